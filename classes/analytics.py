@@ -0,0 +1,194 @@
+import datetime
+import statistics
+
+import numpy as np
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from .models import Student
+
+
+PERCENTILES = (10, 25, 50, 75, 90)
+OUTLIER_Z = 2.0
+FETCH_CHUNK_SIZE = 5000
+
+
+class Cohort:
+    """
+    Column arrays of every student in a queryset: grade, age in years at
+    `as_of`, and the classroom id, subject and year each one belongs to.
+    """
+
+    def __init__(self, students=None, as_of=None):
+        if students is None:
+            students = Student.objects.active()
+        self.as_of = as_of or datetime.date.today()
+
+        rows = (
+            students.order_by()
+            .values_list(
+                Cast('exam_grade', FloatField()), 'date_of_birth',
+                'classroom_id', 'classroom__subject', 'classroom__year',
+            )
+            .iterator(chunk_size=FETCH_CHUNK_SIZE)
+        )
+        columns = list(zip(*rows)) or [()] * 5
+        grades, births, classrooms, subjects, years = columns
+
+        self.grades = np.array(grades, dtype=np.float64)
+        born = np.array(births, dtype='datetime64[D]')
+        self.ages = (np.datetime64(self.as_of, 'D') - born).astype(np.float64) / 365.25
+        self.classrooms = np.array(classrooms, dtype=np.int64)
+        self.subjects = np.array(subjects, dtype=object)
+        self.years = np.array(years, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.grades)
+
+
+def describe(values):
+    if not len(values):
+        return {'count': 0}
+    summary = {
+        'count': int(len(values)),
+        'mean': float(values.mean()),
+        'std': float(values.std()),
+        'min': float(values.min()),
+        'max': float(values.max()),
+    }
+    for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary['p%d' % percentile] = float(value)
+    return summary
+
+
+def group_stats(keys, values):
+    """
+    Count, mean, standard deviation and percentiles of `values` for every
+    distinct key, computed for all groups at once: bincount for the
+    moments and one lexsort for the percentiles.
+    """
+    if not len(values):
+        return {}
+    groups, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse)
+    means = np.bincount(inverse, weights=values) / counts
+    variances = np.bincount(inverse, weights=values * values) / counts - means * means
+    stds = np.sqrt(np.maximum(variances, 0))
+
+    ordered = values[np.lexsort((values, inverse))]
+    starts = np.cumsum(counts) - counts
+    percentiles = {}
+    for percentile in PERCENTILES:
+        # Same linear interpolation as np.percentile, for every group at once.
+        position = starts + (counts - 1) * percentile / 100.0
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        weight = position - lower
+        percentiles[percentile] = ordered[lower] * (1 - weight) + ordered[upper] * weight
+
+    return {
+        _key(group): dict(
+            {'count': int(counts[i]), 'mean': float(means[i]), 'std': float(stds[i])},
+            **{'p%d' % percentile: float(percentiles[percentile][i]) for percentile in PERCENTILES}
+        )
+        for i, group in enumerate(groups)
+    }
+
+
+def z_scores(keys, values):
+    """Each value's z-score within its group; zero where a group has no spread."""
+    if not len(values):
+        return np.zeros(0)
+    _, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse)
+    means = np.bincount(inverse, weights=values) / counts
+    stds = np.sqrt(np.maximum(np.bincount(inverse, weights=values * values) / counts - means * means, 0))
+    spread = stds[inverse]
+    return np.divide(values - means[inverse], spread, out=np.zeros_like(values), where=spread > 0)
+
+
+def correlation(x, y):
+    if len(x) < 2 or x.std() == 0 or y.std() == 0:
+        return None
+    return float(np.corrcoef(x, y)[0, 1])
+
+
+def _key(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def cohort_report(cohort):
+    """End-of-term analytics for a whole cohort."""
+    z = z_scores(cohort.classrooms, cohort.grades)
+    subject_year = np.array(['%s %d' % pair for pair in zip(cohort.subjects, cohort.years)], dtype=object)
+    return {
+        'as_of': cohort.as_of.isoformat(),
+        'overall': describe(cohort.grades),
+        'by_subject': group_stats(cohort.subjects, cohort.grades),
+        'by_year': group_stats(cohort.years, cohort.grades),
+        'by_subject_year': group_stats(subject_year, cohort.grades),
+        'outliers': int(np.count_nonzero(np.abs(z) >= OUTLIER_Z)),
+        'grade_age_correlation': correlation(cohort.ages, cohort.grades),
+    }
+
+
+def naive_report(students=None, as_of=None):
+    """
+    The same report computed one ORM object at a time, kept as the
+    baseline for the analytics benchmark.
+    """
+    if students is None:
+        students = Student.objects.active()
+    as_of = as_of or datetime.date.today()
+
+    grades, ages = [], []
+    by_subject, by_year, by_subject_year, by_classroom = {}, {}, {}, {}
+    for student in students.select_related('classroom'):
+        grade = float(student.exam_grade)
+        grades.append(grade)
+        ages.append((as_of - student.date_of_birth).days / 365.25)
+        classroom = student.classroom
+        by_subject.setdefault(classroom.subject, []).append(grade)
+        by_year.setdefault(classroom.year, []).append(grade)
+        by_subject_year.setdefault('%s %d' % (classroom.subject, classroom.year), []).append(grade)
+        by_classroom.setdefault(classroom.id, []).append(grade)
+
+    def summary(values):
+        ordered = sorted(values)
+        result = {
+            'count': len(values),
+            'mean': statistics.mean(values),
+            'std': statistics.pstdev(values),
+        }
+        for percentile in PERCENTILES:
+            position = (len(ordered) - 1) * percentile / 100.0
+            lower = int(position)
+            upper = min(lower + 1, len(ordered) - 1)
+            result['p%d' % percentile] = ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+        return result
+
+    outliers = 0
+    for values in by_classroom.values():
+        mean, std = statistics.mean(values), statistics.pstdev(values)
+        if std:
+            outliers += sum(1 for value in values if abs(value - mean) / std >= OUTLIER_Z)
+
+    overall = {'count': 0}
+    if grades:
+        overall = dict(summary(grades), min=min(grades), max=max(grades))
+
+    correlation_value = None
+    if len(grades) > 1 and statistics.pstdev(grades) and statistics.pstdev(ages):
+        mean_grade, mean_age = statistics.mean(grades), statistics.mean(ages)
+        covariance = sum((g - mean_grade) * (a - mean_age) for g, a in zip(grades, ages)) / len(grades)
+        correlation_value = covariance / (statistics.pstdev(grades) * statistics.pstdev(ages))
+
+    return {
+        'as_of': as_of.isoformat(),
+        'overall': overall,
+        'by_subject': {key: summary(values) for key, values in by_subject.items()},
+        'by_year': {key: summary(values) for key, values in by_year.items()},
+        'by_subject_year': {key: summary(values) for key, values in by_subject_year.items()},
+        'outliers': outliers,
+        'grade_age_correlation': correlation_value,
+    }
@@ -0,0 +1,309 @@
+import json
+import os
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseBadRequest, JsonResponse
+
+from .conditional import classrooms_state, conditional
+from .forms import BulkGradeForm, StudentForm
+from .grades import set_grades
+from .jobs import job_status
+from .models import Classroom, Job, Student
+from .pagination import InvalidCursor, get_page_size, keyset_page, keyset_window
+
+
+# Every API field and the values() lookups it is read from.
+CLASSROOM_FIELDS = {
+    'id': ('id',),
+    'name': ('name',),
+    'subject': ('subject',),
+    'year': ('year',),
+    'teacher_id': ('teacher_id',),
+    'students': ('stats__count',),
+    'average_grade': ('stats__total', 'stats__count'),
+    'updated_at': ('updated_at',),
+}
+STUDENT_FIELDS = {
+    'id': ('id',),
+    'name': ('name',),
+    'date_of_birth': ('date_of_birth',),
+    'gender': ('gender',),
+    'exam_grade': ('exam_grade',),
+    'classroom_id': ('classroom_id',),
+    'updated_at': ('updated_at',),
+}
+
+CLASSROOM_ORDERING = ('year', 'name', 'id')
+STUDENT_ORDERING = ('name', 'exam_grade', 'id')
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+def _average(total, count):
+    return total / count if count else None
+
+
+def selected_fields(request, available):
+    """The fields named in ?fields=a,b (all of them by default), in the given order."""
+    if not request.GET.get('fields'):
+        return list(available)
+    fields = request.GET['fields'].split(',')
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise InvalidFields(', '.join(unknown))
+    return fields
+
+
+def serialize(rows, fields, available):
+    results = []
+    for row in rows:
+        item = {}
+        for field in fields:
+            values = [row[lookup] for lookup in available[field]]
+            item[field] = _average(*values) if field == 'average_grade' else values[0]
+        results.append(item)
+    return results
+
+
+def instance_row(instance, available):
+    """The values() row of an already loaded instance, following "a__b" lookups."""
+    row = {}
+    for field in available.values():
+        for lookup in field:
+            value = instance
+            for name in lookup.split('__'):
+                value = getattr(value, name, None)
+            row[lookup] = value
+    return row
+
+
+def lookups(fields, available, ordering=()):
+    needed = list(ordering)
+    for field in fields:
+        needed += [lookup for lookup in available[field] if lookup not in needed]
+    return needed
+
+
+def roster_changed(classroom):
+    """The later of a classroom's own change and its roster's."""
+    stats = getattr(classroom, 'stats', None)
+    if stats is None:
+        return classroom.updated_at
+    return max(classroom.updated_at, stats.updated_at)
+
+
+def unauthorized():
+    return JsonResponse({"detail": "Authentication required"}, status=401)
+
+
+def not_found():
+    return JsonResponse({"detail": "Not found"}, status=404)
+
+
+def forbidden():
+    return JsonResponse({"detail": "Only the teacher of this classroom can change its students"}, status=403)
+
+
+def page_response(request, queryset, ordering, available):
+    try:
+        fields = selected_fields(request, available)
+        rows, next_cursor = keyset_page(
+            queryset.values(*lookups(fields, available, ordering)),
+            ordering,
+            cursor=request.GET.get('after'),
+            size=get_page_size(request, API_PAGE_SIZE, API_MAX_PAGE_SIZE),
+        )
+    except InvalidFields as error:
+        return HttpResponseBadRequest("Unknown fields: %s" % error)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor")
+    return JsonResponse({"results": serialize(rows, fields, available), "next": next_cursor})
+
+
+def object_response(request, row, available, status=200):
+    try:
+        fields = selected_fields(request, available)
+    except InvalidFields as error:
+        return HttpResponseBadRequest("Unknown fields: %s" % error)
+    return JsonResponse(serialize([row], fields, available)[0], status=status)
+
+
+def classroom_list(request):
+    if request.user.is_anonymous:
+        return unauthorized()
+
+    classrooms = Classroom.objects.all()
+    if request.GET.get('mine'):
+        classrooms = classrooms.filter(teacher=request.user)
+
+    size = get_page_size(request, API_PAGE_SIZE, API_MAX_PAGE_SIZE)
+    try:
+        # As in views.classroom_list, only the requested page decides
+        # whether it changed.
+        state = classrooms_state(keyset_window(classrooms, CLASSROOM_ORDERING, request.GET.get('after'), size))
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor")
+    return conditional(
+        request,
+        state,
+        lambda: page_response(request, classrooms.select_related('stats'), CLASSROOM_ORDERING, CLASSROOM_FIELDS),
+        private=True,
+    )
+
+
+def classroom_detail(request, classroom_id):
+    if request.user.is_anonymous:
+        return unauthorized()
+
+    classroom = Classroom.objects.select_related('stats').filter(id=classroom_id).first()
+    if classroom is None:
+        return not_found()
+
+    changed = roster_changed(classroom)
+    return conditional(
+        request,
+        (changed.isoformat(), changed),
+        lambda: object_response(request, instance_row(classroom, CLASSROOM_FIELDS), CLASSROOM_FIELDS),
+        private=True,
+    )
+
+
+def classroom_students(request, classroom_id):
+    """Lists a classroom's students, or with POST adds one."""
+    if request.user.is_anonymous:
+        return unauthorized()
+
+    classroom = Classroom.objects.select_related('stats').filter(id=classroom_id).first()
+    if classroom is None:
+        return not_found()
+
+    if request.method == 'POST':
+        if classroom.teacher_id != request.user.id:
+            return forbidden()
+        return save_student(request, Student(classroom=classroom), status=201)
+
+    changed = roster_changed(classroom)
+    return conditional(
+        request,
+        (changed.isoformat(), changed),
+        lambda: page_response(request, classroom.students.all(), STUDENT_ORDERING, STUDENT_FIELDS),
+        private=True,
+    )
+
+
+def student_detail(request, student_id):
+    """Shows a student, or changes it with PUT or PATCH, or deletes it with DELETE."""
+    if request.user.is_anonymous:
+        return unauthorized()
+
+    student = Student.objects.select_related('classroom').filter(id=student_id).first()
+    if student is None:
+        return not_found()
+
+    if request.method in ('PUT', 'PATCH', 'DELETE'):
+        if student.classroom.teacher_id != request.user.id:
+            return forbidden()
+        if request.method == 'DELETE':
+            student.delete()
+            return HttpResponse(status=204)
+        return save_student(request, student, partial=request.method == 'PATCH')
+
+    return conditional(
+        request,
+        (student.updated_at.isoformat(), student.updated_at),
+        lambda: object_response(request, instance_row(student, STUDENT_FIELDS), STUDENT_FIELDS),
+        private=True,
+    )
+
+
+def classroom_grades(request, classroom_id):
+    """
+    Sets many grades at once from a POSTed {"grades": {"<student id>":
+    "<grade>", ...}} body. Nothing is saved unless every grade is valid.
+    """
+    if request.user.is_anonymous:
+        return unauthorized()
+    if request.method != 'POST':
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+
+    classroom = Classroom.objects.filter(id=classroom_id).first()
+    if classroom is None:
+        return not_found()
+    if classroom.teacher_id != request.user.id:
+        return forbidden()
+
+    try:
+        grades = json.loads(request.body.decode() or '{}').get('grades')
+    except (ValueError, AttributeError):
+        return HttpResponseBadRequest("Invalid JSON")
+    if not isinstance(grades, dict):
+        return HttpResponseBadRequest('Expected {"grades": {"<student id>": "<grade>"}}')
+
+    students = classroom.students.only('id', 'exam_grade', 'classroom_id')
+    form = BulkGradeForm(students, {BulkGradeForm.field_name(key): value for key, value in grades.items()})
+    unknown = set(map(str, grades)) - {str(student.id) for student in form.students}
+    if unknown:
+        return JsonResponse({"errors": {key: ["Not a student of this classroom."] for key in sorted(unknown)}}, status=400)
+    if not form.is_valid():
+        errors = {name[len('grade_'):]: messages for name, messages in form.errors.items()}
+        return JsonResponse({"errors": errors}, status=400)
+    return JsonResponse({"updated": set_grades(classroom, form.grades())})
+
+
+def save_student(request, student, partial=False, status=200):
+    """Validates a JSON body with the same StudentForm the HTML views use."""
+    try:
+        data = json.loads(request.body.decode() or '{}')
+    except ValueError:
+        return HttpResponseBadRequest("Invalid JSON")
+    if not isinstance(data, dict):
+        return HttpResponseBadRequest("Invalid JSON")
+
+    if partial:
+        current = StudentForm(instance=student).initial
+        data = dict(current, **data)
+    form = StudentForm(data, instance=student)
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors.get_json_data()}, status=400)
+
+    student = form.save()
+    return object_response(request, instance_row(student, STUDENT_FIELDS), STUDENT_FIELDS, status=status)
+
+
+def user_job(request, job_id):
+    jobs = Job.objects.all()
+    if not request.user.is_staff:
+        jobs = jobs.filter(owner=request.user)
+    return jobs.filter(id=job_id).first()
+
+
+def job_detail(request, job_id):
+    """The status and progress of a background job, for clients to poll."""
+    if request.user.is_anonymous:
+        return unauthorized()
+
+    job = user_job(request, job_id)
+    if job is None:
+        return not_found()
+    return JsonResponse(job_status(job))
+
+
+def job_download(request, job_id):
+    """The file a finished export job wrote."""
+    if request.user.is_anonymous:
+        return unauthorized()
+
+    job = user_job(request, job_id)
+    if job is None or job.status != Job.SUCCEEDED or job.kind != 'export_students':
+        return not_found()
+    result = json.loads(job.result)
+    path = os.path.join(settings.JOB_FILES_ROOT, result['file'])
+    if not os.path.exists(path):
+        return not_found()
+    response = FileResponse(open(path, 'rb'), content_type=result['content_type'])
+    response['Content-Disposition'] = 'attachment; filename="%s"' % result['filename']
+    return response
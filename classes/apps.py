@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ClassesConfig(AppConfig):
     name = 'classes'
+
+    def ready(self):
+        from . import checks, database, signals
@@ -0,0 +1,300 @@
+import random
+import re
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from .cache import bump_students_version
+from .deletion import purge_classroom
+from .models import Classroom, Student
+from .seeding import DEFAULT_PASSWORD
+
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+class Fixture:
+    """The seeded teachers, one classroom each and some of its students."""
+
+    def __init__(self, password=DEFAULT_PASSWORD, sample_size=50):
+        self.password = password
+        self.teachers = []
+        for teacher in User.objects.filter(classroom__isnull=False).distinct().order_by('id')[:sample_size]:
+            classroom_id = (
+                Classroom.objects.filter(teacher=teacher).order_by('id').values_list('id', flat=True).first()
+            )
+            student_ids = list(
+                Student.objects.filter(classroom_id=classroom_id).order_by('id').values_list('id', flat=True)[:sample_size]
+            )
+            if student_ids:
+                self.teachers.append((teacher, classroom_id, student_ids))
+        if not self.teachers:
+            raise ValueError("There are no classrooms with students to benchmark against.")
+
+
+def classroom_list(client, teacher, classroom_id, student_ids, fixture, rng):
+    return client.get(reverse('classroom-list'))
+
+
+def classroom_detail(client, teacher, classroom_id, student_ids, fixture, rng):
+    return client.get(reverse('classroom-detail', kwargs={'classroom_id': classroom_id}))
+
+
+def classroom_detail_full(client, teacher, classroom_id, student_ids, fixture, rng):
+    # The whole table in one streamed page, read to the end.
+    response = client.get(reverse('classroom-detail', kwargs={'classroom_id': classroom_id}), {'stream': 1})
+    b''.join(response.streaming_content)
+    return response
+
+
+def classroom_detail_revalidate(client, teacher, classroom_id, student_ids, fixture, rng):
+    # A browser revalidating the page it has cached, as after every
+    # back-navigation; it only gets a new page when the roster changed.
+    url = reverse('classroom-detail', kwargs={'classroom_id': classroom_id})
+    etags = client.__dict__.setdefault('etags', {})
+    headers = {'HTTP_IF_NONE_MATCH': etags[url]} if url in etags else {}
+    response = client.get(url, **headers)
+    if response.status_code == 200:
+        etags[url] = response['ETag']
+    return response
+
+
+def classroom_detail_herd(client, teacher, classroom_id, student_ids, fixture, rng):
+    # Every client reads the same classroom while one request in ten
+    # invalidates its cached table, as when results are published.
+    classroom_id = fixture.teachers[0][1]
+    if rng.random() < 0.1:
+        bump_students_version(classroom_id)
+    return client.get(reverse('classroom-detail', kwargs={'classroom_id': classroom_id}))
+
+
+def student_add(client, teacher, classroom_id, student_ids, fixture, rng):
+    return client.post(reverse('student-add', kwargs={'classroom_id': classroom_id}), {
+        'name': 'Benchmark %d' % rng.randrange(10 ** 6),
+        'date_of_birth': '2010-01-01',
+        'gender': 'FEMALE',
+        'exam_grade': rng.randrange(100),
+    })
+
+
+def student_update(client, teacher, classroom_id, student_ids, fixture, rng):
+    student_id = rng.choice(student_ids)
+    return client.post(reverse('student-update', kwargs={'student_id': student_id, 'classroom_id': classroom_id}), {
+        'name': 'Benchmark %d' % student_id,
+        'date_of_birth': '2010-01-01',
+        'gender': 'MALE',
+        'exam_grade': rng.randrange(100),
+    })
+
+
+def mixed(client, teacher, classroom_id, student_ids, fixture, rng):
+    # Mostly reads with one write in five, so readers and writers contend.
+    if rng.random() < 0.2:
+        return student_update(client, teacher, classroom_id, student_ids, fixture, rng)
+    return classroom_detail(client, teacher, classroom_id, student_ids, fixture, rng)
+
+
+def signin(client, teacher, classroom_id, student_ids, fixture, rng):
+    return client.post(reverse('signin'), {'username': teacher.username, 'password': fixture.password})
+
+
+SCENARIOS = {
+    'classroom_list': classroom_list,
+    'classroom_detail': classroom_detail,
+    'classroom_detail_full': classroom_detail_full,
+    'classroom_detail_herd': classroom_detail_herd,
+    'classroom_detail_revalidate': classroom_detail_revalidate,
+    'student_add': student_add,
+    'student_update': student_update,
+    'mixed': mixed,
+    'signin': signin,
+}
+
+# Sign in set-ups compared by `benchmark --compare-auth`: where sessions
+# live, and a cheaper password hash (rehashed on each teacher's first sign
+# in) to show what the hasher's work factor costs.
+AUTH_CONFIGURATIONS = {
+    'db': {'SESSION_ENGINE': 'django.contrib.sessions.backends.db'},
+    'cached_db': {'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db'},
+    'cache': {'SESSION_ENGINE': 'django.contrib.sessions.backends.cache'},
+    'signed_cookies': {'SESSION_ENGINE': 'django.contrib.sessions.backends.signed_cookies'},
+    'cached_db-30k': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db',
+        'PASSWORD_HASH_ITERATIONS': 30000,
+    },
+}
+
+# What SQLite does with no tuning at all: a rollback journal, fully synced
+# commits and a new connection for every request.
+UNTUNED_PRAGMAS = {'journal_mode': 'delete', 'synchronous': 'full'}
+
+
+@contextmanager
+def database_tuning(enabled):
+    """
+    Runs the block with the configured SQLITE_PRAGMAS and CONN_MAX_AGE, or
+    with SQLite's defaults and no persistent connections. Connections are
+    closed on the way in so that the next ones pick the setting up.
+    """
+    database = connections.databases['default']
+    old_max_age = database.get('CONN_MAX_AGE', 0)
+    pragmas = {} if enabled else {'SQLITE_PRAGMAS': UNTUNED_PRAGMAS}
+    with override_settings(**pragmas):
+        if not enabled:
+            database['CONN_MAX_AGE'] = 0
+        connections.close_all()
+        try:
+            yield
+        finally:
+            database['CONN_MAX_AGE'] = old_max_age
+            connections.close_all()
+
+
+@contextmanager
+def template_mode(mode):
+    """Runs the block with the cached template loader ('production') or without it ('development')."""
+    loaders = ['django.template.loaders.app_directories.Loader']
+    if mode == 'production':
+        loaders = [('django.template.loaders.cached.Loader', loaders)]
+    backend = dict(settings.TEMPLATES[0], OPTIONS=dict(settings.TEMPLATES[0]['OPTIONS'], loaders=loaders))
+    with override_settings(TEMPLATES=[backend] + settings.TEMPLATES[1:]):
+        yield
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, queries, errors, elapsed):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'elapsed_s': elapsed,
+        'throughput_rps': count / elapsed if elapsed else None,
+        'mean_ms': sum(latencies) / count * 1000 if count else None,
+        'p50_ms': percentile(latencies, 0.50) * 1000 if count else None,
+        'p95_ms': percentile(latencies, 0.95) * 1000 if count else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if count else None,
+        'avg_queries': sum(queries) / len(queries) if queries else None,
+        'max_queries': max(queries) if queries else None,
+    }
+
+
+def run_scenario(name, fixture, requests, concurrency=1, seed=0):
+    """
+    Sends `requests` requests of scenario `name` spread over `concurrency`
+    threads, each with its own logged-in client, and summarizes them.
+    """
+    scenario = SCENARIOS[name]
+    lock = threading.Lock()
+    latencies = []
+    queries = []
+    errors = [0]
+
+    def worker(number, count):
+        rng = random.Random(seed * 1000 + number)
+        teacher, classroom_id, student_ids = fixture.teachers[number % len(fixture.teachers)]
+        client = Client()
+        if name != 'signin':
+            client.force_login(teacher)
+        for _ in range(count):
+            start = time.perf_counter()
+            try:
+                response = scenario(client, teacher, classroom_id, student_ids, fixture, rng)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            latency = time.perf_counter() - start
+            match = SERVER_TIMING_QUERIES.search(response.get('Server-Timing', ''))
+            with lock:
+                if response.status_code >= 400:
+                    errors[0] += 1
+                    continue
+                latencies.append(latency)
+                if match:
+                    queries.append(int(match.group(1)))
+
+    shares = [requests // concurrency + (1 if n < requests % concurrency else 0) for n in range(concurrency)]
+    start = time.perf_counter()
+    if concurrency == 1:
+        worker(0, shares[0])
+    else:
+        def threaded_worker(number):
+            try:
+                worker(number, shares[number])
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(threaded_worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return summarize(latencies, queries, errors[0], elapsed)
+
+
+def _cascade_delete(classroom):
+    _, deleted = classroom.delete()
+    return deleted.get(Student._meta.label, 0)
+
+
+# Ways of deleting a whole classroom: Django's collector, which loads every
+# student and sends its signals, and deletion.purge_classroom.
+DELETE_STRATEGIES = {
+    'cascade': _cascade_delete,
+    'fast': purge_classroom,
+}
+
+
+def run_delete(strategy, classrooms):
+    """
+    Deletes each of `classrooms` with `strategy` and summarizes the time,
+    queries and (with tracemalloc, so for the first classroom only, which
+    is left out of the timings) peak Python memory it took.
+    """
+    delete = DELETE_STRATEGIES[strategy]
+    queries = [0]
+
+    def count(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    latencies, counts, students, peak = [], [], 0, None
+    with connection.execute_wrapper(count):
+        for number, classroom in enumerate(classrooms):
+            traced = number == 0 and len(classrooms) > 1
+            if traced:
+                tracemalloc.start()
+            queries[0] = 0
+            start = time.perf_counter()
+            deleted = delete(classroom)
+            elapsed = time.perf_counter() - start
+            if traced:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                continue
+            latencies.append(elapsed)
+            counts.append(queries[0])
+            students += deleted
+
+    elapsed = sum(latencies)
+    result = summarize(latencies, counts, 0, elapsed)
+    result['students'] = students
+    result['students_per_s'] = students / elapsed if elapsed else None
+    result['peak_kib'] = peak / 1024 if peak is not None else None
+    return result
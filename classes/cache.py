@@ -0,0 +1,131 @@
+import threading
+import time
+
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+
+FRAGMENT_CACHE = 'fragments'
+
+# Seconds a request waits for another request that is already rendering
+# the same missing page before it gives up and renders the page itself.
+COALESCE_TIMEOUT = 5
+# Seconds between looks at the cache while waiting.
+COALESCE_POLL = 0.02
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+
+
+def fragment_cache():
+    return caches[FRAGMENT_CACHE]
+
+
+def _version(key):
+    # A missing (never set or evicted) version starts from the clock rather
+    # than from 1, so fragments left over from an older counter are never hit.
+    cache = fragment_cache()
+    version = cache.get(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def _bump(key):
+    try:
+        fragment_cache().incr(key)
+    except ValueError:
+        _version(key)
+
+
+def students_version(classroom_id):
+    return _version('students-version:%s' % classroom_id)
+
+
+def bump_students_version(classroom_id):
+    _bump('students-version:%s' % classroom_id)
+
+
+def year_version(year):
+    """Changes whenever any rank in the year may have moved."""
+    return _version('year-version:%s' % year)
+
+
+def bump_year_version(year):
+    _bump('year-version:%s' % year)
+
+
+def _record(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    served = stats['hits'] + stats['coalesced']
+    lookups = served + stats['misses']
+    stats['hit_ratio'] = served / lookups if lookups else None
+    return stats
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def cached_student_rows(classroom, year_state, page_key, load_page):
+    """
+    Returns (rows_html, next_cursor) for one page of the student table.
+    `year_state` is the version conditional.classrooms_state gives the
+    classroom's year. `load_page` is only called on a miss and must return
+    (students, next_cursor).
+    """
+    cache = fragment_cache()
+    # The table shows ranks within the whole year, so a write anywhere in
+    # the year invalidates it too. The version counters are bumped in the
+    # writing process's cache only, which with a per-process backend other
+    # processes never see; the year's state comes from the database, so it
+    # moves for them all.
+    key = 'students:%s:%s:%s:%s:%s' % (
+        classroom.id, year_state, students_version(classroom.id), year_version(classroom.year), page_key,
+    )
+    cached = cache.get(key)
+    if cached is not None:
+        _record('hits')
+        rows, next_cursor = cached
+        return mark_safe(rows), next_cursor
+
+    # Single flight: when a popular page expires, only the first request
+    # renders it and the concurrent ones wait for its result instead of all
+    # hitting the database at once. The lock is an add() to the fragment
+    # cache, so with a shared backend it holds across processes too; it
+    # expires on its own if its holder dies.
+    lock_key = 'loading:%s' % key
+    leader = cache.add(lock_key, True, timeout=COALESCE_TIMEOUT)
+    if not leader:
+        deadline = time.monotonic() + COALESCE_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(COALESCE_POLL)
+            cached = cache.get(key)
+            if cached is not None:
+                _record('coalesced')
+                rows, next_cursor = cached
+                return mark_safe(rows), next_cursor
+            if cache.get(lock_key) is None:
+                # The leader failed without caching anything.
+                break
+
+    _record('misses')
+    try:
+        students, next_cursor = load_page()
+        rows = render_to_string('student_rows.html', {"classroom": classroom, "students": students})
+        cache.set(key, (str(rows), next_cursor))
+    finally:
+        if leader:
+            cache.delete(lock_key)
+    return mark_safe(rows), next_cursor
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+
+CACHED_SESSION_ENGINES = {
+    'django.contrib.sessions.backends.cache',
+    'django.contrib.sessions.backends.cached_db',
+}
+
+
+@register()
+def check_session_cache(app_configs, **kwargs):
+    """Cached sessions need a cache all the worker processes share."""
+    if settings.SESSION_ENGINE not in CACHED_SESSION_ENGINES:
+        return []
+    backend = settings.CACHES.get(settings.SESSION_CACHE_ALIAS, {}).get('BACKEND')
+    if backend in settings.SHARED_CACHE_BACKENDS:
+        return []
+    return [Error(
+        "%s keeps sessions in the %r cache, whose %s backend is not shared between processes, "
+        "so a session signed out on one worker stays signed in on the others." % (
+            settings.SESSION_ENGINE, settings.SESSION_CACHE_ALIAS, backend,
+        ),
+        hint="Use SESSION_BACKEND=db, or point SESSION_CACHE_BACKEND at memcached or redis.",
+        id='classes.E001',
+    )]
@@ -0,0 +1,61 @@
+import calendar
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def _timestamp(value):
+    return calendar.timegm(value.utctimetuple()) if value else None
+
+
+def classrooms_state(classrooms):
+    """
+    The (version, last modified) pair of a queryset of classrooms from one
+    aggregate: a new, changed or deleted classroom or roster moves the
+    count, the id sum or the latest change. All three go in the version
+    and there is no last modified, since a classroom leaving the set does
+    not move the latest change, and If-Modified-Since would then answer
+    304 for a page that lost a row.
+    """
+    state = classrooms.annotate(
+        changed=Greatest('updated_at', Coalesce('stats__updated_at', 'updated_at')),
+    ).aggregate(count=Count('id'), ids=Sum('id'), last_modified=Max('changed'))
+    last_modified = state['last_modified'].isoformat() if state['last_modified'] else ''
+    return '%s-%s-%s' % (state['count'], state['ids'], last_modified), None
+
+
+def conditional(request, state, build, private=False):
+    """
+    Answers 304 Not Modified when the client's ETag or Last-Modified still
+    matches `state`, a (version, last modified) pair of which at least one
+    changes whenever the response would. Otherwise calls build() for the
+    response. The ETag also covers the query string, since fields and
+    cursors change the body.
+
+    Pages that differ per user are `private`: their ETag also covers the
+    user, and they are only cached by the browser, which revalidates them
+    on every use. A page with messages waiting to be shown is always
+    rendered, since showing them is what uses them up.
+    """
+    if private and len(get_messages(request)):
+        return build()
+
+    version, last_modified = state
+    key = '%s|%s|%s' % (version, last_modified.isoformat() if last_modified else '', request.GET.urlencode())
+    if private:
+        key += '|%s' % request.user.pk
+    etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+    response = get_conditional_response(request, etag=etag, last_modified=_timestamp(last_modified))
+    if response is None:
+        response = build()
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(_timestamp(last_modified))
+    if private:
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie',))
+    return response
@@ -0,0 +1,120 @@
+import random
+import sqlite3
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Applies settings.SQLITE_PRAGMAS to every new SQLite connection. They
+    run on the raw connection so they are not counted as the request's
+    queries.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = dict(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    journal_mode = pragmas.pop('journal_mode', None)
+    # busy_timeout goes first so the pragmas below wait for other writers.
+    if 'busy_timeout' in pragmas:
+        connection.connection.execute('PRAGMA busy_timeout = %s' % pragmas.pop('busy_timeout'))
+    for name, value in pragmas.items():
+        connection.connection.execute('PRAGMA %s = %s' % (name, value))
+    if journal_mode is not None:
+        set_journal_mode(connection, journal_mode)
+
+
+def set_journal_mode(connection, mode):
+    # The journal mode is stored in the database file, so it usually only
+    # has to be read. Changing it needs the database to itself; while other
+    # connections hold it the old mode stays until a later connection.
+    current = connection.connection.execute('PRAGMA journal_mode').fetchone()[0]
+    if current.lower() == mode.lower():
+        return
+    try:
+        connection.connection.execute('PRAGMA journal_mode = %s' % mode)
+    except connection.Database.OperationalError:
+        pass
+
+
+# Read-your-writes: once a request writes, it and the same client's
+# requests for READ_YOUR_WRITES_SECONDS read from the primary, which the
+# replicas may not have caught up with yet.
+PIN_COOKIE = 'pin_primary'
+# Sessions are written on sign in and read on the very next request, so
+# they never come from a replica.
+PRIMARY_ONLY_APPS = {'sessions'}
+
+_local = threading.local()
+
+
+def replica_databases():
+    return getattr(settings, 'REPLICA_DATABASES', [])
+
+
+def pin_reads(pinned=True):
+    """Sends this thread's reads to the primary (or lets them go to replicas again)."""
+    _local.pinned = pinned
+    _local.wrote = False
+
+
+def reads_pinned():
+    return getattr(_local, 'pinned', False)
+
+
+def wrote():
+    """Whether this thread has written since pin_reads() was last called."""
+    return getattr(_local, 'wrote', False)
+
+
+class ReplicaRouter:
+    """
+    Sends writes to the primary ('default') and reads to a random one of
+    settings.REPLICA_DATABASES, except when reads are pinned to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = replica_databases()
+        if not replicas or reads_pinned() or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # Later reads in the same thread must see this write.
+        _local.pinned = _local.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, *replica_databases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary and get its schema with it.
+        return db not in replica_databases()
+
+
+def sync_replicas(aliases=None):
+    """
+    Copies the primary SQLite database over each replica with SQLite's
+    online backup, which is consistent even while the primary is written
+    to. Returns the aliases copied.
+    """
+    primary = connections[DEFAULT_DB_ALIAS]
+    primary.ensure_connection()
+    aliases = aliases or replica_databases()
+    for alias in aliases:
+        replica = connections[alias]
+        replica.close()
+        target = sqlite3.connect(replica.settings_dict['NAME'])
+        try:
+            primary.connection.backup(target)
+        finally:
+            target.close()
+    return aliases
@@ -0,0 +1,119 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .cache import bump_students_version, bump_year_version
+from .grades import RERANK_THRESHOLD
+from .models import Classroom, Student, StudentRank
+from .ranking import move_student, rebuild_rankings
+from .search import index_classroom, index_classroom_students, unindex_classroom, unindex_classroom_students
+
+
+# Students removed per DELETE statement, and per transaction, when a
+# classroom is purged.
+DELETE_CHUNK_SIZE = 2000
+
+# Models pointing at Student whose rows purge_classroom deletes itself.
+CLASSROOM_WIDE_RELATIONS = {StudentRank}
+
+STUDENT_TABLE = Student._meta.db_table
+
+
+def can_fast_delete():
+    """
+    Whether students can be deleted with plain DELETE statements: only
+    when every model pointing at Student is one purge_classroom clears
+    itself.
+    """
+    relations = {
+        field.related_model for field in Student._meta.get_fields()
+        if field.auto_created and not field.concrete
+    }
+    return relations <= CLASSROOM_WIDE_RELATIONS
+
+
+def archive_classroom(classroom):
+    """
+    Soft-deletes a classroom: it drops out of Classroom.objects, and its
+    students out of the rankings, the search index and every cross
+    classroom listing, but nothing is deleted, so restore_classroom can
+    bring it all back.
+    """
+    with transaction.atomic():
+        # update() skips auto_now, and the year's detail pages use the
+        # latest change to tell that its ranks moved.
+        now = timezone.now()
+        Classroom.all_objects.filter(id=classroom.id).update(archived_at=now, updated_at=now)
+        ranks = StudentRank.objects.filter(classroom_id=classroom.id)
+        moves = list(ranks.values_list('student_id', 'exam_grade')[:RERANK_THRESHOLD + 1])
+        if len(moves) > RERANK_THRESHOLD:
+            rebuild_rankings([classroom.year])
+        else:
+            for student_id, grade in moves:
+                move_student(student_id, (classroom.id, classroom.year, grade), None)
+            ranks.delete()
+        unindex_classroom_students(classroom.id)
+        unindex_classroom(classroom.id)
+
+    bump_students_version(classroom.id)
+    bump_year_version(classroom.year)
+
+
+def restore_classroom(classroom):
+    """Undoes archive_classroom."""
+    with transaction.atomic():
+        Classroom.all_objects.filter(id=classroom.id).update(archived_at=None, updated_at=timezone.now())
+        rebuild_rankings([classroom.year])
+        index_classroom(classroom)
+        index_classroom_students(classroom.id)
+
+    bump_students_version(classroom.id)
+    bump_year_version(classroom.year)
+
+
+def _delete_student_chunk(classroom_id, chunk_size):
+    # The inner SELECT walks the (classroom, name, grade) index, so each
+    # chunk costs the same however many students are left.
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM %s WHERE id IN (SELECT id FROM %s WHERE classroom_id = %%s LIMIT %%s)' % (
+                STUDENT_TABLE, STUDENT_TABLE,
+            ),
+            [classroom_id, chunk_size],
+        )
+        return cursor.rowcount
+
+
+def purge_classroom(classroom, chunk_size=DELETE_CHUNK_SIZE, progress=None):
+    """
+    Deletes a classroom and its students without loading them: the
+    classroom is archived first, so it disappears at once and its students
+    leave the rankings and the search index, then its students are deleted
+    `chunk_size` at a time, each chunk in its own short transaction so
+    other writers are not held up. Memory use and the number of queries do
+    not grow with the classroom. `progress(deleted)` is called after every
+    chunk. Like QuerySet.update(), it sends no signal per student. Falls
+    back to Django's cascade, which fetches every student, when another
+    model points at Student (see can_fast_delete). Returns the number of
+    students deleted.
+    """
+    if not can_fast_delete():
+        _, deleted = classroom.delete()
+        return deleted.get(Student._meta.label, 0)
+
+    if classroom.archived_at is None:
+        archive_classroom(classroom)
+    else:
+        # Catches any rank written since the classroom was archived, which
+        # would otherwise block deleting its student.
+        StudentRank.objects.filter(classroom_id=classroom.id).delete()
+    deleted = 0
+    while True:
+        removed = _delete_student_chunk(classroom.id, chunk_size)
+        deleted += removed
+        if removed and progress is not None:
+            progress(deleted)
+        if removed < chunk_size:
+            break
+    # Only the classroom and its stats remain for the cascade.
+    classroom.delete()
+    return deleted
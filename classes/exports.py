@@ -0,0 +1,121 @@
+import csv
+import json
+import zlib
+
+from django.http import StreamingHttpResponse
+
+from .pagination import keyset_chunks
+
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_ORDERING = ('classroom_id', 'name', 'exam_grade', 'id')
+
+EXPORT_COLUMNS = (
+    ('classroom_id', 'classroom_id'),
+    ('classroom', 'classroom__name'),
+    ('subject', 'classroom__subject'),
+    ('year', 'classroom__year'),
+    ('student_id', 'id'),
+    ('name', 'name'),
+    ('date_of_birth', 'date_of_birth'),
+    ('gender', 'gender'),
+    ('exam_grade', 'exam_grade'),
+)
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+class Echo:
+    """A file-like object whose write() hands the line straight back."""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(students, chunk_size=EXPORT_CHUNK_SIZE):
+    fields = [field for _, field in EXPORT_COLUMNS]
+    for chunk in keyset_chunks(students.values(*fields), EXPORT_ORDERING, chunk_size):
+        for row in chunk:
+            yield [row[field] for field in fields]
+
+
+def iter_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow([header for header, _ in EXPORT_COLUMNS])
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_ndjson(rows):
+    headers = [header for header, _ in EXPORT_COLUMNS]
+    for row in rows:
+        yield json.dumps(dict(zip(headers, row)), default=str) + '\n'
+
+
+def iter_batched(chunks, size=64 * 1024):
+    """Joins small chunks so the server writes ~`size` characters at a time."""
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= size:
+            yield ''.join(pending)
+            pending = []
+            pending_size = 0
+    if pending:
+        yield ''.join(pending)
+
+
+def iter_gzip(chunks):
+    # wbits=31 writes a gzip header and trailer around the deflate stream.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(rows, export_format='csv', gzip=False):
+    """The encoded file for `rows`, with its content type and extension."""
+    content_type, extension = EXPORT_FORMATS[export_format]
+    chunks = iter_batched(iter_csv(rows) if export_format == 'csv' else iter_ndjson(rows))
+    if gzip:
+        return iter_gzip(chunks), 'application/gzip', extension + '.gz'
+    return (chunk.encode() for chunk in chunks), content_type, extension
+
+
+def export_response(students, filename, export_format='csv', gzip=False):
+    """
+    Streams every student in `students` as CSV or NDJSON, optionally
+    gzipped, without ever holding more than one fetch chunk in memory.
+    """
+    chunks, content_type, extension = export_chunks(export_rows(students), export_format, gzip)
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (filename, extension)
+    return response
+
+
+def write_export(students, path, export_format='csv', gzip=False, progress=None):
+    """
+    Writes the export of `students` to the file at `path`, calling
+    `progress(rows)` after every fetch chunk. Returns the content type and
+    extension of the file.
+    """
+    def rows():
+        written = 0
+        for row in export_rows(students):
+            yield row
+            written += 1
+            if progress is not None and written % EXPORT_CHUNK_SIZE == 0:
+                progress(written)
+
+    chunks, content_type, extension = export_chunks(rows(), export_format, gzip)
+    with open(path, 'wb') as handle:
+        for chunk in chunks:
+            handle.write(chunk)
+    return content_type, extension
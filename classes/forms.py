@@ -19,6 +19,39 @@ class StudentForm(forms.ModelForm):
         
 
 
+class StudentImportForm(forms.Form):
+    file = forms.FileField(help_text="A .csv or .xlsx file with a header row of student fields.")
+
+
+class BulkGradeForm(forms.Form):
+    """
+    One optional grade field per student, validated like
+    Student.exam_grade. Blank fields leave the grade as it is.
+    """
+
+    def __init__(self, students, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.students = list(students)
+        for student in self.students:
+            field = Student._meta.get_field('exam_grade').formfield(required=False)
+            field.initial = student.exam_grade
+            self.fields[self.field_name(student.id)] = field
+
+    @staticmethod
+    def field_name(student_id):
+        return 'grade_%s' % student_id
+
+    def rows(self):
+        return [(student, self[self.field_name(student.id)]) for student in self.students]
+
+    def grades(self):
+        return {
+            student.id: self.cleaned_data[self.field_name(student.id)]
+            for student in self.students
+            if self.cleaned_data.get(self.field_name(student.id)) is not None
+        }
+
+
 class SignupForm(forms.ModelForm):
     class Meta:
         model = User
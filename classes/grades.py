@@ -0,0 +1,71 @@
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from .cache import bump_students_version, bump_year_version
+from .models import Student
+from .ranking import move_student, rebuild_rankings
+from .stats import apply_grade_changes
+
+
+GRADE_FIELD = Student._meta.get_field('exam_grade')
+# Each WHEN binds two parameters, so this stays under SQLite's 999.
+UPDATE_BATCH_SIZE = 200
+# Above this many changes re-ranking the whole year beats moving each student.
+RERANK_THRESHOLD = 20
+
+
+def grade_updates(grades):
+    """The UPDATEs for a {student id: grade} map, UPDATE_BATCH_SIZE students each."""
+    items = sorted(grades.items())
+    now = timezone.now()
+    for start in range(0, len(items), UPDATE_BATCH_SIZE):
+        batch = items[start:start + UPDATE_BATCH_SIZE]
+        grade = Case(
+            *[When(id=student_id, then=Value(value)) for student_id, value in batch],
+            output_field=GRADE_FIELD
+        )
+        yield [student_id for student_id, _ in batch], {'exam_grade': grade, 'updated_at': now}
+
+
+def set_grades(classroom, grades):
+    """
+    Sets the exam grade of many of the classroom's students at once, with
+    one UPDATE per UPDATE_BATCH_SIZE students, and brings the stats, ranks
+    and cached tables up to date once for the whole batch. `grades` maps
+    student ids to already validated grades; ids of other classrooms are
+    ignored. Returns the number of grades that changed.
+    """
+    with transaction.atomic():
+        current = dict(
+            Student.objects.filter(classroom=classroom).values_list('id', 'exam_grade').select_for_update()
+        )
+        changed = {
+            student_id: grade for student_id, grade in grades.items()
+            if student_id in current and current[student_id] != grade
+        }
+        if not changed:
+            return 0
+
+        for student_ids, values in grade_updates(changed):
+            Student.objects.filter(classroom=classroom, id__in=student_ids).update(**values)
+
+        # update() skips the signals that maintain the stats and ranks.
+        apply_grade_changes(
+            classroom.id,
+            added=list(changed.values()),
+            removed=[current[student_id] for student_id in changed],
+        )
+        if len(changed) > RERANK_THRESHOLD:
+            rebuild_rankings([classroom.year])
+        else:
+            for student_id, grade in changed.items():
+                move_student(
+                    student_id,
+                    (classroom.id, classroom.year, current[student_id]),
+                    (classroom.id, classroom.year, grade),
+                )
+
+    bump_students_version(classroom.id)
+    bump_year_version(classroom.year)
+    return len(changed)
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class TunablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2-SHA256 hasher with its work factor read from
+    settings.PASSWORD_HASH_ITERATIONS. Stored hashes keep their own
+    iteration count, so changing the setting breaks no password: a
+    password with another count is rehashed the next time its owner signs
+    in.
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS', PBKDF2PasswordHasher.iterations)
@@ -0,0 +1,124 @@
+import csv
+import io
+import zipfile
+from contextlib import ExitStack
+
+from django.db import transaction
+
+from .cache import bump_students_version, bump_year_version
+from .forms import StudentForm
+from .models import Student
+from .ranking import rebuild_rankings
+from .search import index_students_after
+from .seeding import last_pk
+from .stats import add_grades
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def iter_csv_rows(upload):
+    text = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    try:
+        for row in csv.DictReader(text):
+            yield row
+    except (csv.Error, UnicodeDecodeError) as error:
+        raise ImportFormatError("The file is not a valid UTF-8 CSV file: %s" % error)
+
+
+def iter_xlsx_rows(upload):
+    if openpyxl is None:
+        raise ImportFormatError("XLSX import requires the openpyxl package.")
+    try:
+        workbook = openpyxl.load_workbook(upload, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, openpyxl.utils.exceptions.InvalidFileException) as error:
+        raise ImportFormatError("The file is not a valid XLSX workbook: %s" % error)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+        for values in rows:
+            yield {
+                name: value
+                for name, value in zip(header, values)
+                if name and value is not None
+            }
+    finally:
+        workbook.close()
+
+
+def iter_rows(upload):
+    name = upload.name.lower()
+    if name.endswith('.csv'):
+        return iter_csv_rows(upload)
+    if name.endswith('.xlsx'):
+        return iter_xlsx_rows(upload)
+    raise ImportFormatError("Only .csv and .xlsx files can be imported.")
+
+
+def import_students(classroom, rows, batch_size=IMPORT_BATCH_SIZE, checkpoint=None, resume=None):
+    """
+    Validates every row with StudentForm and inserts the valid ones with
+    bulk_create every `batch_size` rows, all inside one transaction. Only one batch of
+    students is held in memory at a time; at most MAX_REPORTED_ERRORS row
+    errors are kept for the report.
+
+    With `checkpoint`, every batch is instead its own transaction, and
+    `checkpoint(rows_read, report)` is called inside it, so what it records
+    commits together with the batch. Passing those back as `resume`, a
+    (rows_read, report) pair, skips the rows already imported.
+    """
+    skip, report = resume or (0, None)
+    report = report or {"created": 0, "error_count": 0, "errors": []}
+    batch = []
+    number = 1
+
+    def flush():
+        with transaction.atomic() if checkpoint is not None else ExitStack():
+            if batch:
+                last_student_id = last_pk(Student)
+                Student.objects.bulk_create(batch)
+                add_grades(classroom.id, [student.exam_grade for student in batch])
+                index_students_after(last_student_id)
+                report["created"] += len(batch)
+                batch.clear()
+            if checkpoint is not None:
+                checkpoint(number - 1, report)
+
+    with transaction.atomic() if checkpoint is None else ExitStack():
+        # Row 1 is the header, so data rows are numbered from 2 like a spreadsheet.
+        for number, row in enumerate(rows, start=2):
+            if number - 1 <= skip:
+                continue
+            form = StudentForm(row)
+            if not form.is_valid():
+                report["error_count"] += 1
+                if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                    report["errors"].append({"row": number, "errors": form.errors.get_json_data()})
+                continue
+
+            student = form.save(commit=False)
+            student.classroom = classroom
+            batch.append(student)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+        if report["created"]:
+            with transaction.atomic():
+                rebuild_rankings([classroom.year])
+
+    # bulk_create skips post_save, so the stats are updated and the new
+    # students indexed per batch above, the year is re-ranked once, and the
+    # cached tables are invalidated by hand.
+    bump_students_version(classroom.id)
+    bump_year_version(classroom.year)
+    return report
@@ -0,0 +1,270 @@
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db.models import F
+from django.utils import timezone
+
+from .deletion import purge_classroom
+from .exports import write_export
+from .imports import ImportFormatError, import_students, iter_rows
+from .models import Classroom, Job, Student
+from .stats import rebuild_stats
+
+
+logger = logging.getLogger(__name__)
+
+# Candidates looked at per claim before giving up to another worker.
+CLAIM_CANDIDATES = 5
+# Progress is written at most this often (in seconds) while a job runs.
+PROGRESS_INTERVAL = 1.0
+
+TASKS = {}
+
+
+class JobFailed(Exception):
+    """Raised by a task for a failure that retrying cannot fix."""
+
+
+def task(kind):
+    """Registers a function as the handler of the jobs of `kind`."""
+    def register(function):
+        TASKS[kind] = function
+        return function
+    return register
+
+
+def job_path(*names):
+    """A path under JOB_FILES_ROOT, creating its directory."""
+    path = os.path.join(settings.JOB_FILES_ROOT, *names)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def enqueue(kind, owner=None, max_attempts=None, **params):
+    if kind not in TASKS:
+        raise ValueError("Unknown job kind %r" % kind)
+    return Job.objects.create(
+        kind=kind,
+        owner=owner,
+        params=json.dumps(params),
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+        run_after=timezone.now(),
+    )
+
+
+def claim_job(worker):
+    """
+    Marks the oldest due job as running on `worker` and returns it, or
+    None when nothing is due. The claim is a conditional UPDATE, so two
+    workers racing for the same job cannot both win it.
+    """
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_after__lte=now).order_by('run_after', 'id')
+    for job_id in due.values_list('id', flat=True)[:CLAIM_CANDIDATES]:
+        claimed = Job.objects.filter(id=job_id, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, attempts=F('attempts') + 1,
+            started_at=now, updated_at=now,
+        )
+        if claimed:
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def report_progress(job, done, total=None):
+    """Records that `done` of `total` units of `job` are finished."""
+    now = time.monotonic()
+    if total is not None:
+        job.total = total
+    last = getattr(job, '_progress_reported', None)
+    if last is not None and now - last < PROGRESS_INTERVAL and done != job.total:
+        return
+    job._progress_reported = now
+    job.progress = done
+    Job.objects.filter(id=job.id).update(progress=done, total=job.total, updated_at=timezone.now())
+
+
+def retry_delay(attempts):
+    """Seconds before the next attempt; doubles after every failure."""
+    return settings.JOB_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def run_job(job):
+    """
+    Runs a claimed job and records its outcome. A failure is retried after
+    retry_delay() until the job runs out of attempts, unless the task
+    raised JobFailed.
+    """
+    handler = TASKS.get(job.kind)
+    try:
+        if handler is None:
+            raise JobFailed("Unknown job kind %r" % job.kind)
+        result = handler(job, **json.loads(job.params))
+    except Exception as error:
+        now = timezone.now()
+        if isinstance(error, JobFailed):
+            final, message = True, str(error)
+        else:
+            logger.exception("Job %s failed (attempt %d of %d)", job.id, job.attempts, job.max_attempts)
+            final, message = job.attempts >= job.max_attempts, '%s: %s' % (type(error).__name__, error)
+        if final:
+            job.status, job.finished_at = Job.FAILED, now
+        else:
+            job.status, job.run_after = Job.QUEUED, now + timedelta(seconds=retry_delay(job.attempts))
+        job.error = message
+        # Filtered on the attempt, so a run that lost its job to another
+        # worker does not overwrite that worker's outcome.
+        Job.objects.filter(id=job.id, attempts=job.attempts).update(
+            status=job.status, error=message, run_after=job.run_after,
+            finished_at=job.finished_at, updated_at=now,
+        )
+        return job
+
+    job.status, job.finished_at, job.error = Job.SUCCEEDED, timezone.now(), ''
+    job.result = json.dumps(result)
+    if job.total is not None:
+        job.progress = job.total
+    Job.objects.filter(id=job.id, attempts=job.attempts).update(
+        status=job.status, result=job.result, error='', progress=job.progress,
+        finished_at=job.finished_at, updated_at=job.finished_at,
+    )
+    return job
+
+
+def run_claimed_job(job_id):
+    """Runs a job a worker process was handed by the claiming process."""
+    return run_job(Job.objects.get(id=job_id)).status
+
+
+def requeue_stale(seconds=None):
+    """
+    Puts back jobs left running by a worker that died, or fails them when
+    they have no attempts left. Returns how many were found.
+    """
+    seconds = settings.JOB_STALE_SECONDS if seconds is None else seconds
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, updated_at__lt=now - timedelta(seconds=seconds))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, error="The worker stopped.", finished_at=now, updated_at=now,
+    )
+    requeued = stale.update(status=Job.QUEUED, error="The worker stopped.", run_after=now, updated_at=now)
+    return failed + requeued
+
+
+def pending_jobs(kind, **params):
+    """The queued or running jobs of `kind` enqueued with exactly `params`."""
+    return Job.objects.filter(kind=kind, params=json.dumps(params), status__in=(Job.QUEUED, Job.RUNNING))
+
+
+def job_status(job):
+    """The JSON the status endpoint shows for `job`."""
+    result = json.loads(job.result) if job.result else None
+    if isinstance(result, dict):
+        result.pop('file', None)
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'total': job.total,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'error': job.error,
+        'result': result,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
+
+
+def save_upload(upload):
+    """Stores an uploaded file for a job and returns its path."""
+    path = job_path('uploads', '%s-%s' % (uuid.uuid4().hex, os.path.basename(upload.name)))
+    with open(path, 'wb') as handle:
+        for chunk in upload.chunks():
+            handle.write(chunk)
+    return path
+
+
+def checkpoint(job, done, result):
+    """
+    Records `done` and the partial `result` of `job` from inside the
+    transaction of the work they describe, so both commit or neither does.
+    Raises JobFailed when the job has been claimed again since this attempt
+    started (requeue_stale took it for dead), rolling the work back.
+    """
+    job.progress, job.result = done, json.dumps(result)
+    updated = Job.objects.filter(id=job.id, attempts=job.attempts).update(
+        progress=done, result=job.result, updated_at=timezone.now(),
+    )
+    if not updated:
+        raise JobFailed("The job was handed to another worker.")
+
+
+@task('import_students')
+def import_students_job(job, classroom_id, path, filename):
+    # Every batch commits with the number of rows read and the report so
+    # far, and a retry starts after them, so no row is imported twice.
+    classroom = Classroom.objects.filter(id=classroom_id).first()
+    if classroom is None:
+        os.remove(path)
+        raise JobFailed("The classroom no longer exists.")
+    resume = (job.progress, json.loads(job.result)) if job.result else None
+    try:
+        with open(path, 'rb') as handle:
+            report = import_students(
+                classroom, iter_rows(File(handle, name=filename)),
+                checkpoint=lambda done, report: checkpoint(job, done, report), resume=resume,
+            )
+    except ImportFormatError as error:
+        os.remove(path)
+        raise JobFailed(str(error))
+    os.remove(path)
+    report_progress(job, job.progress, job.progress)
+    return report
+
+
+@task('export_students')
+def export_students_job(job, filename, export_format='csv', gzip=False, classroom_id=None, teacher_id=None):
+    students = Student.objects.active()
+    if classroom_id is not None:
+        students = students.filter(classroom_id=classroom_id)
+    if teacher_id is not None:
+        students = students.filter(classroom__teacher_id=teacher_id)
+
+    total = students.count()
+    report_progress(job, 0, total)
+    name = os.path.join('exports', 'job-%d' % job.id)
+    content_type, extension = write_export(
+        students, job_path(name), export_format, gzip, progress=lambda done: report_progress(job, done),
+    )
+    return {
+        'file': name,
+        'filename': '%s.%s' % (filename, extension),
+        'content_type': content_type,
+        'rows': total,
+    }
+
+
+@task('delete_classroom')
+def delete_classroom_job(job, classroom_id):
+    classroom = Classroom.all_objects.select_related('stats').filter(id=classroom_id).first()
+    if classroom is None:
+        return {'deleted': 0}
+    stats = getattr(classroom, 'stats', None)
+    report_progress(job, 0, stats.count if stats is not None else None)
+    deleted = purge_classroom(classroom, progress=lambda done: report_progress(job, done))
+    return {'deleted': deleted}
+
+
+@task('rebuild_stats')
+def rebuild_stats_job(job, classroom_ids=None):
+    total = len(classroom_ids) if classroom_ids is not None else Classroom.objects.count()
+    report_progress(job, 0, total)
+    rebuilt = rebuild_stats(classroom_ids, progress=lambda done: report_progress(job, done))
+    return {'rebuilt': rebuilt}
@@ -0,0 +1,168 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from classes.benchmark import (
+    AUTH_CONFIGURATIONS, DELETE_STRATEGIES, SCENARIOS, Fixture, database_tuning, run_delete, run_scenario,
+    template_mode,
+)
+from classes.models import Classroom
+from classes.seeding import seed_dataset
+from classes.templating import reset_template_metrics, template_metrics
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway database with synthetic teachers, classrooms and "
+        "students, drives the main views through the test client and reports "
+        "latency percentiles, throughput and query counts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--teachers', type=int, default=20)
+        parser.add_argument('--classrooms', type=int, default=5, help="Classrooms per teacher.")
+        parser.add_argument('--students', type=int, default=30, help="Students per classroom.")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario.")
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--scenario', action='append', choices=sorted(SCENARIOS), dest='scenarios',
+            help="Scenario to run; repeat for several. Defaults to all of them.",
+        )
+        parser.add_argument(
+            '--compare-tuning', action='store_true',
+            help="Run every scenario without the SQLite pragmas and persistent connections first, then with them.",
+        )
+        parser.add_argument(
+            '--compare-auth', action='store_true',
+            help="Instead of the scenarios, run signin with each session backend and password hash set-up.",
+        )
+        parser.add_argument(
+            '--compare-templates', action='store_true',
+            help="Run every scenario without the cached template loader, then with it, and show render times per template.",
+        )
+        parser.add_argument(
+            '--compare-delete', action='store_true',
+            help="Instead of the scenarios, delete the seeded classrooms, half with Django's cascade and half with the chunked fast path.",
+        )
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError("--requests and --concurrency must be positive.")
+        scenarios = options['scenarios'] or list(SCENARIOS)
+
+        # A file rather than an in-memory database, so worker threads share it.
+        directory = tempfile.mkdtemp(prefix='classrooms-benchmark-')
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        test_settings['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            dataset = seed_dataset(options['teachers'], options['classrooms'], options['students'], seed=options['seed'])
+            self.stdout.write("Seeded %(teachers)d teachers, %(classrooms)d classrooms, %(students)d students" % dataset)
+
+            if options['compare_delete']:
+                results = self.compare_delete()
+            else:
+                results = self.run_scenarios(options, scenarios)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(directory, ignore_errors=True)
+
+        self.write_report(options, dataset, results)
+
+    def compare_delete(self):
+        results = {}
+        classrooms = list(Classroom.objects.order_by('id'))
+        for number, strategy in enumerate(DELETE_STRATEGIES):
+            key = 'delete:%s' % strategy
+            results[key] = run_delete(strategy, classrooms[number::len(DELETE_STRATEGIES)])
+            self.stdout.write(self.format_delete(key, results[key]))
+        return results
+
+    def run_scenarios(self, options, scenarios):
+        results = {}
+        fixture = Fixture()
+        # (scenario, label, database tuning, template mode, settings) per run.
+        if options['compare_auth']:
+            runs = [
+                ('signin', label, True, settings.TEMPLATE_MODE, overrides)
+                for label, overrides in AUTH_CONFIGURATIONS.items()
+            ]
+        elif options['compare_templates']:
+            runs = [(name, mode, True, mode, {}) for mode in ('development', 'production') for name in scenarios]
+        else:
+            tunings = [('untuned', False), ('tuned', True)] if options['compare_tuning'] else [(None, True)]
+            runs = [
+                (name, label, tuned, settings.TEMPLATE_MODE, {})
+                for label, tuned in tunings for name in scenarios
+            ]
+        with override_settings(ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+            for name, label, tuned, mode, overrides in runs:
+                with database_tuning(tuned), template_mode(mode), override_settings(**overrides):
+                    key = '%s:%s' % (name, label) if label else name
+                    reset_template_metrics()
+                    results[key] = run_scenario(
+                        name, fixture, options['requests'], options['concurrency'], options['seed'],
+                    )
+                    self.stdout.write(self.format_result(key, results[key]))
+                    if options['compare_templates']:
+                        results[key]['templates'] = template_metrics()
+                        if results[key]['templates']:
+                            self.stdout.write(self.format_templates(results[key]['templates']))
+        return results
+
+    def write_report(self, options, dataset, results):
+        if options['output']:
+            report = {
+                'commit': self.git_commit(),
+                'options': {key: options[key] for key in ('teachers', 'classrooms', 'students', 'requests', 'concurrency', 'seed')},
+                'dataset': dataset,
+                'results': results,
+            }
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write("Results written to %s" % options['output'])
+
+    def format_delete(self, name, result):
+        if not result['requests']:
+            return "%-24s needs more classrooms" % name
+        peak = "%9.0f KiB peak" % result['peak_kib'] if result['peak_kib'] is not None else ""
+        return (
+            "%-24s avg %8.2fms  p99 %8.2fms  %6.1f queries  %9.0f students/s  %s" % (
+                name, result['mean_ms'], result['p99_ms'], result['avg_queries'], result['students_per_s'] or 0, peak,
+            )
+        )
+
+    def format_templates(self, templates):
+        return '\n'.join(
+            "    %-28s %6d renders  avg %8.2fms  max %8.2fms" % (
+                name, metrics['renders'], metrics['avg_ms'], metrics['max_ms'],
+            )
+            for name, metrics in sorted(templates.items(), key=lambda item: -item[1]['avg_ms'])
+        )
+
+    def format_result(self, name, result):
+        if not result['requests']:
+            return "%-24s no successful requests (%d errors)" % (name, result['errors'])
+        return (
+            "%-24s p50 %7.2fms  p95 %7.2fms  p99 %7.2fms  %8.1f req/s  %5.1f queries  %d errors" % (
+                name, result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                result['throughput_rps'], result['avg_queries'] or 0, result['errors'],
+            )
+        )
+
+    def git_commit(self):
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            ).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
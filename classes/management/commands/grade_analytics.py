@@ -0,0 +1,66 @@
+import datetime
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from classes.analytics import Cohort, cohort_report, naive_report
+from classes.models import Student
+
+
+class Command(BaseCommand):
+    help = (
+        "Computes end-of-term grade analytics (percentiles, per subject and "
+        "year comparisons, outliers, grade/age correlation) over every student "
+        "of the classrooms that are not archived."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subject')
+        parser.add_argument('--year', type=int)
+        parser.add_argument('--as-of', help="Reference date for ages, YYYY-MM-DD. Defaults to today.")
+        parser.add_argument('--output', help="Write the report to this JSON file instead of stdout.")
+        parser.add_argument(
+            '--benchmark', action='store_true',
+            help="Also time the per-object baseline and report the speedup.",
+        )
+
+    def handle(self, *args, **options):
+        as_of = None
+        if options['as_of']:
+            try:
+                as_of = datetime.datetime.strptime(options['as_of'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("--as-of must be a YYYY-MM-DD date.")
+
+        students = Student.objects.active()
+        if options['subject']:
+            students = students.filter(classroom__subject=options['subject'])
+        if options['year']:
+            students = students.filter(classroom__year=options['year'])
+
+        start = time.perf_counter()
+        report = cohort_report(Cohort(students, as_of))
+        vectorized = time.perf_counter() - start
+
+        if options['benchmark']:
+            start = time.perf_counter()
+            naive_report(students, as_of)
+            naive = time.perf_counter() - start
+            report['benchmark'] = {
+                'students': report['overall']['count'],
+                'vectorized_s': vectorized,
+                'naive_s': naive,
+                'speedup': naive / vectorized if vectorized else None,
+            }
+            self.stderr.write(
+                "%d students: vectorized %.3fs, per-object %.3fs (%.1fx)" % (
+                    report['overall']['count'], vectorized, naive, report['benchmark']['speedup'] or 0,
+                )
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from classes.jobs import enqueue
+from classes.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = "Recomputes the grade statistics of every classroom, or of the given classroom ids."
+
+    def add_arguments(self, parser):
+        parser.add_argument('classroom_ids', nargs='*', type=int)
+        parser.add_argument('--background', action='store_true', help="Queue the rebuild for `run_jobs` instead.")
+
+    def handle(self, *args, **options):
+        if options['background']:
+            job = enqueue('rebuild_stats', classroom_ids=options['classroom_ids'] or None)
+            self.stdout.write("Queued job %d" % job.id)
+            return
+
+        # rebuild_stats commits every chunk itself, so the write lock is
+        # never held for the whole rebuild.
+        rebuilt = rebuild_stats(options['classroom_ids'] or None)
+        self.stdout.write("Rebuilt the stats of %d classroom(s)" % rebuilt)
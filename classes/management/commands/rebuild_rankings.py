@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from classes.ranking import rebuild_rankings
+
+
+class Command(BaseCommand):
+    help = "Recomputes the class and year ranks of every student, or of the students in the given years."
+
+    def add_arguments(self, parser):
+        parser.add_argument('years', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuilt = rebuild_rankings(options['years'] or None)
+        self.stdout.write("Ranked %d student(s)" % rebuilt)
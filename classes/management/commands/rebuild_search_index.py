@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from classes.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index of students and classrooms."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            indexed = rebuild_search_index()
+        self.stdout.write("Indexed %d student(s) and classroom(s)" % indexed)
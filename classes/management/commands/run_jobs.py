@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from classes.jobs import claim_job, requeue_stale, run_claimed_job, run_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs queued background jobs in a pool of worker processes. This "
+        "process claims the jobs and hands them to the pool, so no two "
+        "workers run the same job."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help="Jobs run at once; 0 runs them one by one in this process.",
+        )
+        parser.add_argument('--poll', type=float, default=1.0, help="Seconds between looks at an empty queue.")
+        parser.add_argument('--once', action='store_true', help="Exit once no job is due instead of waiting for more.")
+
+    def handle(self, *args, **options):
+        if options['processes'] < 0:
+            raise CommandError("--processes cannot be negative.")
+        self.worker = '%s:%d' % (socket.gethostname(), os.getpid())
+        if options['processes']:
+            finished = self.run_pool(options)
+        else:
+            finished = self.run_inline(options)
+        self.stdout.write("Ran %d job(s)" % finished)
+
+    def run_inline(self, options):
+        finished = 0
+        while True:
+            requeue_stale()
+            job = claim_job(self.worker)
+            if job is not None:
+                job = run_job(job)
+                finished += 1
+                self.stdout.write("Job %d (%s) %s" % (job.id, job.kind, job.status))
+            elif options['once']:
+                return finished
+            else:
+                time.sleep(options['poll'])
+
+    def run_pool(self, options):
+        finished = 0
+        running = {}
+        # Forked workers must not inherit an open SQLite connection.
+        connections.close_all()
+        with multiprocessing.Pool(options['processes']) as pool:
+            while True:
+                requeue_stale()
+                # Stays None when the pool is full or the queue is empty, so
+                # the loop then waits --poll before looking again.
+                job = None
+                while len(running) < options['processes']:
+                    job = claim_job(self.worker)
+                    if job is None:
+                        break
+                    running[job.id] = (job.kind, pool.apply_async(run_claimed_job, (job.id,)))
+
+                for job_id, (kind, result) in list(running.items()):
+                    if result.ready():
+                        del running[job_id]
+                        finished += 1
+                        try:
+                            status = result.get()
+                        except Exception as error:
+                            status = 'crashed (%s)' % error
+                        self.stdout.write("Job %d (%s) %s" % (job_id, kind, status))
+
+                if not running and options['once'] and job is None:
+                    return finished
+                time.sleep(options['poll'] if job is None else 0.05)
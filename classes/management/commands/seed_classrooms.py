@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connections
+
+from classes.seeding import DEFAULT_PASSWORD, seed_dataset
+
+
+def seed_shard(job):
+    """Seeds one SQLite file in a worker process."""
+    path, options, first_teacher, teachers, seed = job
+    connection = connections['default']
+    connection.close()
+    connection.settings_dict['NAME'] = path
+    call_command('migrate', verbosity=0, interactive=False)
+    try:
+        return seed_dataset(
+            teachers, options['classrooms'], options['students'], seed=seed,
+            prefix=options['prefix'], password=options['password'], first_teacher=first_teacher,
+            batch_size=options['batch_size'], single_transaction=options['single_transaction'],
+        )
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates deterministic synthetic teachers, classrooms and students "
+        "with bulk inserts, either into the default database or, with "
+        "--processes, into one SQLite file per worker process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--teachers', type=int, default=100)
+        parser.add_argument('--classrooms', type=int, default=10, help="Classrooms per teacher.")
+        parser.add_argument('--students', type=int, default=30, help="Students per classroom.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='teacher', help="Teacher usernames are <prefix>-<number>.")
+        parser.add_argument('--password', default=DEFAULT_PASSWORD, help="Password of every generated teacher.")
+        parser.add_argument('--batch-size', type=int, default=10000, help="Students per bulk_create batch.")
+        parser.add_argument(
+            '--single-transaction', action='store_true',
+            help="Insert everything in one transaction instead of committing every batch.",
+        )
+        parser.add_argument(
+            '--processes', type=int, default=0,
+            help="Seed this many separate SQLite files in parallel instead of the default database.",
+        )
+        parser.add_argument('--output-dir', default='.', help="Where --processes writes its SQLite files.")
+
+    def handle(self, *args, **options):
+        if min(options['teachers'], options['classrooms'], options['students'], options['batch_size']) < 1:
+            raise CommandError("--teachers, --classrooms, --students and --batch-size must be positive.")
+
+        start = time.perf_counter()
+        if options['processes']:
+            totals = self.seed_shards(options)
+        else:
+            try:
+                totals = seed_dataset(
+                    options['teachers'], options['classrooms'], options['students'], seed=options['seed'],
+                    prefix=options['prefix'], password=options['password'],
+                    batch_size=options['batch_size'], single_transaction=options['single_transaction'],
+                )
+            except IntegrityError as error:
+                raise CommandError("Could not seed, is --prefix %r already used? (%s)" % (options['prefix'], error))
+        elapsed = time.perf_counter() - start
+
+        rows = sum(totals.values())
+        self.stdout.write(
+            "Created %d teachers, %d classrooms and %d students in %.1fs (%.0f rows/sec)" % (
+                totals['teachers'], totals['classrooms'], totals['students'], elapsed, rows / elapsed,
+            )
+        )
+
+    def seed_shards(self, options):
+        processes = options['processes']
+        if processes > options['teachers']:
+            raise CommandError("--processes cannot exceed --teachers.")
+        os.makedirs(options['output_dir'], exist_ok=True)
+
+        jobs = []
+        first_teacher = 0
+        for number in range(processes):
+            teachers = options['teachers'] // processes + (1 if number < options['teachers'] % processes else 0)
+            path = os.path.abspath(os.path.join(options['output_dir'], 'seed-%d.sqlite3' % number))
+            if os.path.exists(path):
+                raise CommandError("%s already exists." % path)
+            jobs.append((path, options, first_teacher, teachers, options['seed'] + number))
+            first_teacher += teachers
+
+        # Forked workers must not inherit an open SQLite connection.
+        connections.close_all()
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(seed_shard, jobs)
+
+        for path, *_ in jobs:
+            self.stdout.write("Seeded %s" % path)
+        return {
+            name: sum(result[name] for result in results)
+            for name in ('teachers', 'classrooms', 'students')
+        }
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from classes.database import replica_databases, sync_replicas
+
+
+class Command(BaseCommand):
+    help = "Copies the primary SQLite database over the read replicas in REPLICA_DATABASES."
+
+    def add_arguments(self, parser):
+        parser.add_argument('aliases', nargs='*', help="Replicas to copy to. Defaults to all of them.")
+
+    def handle(self, *args, **options):
+        unknown = set(options['aliases']) - set(replica_databases())
+        if unknown:
+            raise CommandError("Not a replica: %s" % ', '.join(sorted(unknown)))
+        if not replica_databases():
+            raise CommandError("No replicas configured; set DATABASE_REPLICAS.")
+        for alias in sync_replicas(options['aliases'] or None):
+            self.stdout.write("Copied the primary to %s" % alias)
@@ -0,0 +1,208 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .database import PIN_COOKIE, pin_reads, replica_databases, wrote
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in milliseconds, of the wall time histogram buckets.
+HISTOGRAM_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+_local = threading.local()
+_metrics_lock = threading.Lock()
+_metrics = {}
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        # Database alias -> [queries, seconds].
+        self.databases = {}
+
+    def execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.db_time += elapsed
+            database = self.databases.setdefault(context['connection'].alias, [0, 0.0])
+            database[0] += 1
+            database[1] += elapsed
+
+
+def current_timings():
+    return getattr(_local, 'timings', None)
+
+
+def _empty_metrics():
+    return {
+        'requests': 0,
+        'queries': 0,
+        'max_queries': 0,
+        'db_ms': 0.0,
+        'template_ms': 0.0,
+        'wall_ms': 0.0,
+        'histogram': [0] * len(HISTOGRAM_BUCKETS),
+        'databases': {},
+    }
+
+
+def _record(url_name, timings, wall_time):
+    wall_ms = wall_time * 1000
+    with _metrics_lock:
+        metrics = _metrics.setdefault(url_name, _empty_metrics())
+        metrics['requests'] += 1
+        metrics['queries'] += timings.queries
+        metrics['max_queries'] = max(metrics['max_queries'], timings.queries)
+        metrics['db_ms'] += timings.db_time * 1000
+        metrics['template_ms'] += timings.template_time * 1000
+        metrics['wall_ms'] += wall_ms
+        metrics['histogram'][bisect.bisect_left(HISTOGRAM_BUCKETS, wall_ms)] += 1
+        for alias, (queries, db_time) in timings.databases.items():
+            database = metrics['databases'].setdefault(alias, {'queries': 0, 'db_ms': 0.0})
+            database['queries'] += queries
+            database['db_ms'] += db_time * 1000
+
+
+def view_metrics():
+    """Returns a snapshot of the per-URL-name counters collected so far."""
+    with _metrics_lock:
+        snapshot = {}
+        for url_name, metrics in _metrics.items():
+            requests = metrics['requests']
+            snapshot[url_name] = {
+                'requests': requests,
+                'max_queries': metrics['max_queries'],
+                'avg_queries': metrics['queries'] / requests,
+                'avg_db_ms': metrics['db_ms'] / requests,
+                'avg_template_ms': metrics['template_ms'] / requests,
+                'avg_wall_ms': metrics['wall_ms'] / requests,
+                'histogram': [
+                    {'le': 'inf' if bound == float('inf') else bound, 'count': count}
+                    for bound, count in zip(HISTOGRAM_BUCKETS, metrics['histogram'])
+                ],
+                'databases': {
+                    alias: {
+                        'avg_queries': database['queries'] / requests,
+                        'avg_db_ms': database['db_ms'] / requests,
+                    }
+                    for alias, database in metrics['databases'].items()
+                },
+            }
+    return snapshot
+
+
+def database_metrics():
+    """The queries and database time of all views so far, per database alias."""
+    with _metrics_lock:
+        totals = {}
+        for metrics in _metrics.values():
+            for alias, database in metrics['databases'].items():
+                total = totals.setdefault(alias, {'queries': 0, 'db_ms': 0.0})
+                total['queries'] += database['queries']
+                total['db_ms'] += database['db_ms']
+    for total in totals.values():
+        total['avg_ms'] = total['db_ms'] / total['queries'] if total['queries'] else None
+    return totals
+
+
+def reset_view_metrics():
+    with _metrics_lock:
+        _metrics.clear()
+
+
+def query_budget(url_name):
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    return budgets.get(url_name, getattr(settings, 'QUERY_BUDGET_DEFAULT', None))
+
+
+class QueryTimingMiddleware:
+    """
+    Counts the SQL queries and times the database, template rendering and
+    whole request for every view, adds them to the response as a
+    Server-Timing header and aggregates them per URL name.
+
+    Views that run more queries than QUERY_BUDGETS allows are logged, or
+    raise QueryBudgetExceeded when QUERY_BUDGET_ACTION is 'raise'.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        _local.timings = timings
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings.execute))
+                response = self.get_response(request)
+        finally:
+            _local.timings = None
+        wall_time = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.url_name if match and match.url_name else 'unresolved'
+        _record(url_name, timings, wall_time)
+
+        response['Server-Timing'] = ', '.join([
+            'db;dur=%.2f;desc="%d queries"' % (timings.db_time * 1000, timings.queries),
+            'tpl;dur=%.2f' % (timings.template_time * 1000),
+            'total;dur=%.2f' % (wall_time * 1000),
+        ])
+
+        budget = query_budget(url_name)
+        if budget is not None and timings.queries > budget:
+            message = "%s ran %d queries, over its budget of %d" % (url_name, timings.queries, budget)
+            if getattr(settings, 'QUERY_BUDGET_ACTION', 'log') == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        return response
+
+
+class ReplicaPinningMiddleware:
+    """
+    Pins a client's reads to the primary database for
+    READ_YOUR_WRITES_SECONDS after any of its requests writes, with a
+    cookie holding the time the pin expires. Does nothing without
+    REPLICA_DATABASES.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replica_databases():
+            return self.get_response(request)
+
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        pin_reads(pinned_until > time.time())
+        try:
+            response = self.get_response(request)
+            if wrote():
+                window = getattr(settings, 'READ_YOUR_WRITES_SECONDS', 10)
+                response.set_cookie(PIN_COOKIE, '%.3f' % (time.time() + window), max_age=window, httponly=True)
+        finally:
+            pin_reads(False)
+        return response
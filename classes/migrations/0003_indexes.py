@@ -0,0 +1,32 @@
+# Generated by Django 2.1.5 on 2026-10-17 17:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0002_auto_20200122_1652'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='classroom',
+            name='teacher',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='classroom',
+            index=models.Index(fields=['teacher', 'year'], name='classroom_teacher_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='classroom',
+            index=models.Index(fields=['year', 'name'], name='classroom_year_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['classroom', 'name', 'exam_grade'], name='student_class_name_grade_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.1.5 on 2026-10-17 17:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0003_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClassroomStats',
+            fields=[
+                ('classroom', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='classes.Classroom')),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('total_squares', models.DecimalField(decimal_places=4, default=0, max_digits=22)),
+                ('min_grade', models.DecimalField(decimal_places=2, max_digits=4, null=True)),
+                ('max_grade', models.DecimalField(decimal_places=2, max_digits=4, null=True)),
+                ('bucket_0', models.IntegerField(default=0)),
+                ('bucket_1', models.IntegerField(default=0)),
+                ('bucket_2', models.IntegerField(default=0)),
+                ('bucket_3', models.IntegerField(default=0)),
+                ('bucket_4', models.IntegerField(default=0)),
+                ('bucket_5', models.IntegerField(default=0)),
+                ('bucket_6', models.IntegerField(default=0)),
+                ('bucket_7', models.IntegerField(default=0)),
+                ('bucket_8', models.IntegerField(default=0)),
+                ('bucket_9', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
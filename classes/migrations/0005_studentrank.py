@@ -0,0 +1,68 @@
+# Generated by Django 2.1.5 on 2026-10-17 17:25
+
+from django.db import migrations, models
+from django.db.models import F, Window
+from django.db.models.functions import Rank
+import django.db.models.deletion
+
+
+def rank_students(apps, schema_editor):
+    # The same ranks as ranking.rebuild_rankings, so existing students are
+    # ranked before anything reads the table.
+    Student = apps.get_model('classes', 'Student')
+    StudentRank = apps.get_model('classes', 'StudentRank')
+    years = Student.objects.order_by().values_list('classroom__year', flat=True).distinct()
+    for year in list(years):
+        rows = (
+            Student.objects.filter(classroom__year=year)
+            .annotate(
+                class_rank=Window(Rank(), partition_by=[F('classroom_id')], order_by=F('exam_grade').desc()),
+                year_rank=Window(Rank(), order_by=F('exam_grade').desc()),
+            )
+            .values_list('id', 'classroom_id', 'exam_grade', 'class_rank', 'year_rank')
+            .iterator(chunk_size=5000)
+        )
+        batch = []
+        for student_id, classroom_id, grade, class_rank, year_rank in rows:
+            batch.append(StudentRank(
+                student_id=student_id, classroom_id=classroom_id, year=year,
+                exam_grade=grade, class_rank=class_rank, year_rank=year_rank,
+            ))
+            if len(batch) >= 5000:
+                StudentRank.objects.bulk_create(batch, batch_size=150)
+                batch = []
+        StudentRank.objects.bulk_create(batch, batch_size=150)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0004_classroomstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentRank',
+            fields=[
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rank', serialize=False, to='classes.Student')),
+                ('year', models.IntegerField()),
+                ('exam_grade', models.DecimalField(decimal_places=2, max_digits=4)),
+                ('class_rank', models.IntegerField()),
+                ('year_rank', models.IntegerField()),
+                ('classroom', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='classes.Classroom')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='studentrank',
+            index=models.Index(fields=['classroom', 'class_rank'], name='rank_classroom_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentrank',
+            index=models.Index(fields=['year', 'year_rank'], name='rank_year_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentrank',
+            index=models.Index(fields=['year', 'exam_grade'], name='rank_year_grade_idx'),
+        ),
+        migrations.RunPython(rank_students, migrations.RunPython.noop),
+    ]
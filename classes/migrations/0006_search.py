@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+def has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return any(row[0] == 'ENABLE_FTS5' for row in cursor.fetchall())
+
+
+def create_search_table(apps, schema_editor):
+    # Without FTS5, search.search_available() is false and search falls
+    # back to plain prefix matching, so there is no table to create.
+    if schema_editor.connection.vendor != 'sqlite' or not has_fts5(schema_editor.connection):
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE classes_search USING fts5("
+        "name, subject, scope, prefix='2 3 4', tokenize='unicode61 remove_diacritics 1')"
+    )
+    schema_editor.execute(
+        "INSERT INTO classes_search (rowid, name, subject, scope)"
+        " SELECT c.id * 2 + 1, c.name, c.subject, 't' || c.teacher_id FROM classes_classroom c"
+    )
+    schema_editor.execute(
+        "INSERT INTO classes_search (rowid, name, subject, scope)"
+        " SELECT s.id * 2, s.name, '', 't' || c.teacher_id"
+        " FROM classes_student s INNER JOIN classes_classroom c ON s.classroom_id = c.id"
+    )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS classes_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0005_studentrank'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0009_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classroom',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.1.5 on 2026-10-17 18:49
+
+from django.db import migrations
+import django.db.models.manager
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0010_classroom_archived_at'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='classroom',
+            managers=[
+                ('all_objects', django.db.models.manager.Manager()),
+            ],
+        ),
+    ]
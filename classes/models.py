@@ -1,13 +1,47 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import models, transaction
 from django.urls import reverse
 from django.contrib.auth.models import User
 
 
+class ActiveClassroomManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(archived_at__isnull=True)
+
+
 class Classroom(models.Model):
     name = models.CharField(max_length=120)
     subject = models.CharField(max_length=120)
     year = models.IntegerField()
     teacher = models.ForeignKey(User, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Set when the classroom is archived (soft-deleted), see
+    # classes.deletion. Archived classrooms are left out of `objects`.
+    archived_at = models.DateTimeField(null=True, blank=True)
+
+    # Declared first so it is the default manager: the admin, dumpdata and
+    # the cascade from User see archived classrooms too, and a dump never
+    # holds students whose classroom is missing from it.
+    all_objects = models.Manager()
+    objects = ActiveClassroomManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['teacher', 'year'], name='classroom_teacher_year_idx'),
+            models.Index(fields=['year', 'name'], name='classroom_year_name_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded year so a later save can re-rank both years,
+        # and the teacher so it can move the students' search scope.
+        if 'year' in field_names:
+            instance._loaded_year = instance.year
+        if 'teacher_id' in field_names:
+            instance._loaded_teacher_id = instance.teacher_id
+        return instance
 
     def get_absolute_url(self):
         return reverse('classroom-detail', kwargs={'classroom_id':self.id})
@@ -16,6 +50,12 @@ class Classroom(models.Model):
         return self.name
 
 
+class StudentQuerySet(models.QuerySet):
+    def active(self):
+        """Leaves out the students of archived classrooms."""
+        return self.filter(classroom__archived_at__isnull=True)
+
+
 class Student(models.Model):
     name = models.CharField(max_length=120)
     date_of_birth = models.DateField()
@@ -31,7 +71,175 @@ class Student(models.Model):
     )
     exam_grade = models.DecimalField(max_digits=4, decimal_places=2)
     classroom = models.ForeignKey(Classroom, on_delete=models.CASCADE, related_name='students')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = StudentQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so a later save can adjust the stats.
+        if 'classroom_id' in field_names and 'exam_grade' in field_names:
+            instance._loaded_grade = (instance.classroom_id, instance.exam_grade)
+        return instance
+
+    # The signals keep the stats, ranks and search index in step with every
+    # write; one transaction makes that a single commit instead of one each.
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            return super().delete(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['classroom', 'name', 'exam_grade'], name='student_class_name_grade_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class ClassroomStats(models.Model):
+    """
+    Running totals of a classroom's exam grades, kept up to date on every
+    student write so that reading them never scans the students.
+    """
+    BUCKET_WIDTH = 10
+    BUCKETS = 10
+
+    classroom = models.OneToOneField(Classroom, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    count = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    total_squares = models.DecimalField(max_digits=22, decimal_places=4, default=0)
+    min_grade = models.DecimalField(max_digits=4, decimal_places=2, null=True)
+    max_grade = models.DecimalField(max_digits=4, decimal_places=2, null=True)
+    bucket_0 = models.IntegerField(default=0)
+    bucket_1 = models.IntegerField(default=0)
+    bucket_2 = models.IntegerField(default=0)
+    bucket_3 = models.IntegerField(default=0)
+    bucket_4 = models.IntegerField(default=0)
+    bucket_5 = models.IntegerField(default=0)
+    bucket_6 = models.IntegerField(default=0)
+    bucket_7 = models.IntegerField(default=0)
+    bucket_8 = models.IntegerField(default=0)
+    bucket_9 = models.IntegerField(default=0)
+    # When the classroom's roster last changed, deletions included.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def bucket_field(cls, grade):
+        index = min(max(int(grade // cls.BUCKET_WIDTH), 0), cls.BUCKETS - 1)
+        return 'bucket_%d' % index
+
+    @property
+    def buckets(self):
+        return [getattr(self, 'bucket_%d' % index) for index in range(self.BUCKETS)]
+
+    @property
+    def distribution(self):
+        return [
+            ('%d-%d' % (index * self.BUCKET_WIDTH, (index + 1) * self.BUCKET_WIDTH), count)
+            for index, count in enumerate(self.buckets)
+        ]
+
+    @property
+    def average(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    @property
+    def stddev(self):
+        if not self.count:
+            return None
+        variance = self.total_squares / self.count - self.average ** 2
+        return max(variance, Decimal(0)).sqrt()
+
+    @property
+    def median(self):
+        """Estimated from the histogram by interpolating inside the middle bucket."""
+        if not self.count:
+            return None
+        middle = self.count / 2
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            if count and seen + count >= middle:
+                low = index * self.BUCKET_WIDTH
+                estimate = low + (middle - seen) / count * self.BUCKET_WIDTH
+                return min(max(estimate, float(self.min_grade)), float(self.max_grade))
+            seen += count
+
+    def __str__(self):
+        return str(self.classroom_id)
+
+
+class StudentRank(models.Model):
+    """
+    A student's competition rank (1 + the number of better grades) in
+    their classroom and in their classroom's year. The classroom, year and
+    grade are copied here so ranks can be shifted with range updates.
+    """
+    student = models.OneToOneField(Student, on_delete=models.CASCADE, primary_key=True, related_name='rank')
+    classroom = models.ForeignKey(Classroom, on_delete=models.CASCADE, related_name='+')
+    year = models.IntegerField()
+    exam_grade = models.DecimalField(max_digits=4, decimal_places=2)
+    class_rank = models.IntegerField()
+    year_rank = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['classroom', 'class_rank'], name='rank_classroom_rank_idx'),
+            models.Index(fields=['year', 'year_rank'], name='rank_year_rank_idx'),
+            models.Index(fields=['year', 'exam_grade'], name='rank_year_grade_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.student_id)
+
+
+class Job(models.Model):
+    """
+    A unit of background work for `manage.py run_jobs`, see classes.jobs.
+    `params` and `result` hold JSON.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    kind = models.CharField(max_length=60)
+    params = models.TextField(default='{}')
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='+')
+    status = models.CharField(max_length=10, choices=STATUS, default=QUEUED)
+    progress = models.IntegerField(default=0)
+    total = models.IntegerField(null=True)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    result = models.TextField(null=True)
+    error = models.TextField(blank=True, default='')
+    worker = models.CharField(max_length=120, blank=True, default='')
+    # Not claimed before this; pushed back after each failed attempt.
+    run_after = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    # Touched by every progress report, so a job whose worker died shows up
+    # as a running job that stopped changing.
+    updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return '%s #%s' % (self.kind, self.id)
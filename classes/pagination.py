@@ -0,0 +1,101 @@
+import base64
+import json
+
+from django.db.models import Q
+
+
+DEFAULT_PAGE_SIZE = 30
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor(cursor)
+    return values
+
+
+def get_page_size(request, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    try:
+        size = int(request.GET.get('limit', default))
+    except ValueError:
+        return default
+    return max(1, min(size, maximum))
+
+
+def keyset_filter(ordering, values):
+    """
+    Builds the "row comes after (v1, v2, ...)" condition for an ascending
+    ordering, i.e. f1 >= v1 AND ((f1 > v1) OR (f1 = v1 AND f2 > v2) OR ...).
+    The redundant leading f1 >= v1 is what lets SQLite seek to the cursor
+    in an index starting with f1; it cannot use the OR alone, and would
+    scan the index from the start on every page.
+    """
+    condition = Q()
+    for i, field in enumerate(ordering):
+        step = Q(**{field + '__gt': values[i]})
+        for previous, value in zip(ordering[:i], values[:i]):
+            step &= Q(**{previous: value})
+        condition |= step
+    return Q(**{ordering[0] + '__gte': values[0]}) & condition
+
+
+def keyset_window(queryset, ordering, cursor=None, size=DEFAULT_PAGE_SIZE):
+    """
+    The rows of the page that follows `cursor`, plus the first row of the
+    next page if there is one, as a sliced queryset.
+    """
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(keyset_filter(ordering, decode_cursor(cursor, len(ordering))))
+    return queryset[:size + 1]
+
+
+def keyset_page(queryset, ordering, cursor=None, size=DEFAULT_PAGE_SIZE):
+    """
+    Returns (rows, next_cursor) for the page of `queryset` that follows
+    `cursor`. The last field of `ordering` must be unique (normally 'id')
+    so that the ordering is total and pages never overlap.
+    """
+    rows = list(keyset_window(queryset, ordering, cursor, size))
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_cursor = encode_cursor(_keyset_values(rows[-1], ordering))
+    return rows, next_cursor
+
+
+def keyset_chunks(queryset, ordering, size):
+    """
+    Yields every row of `queryset` as lists of at most `size` rows, one
+    bounded query per list. Unlike iterator(), which on SQLite still
+    fetches the whole result at once, memory stays flat however many rows
+    there are.
+    """
+    queryset = queryset.order_by(*ordering)
+    chunk = list(queryset[:size])
+    while chunk:
+        yield chunk
+        if len(chunk) < size:
+            return
+        after = keyset_filter(ordering, list(_keyset_values(chunk[-1], ordering)))
+        chunk = list(queryset.filter(after)[:size])
+
+
+def _keyset_values(row, ordering):
+    if isinstance(row, dict):
+        return (row[field] for field in ordering)
+    return (getattr(row, field) for field in ordering)
@@ -0,0 +1,125 @@
+from decimal import Decimal
+
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When, Window
+from django.db.models.functions import Rank
+
+from .models import Classroom, Student, StudentRank
+
+
+REBUILD_CHUNK_SIZE = 5000
+
+
+def _indicator(condition):
+    return Case(When(condition, then=Value(1)), default=Value(0), output_field=IntegerField())
+
+
+def _apply_shifts(year, shifts, student_id):
+    """Applies the (classroom_id, grade, step) shifts of one year in a single UPDATE."""
+    year_delta = Value(0)
+    class_delta = Value(0)
+    highest = max(grade for _, grade, _ in shifts)
+    for classroom_id, grade, step in shifts:
+        below = Q(exam_grade__lt=grade)
+        year_delta = year_delta + step * _indicator(below)
+        class_delta = class_delta + step * _indicator(below & Q(classroom_id=classroom_id))
+    (
+        StudentRank.objects
+        .filter(year=year, exam_grade__lt=highest)
+        .exclude(student_id=student_id)
+        .update(year_rank=F('year_rank') + year_delta, class_rank=F('class_rank') + class_delta)
+    )
+
+
+def _ranks_of(year, classroom_id, grade, student_id):
+    above = (
+        StudentRank.objects
+        .filter(year=year, exam_grade__gt=grade)
+        .exclude(student_id=student_id)
+        .aggregate(year=Count('pk'), classroom=Count('pk', filter=Q(classroom_id=classroom_id)))
+    )
+    return above['classroom'] + 1, above['year'] + 1
+
+
+def move_student(student_id, old, new):
+    """
+    Updates the ranks for a student whose (classroom_id, year, grade) went
+    from `old` to `new`; either may be None for a created or deleted
+    student. Costs one range UPDATE per year touched, plus a COUNT and a
+    write of the student's own row unless it was deleted.
+    """
+    if old is not None:
+        old = (old[0], old[1], Decimal(str(old[2])))
+    if new is not None:
+        new = (new[0], new[1], Decimal(str(new[2])))
+    if old == new:
+        return
+
+    shifts = {}
+    if old is not None:
+        shifts.setdefault(old[1], []).append((old[0], old[2], -1))
+    if new is not None:
+        shifts.setdefault(new[1], []).append((new[0], new[2], 1))
+    for year, year_shifts in shifts.items():
+        _apply_shifts(year, year_shifts, student_id)
+
+    if new is None:
+        # The student's own row goes with it through the cascade.
+        return
+    classroom_id, year, grade = new
+    class_rank, year_rank = _ranks_of(year, classroom_id, grade, student_id)
+    values = {
+        'classroom_id': classroom_id,
+        'year': year,
+        'exam_grade': grade,
+        'class_rank': class_rank,
+        'year_rank': year_rank,
+    }
+    if old is None or not StudentRank.objects.filter(student_id=student_id).update(**values):
+        StudentRank.objects.create(student_id=student_id, **values)
+
+
+def rebuild_rankings(years=None):
+    """
+    Recomputes every rank in the given years (all years by default) with
+    RANK() window functions partitioned by classroom and by year. Students
+    of archived classrooms are left unranked.
+    """
+    if years is None:
+        years = Classroom.objects.order_by().values_list('year', flat=True).distinct()
+    rebuilt = 0
+    for year in list(years):
+        StudentRank.objects.filter(Q(year=year) | Q(student__classroom__year=year)).delete()
+        rows = (
+            Student.objects.active()
+            .filter(classroom__year=year)
+            .annotate(
+                class_rank=Window(Rank(), partition_by=[F('classroom_id')], order_by=F('exam_grade').desc()),
+                year_rank=Window(Rank(), order_by=F('exam_grade').desc()),
+            )
+            .values_list('id', 'classroom_id', 'exam_grade', 'class_rank', 'year_rank')
+            .iterator(chunk_size=REBUILD_CHUNK_SIZE)
+        )
+        batch = []
+        for student_id, classroom_id, grade, class_rank, year_rank in rows:
+            batch.append(StudentRank(
+                student_id=student_id, classroom_id=classroom_id, year=year,
+                exam_grade=grade, class_rank=class_rank, year_rank=year_rank,
+            ))
+            if len(batch) >= REBUILD_CHUNK_SIZE:
+                StudentRank.objects.bulk_create(batch)
+                rebuilt += len(batch)
+                batch = []
+        StudentRank.objects.bulk_create(batch)
+        rebuilt += len(batch)
+    return rebuilt
+
+
+def top(ranks, order, limit):
+    return ranks.select_related('student').order_by(order, 'student_id')[:limit]
+
+
+def around(ranks, order, rank, distance):
+    # Capped so a long run of tied ranks cannot make the answer unbounded.
+    return ranks.select_related('student').filter(
+        **{order + '__range': (rank - distance, rank + distance)}
+    ).order_by(order, 'student_id')[:4 * distance + 1]
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.cache import caches
+
+
+RATE_LIMIT_CACHE = 'ratelimit'
+
+
+def _counters(request, username):
+    """(scope, cache key, limit, window) for every limit in SIGNIN_RATE_LIMITS."""
+    values = {'ip': request.META.get('REMOTE_ADDR', ''), 'username': username.lower()}
+    return [
+        (scope, 'signin-failures:%s:%s' % (scope, values[scope]), limit, window)
+        for scope, (limit, window) in getattr(settings, 'SIGNIN_RATE_LIMITS', {}).items()
+    ]
+
+
+def signin_blocked(request, username):
+    """
+    Whether the address or the username has failed to sign in too often
+    lately. Checked before authenticating, so a blocked attempt costs no
+    password hashing. Only failures count, so the teachers of one school
+    signing in from behind the same address do not hold each other up.
+    """
+    counters = _counters(request, username)
+    counts = caches[RATE_LIMIT_CACHE].get_many([key for _, key, _, _ in counters])
+    return any(counts.get(key, 0) >= limit for _, key, limit, _ in counters)
+
+
+def signin_failed(request, username):
+    cache = caches[RATE_LIMIT_CACHE]
+    for _, key, _, window in _counters(request, username):
+        # The window starts at the first failure; later ones do not extend it.
+        if not cache.add(key, 1, timeout=window):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.add(key, 1, timeout=window)
+
+
+def signin_succeeded(request, username):
+    caches[RATE_LIMIT_CACHE].delete_many([
+        key for scope, key, _, _ in _counters(request, username) if scope == 'username'
+    ])
@@ -0,0 +1,177 @@
+import functools
+import re
+import sqlite3
+from contextlib import closing
+
+from django.db import connection, connections, router
+from django.db.models import Q
+
+from .models import Classroom, Student
+
+
+# An FTS5 table holding one row per student and per classroom. Students
+# use rowid 2 * id and classrooms 2 * id + 1, so either can be replaced
+# or removed by rowid. `scope` holds "t<teacher id>" so a teacher filter
+# is part of the full-text match instead of a scan of the matches.
+SEARCH_TABLE = 'classes_search'
+SEARCH_LIMIT = 20
+SEARCH_MAX_LIMIT = 50
+# Relative weights of the name, subject and scope columns in the ranking.
+RANK = 'bm25(%s, 10.0, 5.0, 0.0)' % SEARCH_TABLE
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+STUDENT_ROWS_SQL = (
+    "SELECT s.id * 2, s.name, '', 't' || c.teacher_id"
+    " FROM classes_student s INNER JOIN classes_classroom c ON s.classroom_id = c.id"
+)
+CLASSROOM_ROWS_SQL = "SELECT c.id * 2 + 1, c.name, c.subject, 't' || c.teacher_id FROM classes_classroom c"
+
+
+@functools.lru_cache()
+def sqlite_has_fts5():
+    """Whether the SQLite library Django uses was built with FTS5."""
+    with closing(sqlite3.connect(':memory:')) as database:
+        return ('ENABLE_FTS5',) in database.execute('PRAGMA compile_options').fetchall()
+
+
+def search_available():
+    # Must agree with migration 0006, which only creates the table when
+    # SQLite has FTS5.
+    return connection.vendor == 'sqlite' and sqlite_has_fts5()
+
+
+def _execute(sql, params=()):
+    if search_available():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+def _insert(select, where, params):
+    _execute(
+        'INSERT OR REPLACE INTO %s (rowid, name, subject, scope) %s WHERE %s' % (SEARCH_TABLE, select, where),
+        params,
+    )
+
+
+def index_student(student):
+    # The teacher is read in the same statement, so it costs one query
+    # whether or not the classroom is already loaded.
+    _execute(
+        "INSERT OR REPLACE INTO %s (rowid, name, subject, scope)"
+        " SELECT %%s, %%s, '', 't' || teacher_id FROM classes_classroom WHERE id = %%s" % SEARCH_TABLE,
+        [student.id * 2, student.name, student.classroom_id],
+    )
+
+
+def unindex_student(student_id):
+    _execute('DELETE FROM %s WHERE rowid = %%s' % SEARCH_TABLE, [student_id * 2])
+
+
+def index_classroom(classroom):
+    _execute(
+        'INSERT OR REPLACE INTO %s (rowid, name, subject, scope) VALUES (%%s, %%s, %%s, %%s)' % SEARCH_TABLE,
+        [classroom.id * 2 + 1, classroom.name, classroom.subject, 't%s' % classroom.teacher_id],
+    )
+
+
+def unindex_classroom(classroom_id):
+    _execute('DELETE FROM %s WHERE rowid = %%s' % SEARCH_TABLE, [classroom_id * 2 + 1])
+
+
+def rescope_classroom_students(classroom):
+    """Moves the classroom's students to its new teacher's scope."""
+    _execute(
+        'UPDATE %s SET scope = %%s WHERE rowid IN'
+        ' (SELECT id * 2 FROM classes_student WHERE classroom_id = %%s)' % SEARCH_TABLE,
+        ['t%s' % classroom.teacher_id, classroom.id],
+    )
+
+
+def index_classroom_students(classroom_id):
+    _insert(STUDENT_ROWS_SQL, 's.classroom_id = %s', [classroom_id])
+
+
+def unindex_classroom_students(classroom_id):
+    _execute(
+        'DELETE FROM %s WHERE rowid IN (SELECT id * 2 FROM classes_student WHERE classroom_id = %%s)' % SEARCH_TABLE,
+        [classroom_id],
+    )
+
+
+def index_students_after(student_id):
+    """Indexes every student with an id above `student_id`, in one statement."""
+    _insert(STUDENT_ROWS_SQL, 's.id > %s AND c.archived_at IS NULL', [student_id])
+
+
+def index_classrooms_after(classroom_id):
+    _insert(CLASSROOM_ROWS_SQL, 'c.id > %s AND c.archived_at IS NULL', [classroom_id])
+
+
+def rebuild_search_index():
+    _execute('DELETE FROM %s' % SEARCH_TABLE)
+    index_classrooms_after(0)
+    index_students_after(0)
+    return Student.objects.active().count() + Classroom.objects.count()
+
+
+def match_expression(text, teacher_id=None):
+    """
+    Turns free text into an FTS5 query: every word must match the start
+    of a word in a name or subject, so "lai ah" finds "Laila Ahmad".
+    Returns None when there is nothing to search for.
+    """
+    tokens = TOKEN.findall(text)
+    if not tokens:
+        return None
+    words = ' AND '.join('"%s"*' % token.replace('"', '""') for token in tokens)
+    expression = '{name subject} : (%s)' % words
+    if teacher_id is not None:
+        expression = 'scope : "t%d" AND %s' % (teacher_id, expression)
+    return expression
+
+
+def find(text, teacher_id=None, limit=SEARCH_LIMIT):
+    """
+    The best matching students and classrooms, best first, as
+    ('student', Student) and ('classroom', Classroom) pairs.
+    """
+    expression = match_expression(text, teacher_id)
+    if expression is None:
+        return []
+    if not search_available():
+        return _search_fallback(text, teacher_id, limit)
+
+    # Raw SQL skips the router, so it is asked for the database explicitly.
+    with connections[router.db_for_read(Student)].cursor() as cursor:
+        cursor.execute(
+            'SELECT rowid FROM %s WHERE %s MATCH %%s ORDER BY %s LIMIT %%s' % (SEARCH_TABLE, SEARCH_TABLE, RANK),
+            [expression, limit],
+        )
+        rowids = [row[0] for row in cursor.fetchall()]
+
+    students = Student.objects.select_related('classroom').in_bulk(
+        [rowid // 2 for rowid in rowids if rowid % 2 == 0]
+    )
+    classrooms = Classroom.objects.in_bulk([rowid // 2 for rowid in rowids if rowid % 2 == 1])
+    results = []
+    for rowid in rowids:
+        # Skips rows deleted since the match, which in_bulk did not find.
+        if rowid % 2 == 0 and rowid // 2 in students:
+            results.append(('student', students[rowid // 2]))
+        elif rowid % 2 == 1 and rowid // 2 in classrooms:
+            results.append(('classroom', classrooms[rowid // 2]))
+    return results
+
+
+def _search_fallback(text, teacher_id, limit):
+    # Unranked prefix matching of the first word, for databases without FTS5.
+    token = TOKEN.findall(text)[0]
+    classrooms = Classroom.objects.filter(Q(name__istartswith=token) | Q(subject__istartswith=token))
+    students = Student.objects.active().select_related('classroom').filter(name__istartswith=token)
+    if teacher_id is not None:
+        classrooms = classrooms.filter(teacher_id=teacher_id)
+        students = students.filter(classroom__teacher_id=teacher_id)
+    results = [('student', student) for student in students.order_by('name', 'id')[:limit]]
+    results += [('classroom', classroom) for classroom in classrooms.order_by('name', 'id')[:limit]]
+    return results[:limit]
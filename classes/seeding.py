@@ -0,0 +1,158 @@
+import datetime
+import random
+from contextlib import ExitStack
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max
+
+from .cache import bump_students_version, bump_year_version
+from .models import Classroom, Student
+from .ranking import rebuild_rankings
+from .search import index_classrooms_after, index_students_after
+from .stats import rebuild_stats
+
+
+DEFAULT_PASSWORD = 'seed-password-1234'
+
+FIRST_NAMES = (
+    'Laila', 'Salwa', 'Sara', 'Noor', 'Huda', 'Maryam', 'Fatma', 'Dana',
+    'Ali', 'Omar', 'Yousef', 'Khaled', 'Hamad', 'Fahad', 'Saad', 'Nasser',
+)
+LAST_NAMES = (
+    'Alsabah', 'Alkhaled', 'Alghanim', 'Alsaleh', 'Alenezi', 'Alotaibi',
+    'Alrashidi', 'Almutairi', 'Alajmi', 'Alshammari', 'Alhajri', 'Alazmi',
+)
+SUBJECTS = ('Math', 'Science', 'English', 'Arabic', 'History', 'Art', 'Music', 'Physics')
+GENDERS = ('MALE', 'FEMALE')
+
+
+def last_pk(model):
+    # bulk_create does not return SQLite primary keys; the rows it inserts
+    # are the ones after the current last id.
+    return model.objects.aggregate(last=Max('id'))['last'] or 0
+
+
+def teacher_username(prefix, number):
+    return '%s-%d' % (prefix, number)
+
+
+def create_teachers(count, prefix='teacher', password=DEFAULT_PASSWORD, first=0):
+    # Hashing is deliberately slow, so every teacher shares one hash.
+    hashed = make_password(password)
+    last_id = last_pk(User)
+    User.objects.bulk_create(
+        [User(username=teacher_username(prefix, first + n), password=hashed) for n in range(count)],
+    )
+    return list(
+        User.objects
+        .filter(id__gt=last_id)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+
+
+def create_classrooms(teacher_ids, per_teacher, rng):
+    last_id = last_pk(Classroom)
+    classrooms = [
+        Classroom(
+            name='%s %d-%d' % (rng.choice(SUBJECTS), teacher_id, n),
+            subject=rng.choice(SUBJECTS),
+            year=rng.randint(2015, 2020),
+            teacher_id=teacher_id,
+        )
+        for teacher_id in teacher_ids
+        for n in range(per_teacher)
+    ]
+    Classroom.objects.bulk_create(classrooms)
+    return list(
+        Classroom.objects
+        .filter(id__gt=last_id)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+
+
+def generate_students(classroom_ids, per_classroom, rng):
+    """Yields unsaved students, `per_classroom` for every classroom id."""
+    epoch = datetime.date(1995, 1, 1).toordinal()
+    for classroom_id in classroom_ids:
+        for _ in range(per_classroom):
+            yield Student(
+                name='%s %s' % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)),
+                date_of_birth=datetime.date.fromordinal(epoch + rng.randrange(3650)),
+                gender=rng.choice(GENDERS),
+                exam_grade=Decimal(rng.randrange(0, 10000)) / 100,
+                classroom_id=classroom_id,
+            )
+
+
+def create_students(students, batch_size=10000, commit_batches=False):
+    """
+    Inserts `students` with bulk_create, `batch_size` at a time, and returns
+    the count. With `commit_batches` every batch is its own transaction.
+    """
+    created = 0
+    batch = []
+
+    def flush():
+        with transaction.atomic() if commit_batches else ExitStack():
+            Student.objects.bulk_create(batch)
+
+    for student in students:
+        batch.append(student)
+        if len(batch) >= batch_size:
+            flush()
+            created += len(batch)
+            batch = []
+    if batch:
+        flush()
+        created += len(batch)
+    return created
+
+
+def seed_dataset(teachers, classrooms, students, seed=0, prefix='teacher', password=DEFAULT_PASSWORD,
+                 first_teacher=0, batch_size=10000, single_transaction=True):
+    """
+    Creates `teachers` users, `classrooms` classrooms per teacher and
+    `students` students per classroom. The same seed always produces the
+    same data. Everything runs in one transaction unless
+    `single_transaction` is off, in which case every batch of `batch_size`
+    students is committed on its own.
+    """
+    rng = random.Random(seed)
+    with transaction.atomic() if single_transaction else ExitStack():
+        with transaction.atomic():
+            teacher_ids = create_teachers(teachers, prefix, password, first_teacher)
+            classroom_ids = create_classrooms(teacher_ids, classrooms, rng)
+        last_student_id = last_pk(Student)
+        student_count = create_students(
+            generate_students(classroom_ids, students, rng),
+            batch_size=batch_size,
+            commit_batches=not single_transaction,
+        )
+        # bulk_create skips the signals that maintain the stats, ranks and
+        # search index, and that invalidate the cached tables.
+        years = []
+        with transaction.atomic():
+            rebuild_stats(classroom_ids)
+            if classroom_ids:
+                years = list(
+                    Classroom.objects.filter(id__gte=classroom_ids[0])
+                    .order_by().values_list('year', flat=True).distinct()
+                )
+                rebuild_rankings(years)
+                index_classrooms_after(classroom_ids[0] - 1)
+            index_students_after(last_student_id)
+
+    for classroom_id in classroom_ids:
+        bump_students_version(classroom_id)
+    for year in years:
+        bump_year_version(year)
+    return {
+        'teachers': len(teacher_ids),
+        'classrooms': len(classroom_ids),
+        'students': student_count,
+    }
@@ -0,0 +1,118 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_students_version, bump_year_version
+from .models import Classroom, ClassroomStats, Student, StudentRank
+from .ranking import move_student, rebuild_rankings
+from .search import index_classroom, index_student, rescope_classroom_students, unindex_classroom, unindex_student
+from .stats import add_grades, apply_grade_changes, rebuild_stats, remove_grades, touch_stats
+
+
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+def student_changed(sender, instance, **kwargs):
+    bump_students_version(instance.classroom_id)
+
+
+@receiver(post_save, sender=Classroom)
+@receiver(post_delete, sender=Classroom)
+def classroom_changed(sender, instance, **kwargs):
+    bump_students_version(instance.id)
+
+
+@receiver(post_save, sender=Classroom)
+def classroom_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        ClassroomStats.objects.create(classroom=instance)
+
+
+@receiver(post_save, sender=Classroom)
+def classroom_year_changed(sender, instance, created, raw=False, **kwargs):
+    loaded = getattr(instance, '_loaded_year', None)
+    if not created and not raw and loaded is not None and loaded != instance.year:
+        rebuild_rankings([loaded, instance.year])
+        bump_year_version(loaded)
+        bump_year_version(instance.year)
+    instance._loaded_year = instance.year
+
+
+@receiver(post_save, sender=Classroom)
+def classroom_indexed(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    index_classroom(instance)
+    loaded = getattr(instance, '_loaded_teacher_id', None)
+    if not created and loaded is not None and loaded != instance.teacher_id:
+        rescope_classroom_students(instance)
+    instance._loaded_teacher_id = instance.teacher_id
+
+
+@receiver(post_delete, sender=Classroom)
+def classroom_unindexed(sender, instance, **kwargs):
+    unindex_classroom(instance.id)
+
+
+@receiver(post_save, sender=Student)
+def student_indexed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_student(instance)
+
+
+@receiver(post_delete, sender=Student)
+def student_unindexed(sender, instance, **kwargs):
+    unindex_student(instance.id)
+
+
+@receiver(post_save, sender=Student)
+def student_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    loaded = getattr(instance, '_loaded_grade', None)
+    current = (instance.classroom_id, instance.exam_grade)
+    rank_student(instance, created, loaded)
+    if created:
+        add_grades(instance.classroom_id, [instance.exam_grade])
+    elif loaded is None:
+        # Saved without being loaded first, so the old grade is unknown.
+        rebuild_stats([instance.classroom_id])
+    elif loaded != current:
+        if loaded[0] == current[0]:
+            apply_grade_changes(current[0], added=[current[1]], removed=[loaded[1]])
+        else:
+            remove_grades(loaded[0], [loaded[1]])
+            add_grades(current[0], [current[1]])
+    else:
+        touch_stats(current[0])
+    instance._loaded_grade = current
+
+
+@receiver(post_delete, sender=Student)
+def student_deleted(sender, instance, **kwargs):
+    remove_grades(instance.classroom_id, [instance.exam_grade])
+    # The rank row itself is already gone with the student; only shift the others.
+    year = instance.classroom.year
+    move_student(instance.id, (instance.classroom_id, year, instance.exam_grade), None)
+    bump_year_version(year)
+
+
+def rank_student(student, created, loaded):
+    year = student.classroom.year
+    new = (student.classroom_id, year, student.exam_grade)
+    if created:
+        old = None
+    elif loaded is not None and loaded[0] == student.classroom_id:
+        old = (loaded[0], year, loaded[1])
+    else:
+        # Moved between classrooms, or saved without being loaded first.
+        old = StudentRank.objects.filter(student_id=student.id).values_list(
+            'classroom_id', 'year', 'exam_grade',
+        ).first()
+        if old is None:
+            rebuild_rankings([year])
+            bump_year_version(year)
+            return
+    if old != new:
+        move_student(student.id, old, new)
+        bump_year_version(year)
+        if old is not None and old[1] != year:
+            bump_year_version(old[1])
@@ -0,0 +1,163 @@
+from collections import Counter
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Min, Q, Subquery, Sum, Value, When
+from django.utils import timezone
+
+from .models import Classroom, ClassroomStats, Student
+
+
+GRADE_FIELD = ClassroomStats._meta.get_field('min_grade')
+
+
+def _grades(grades):
+    return [Decimal(str(grade)) for grade in grades]
+
+
+def _bucket_filters():
+    last = ClassroomStats.BUCKETS - 1
+    width = ClassroomStats.BUCKET_WIDTH
+    filters = []
+    for index in range(ClassroomStats.BUCKETS):
+        condition = Q()
+        if index > 0:
+            condition &= Q(exam_grade__gte=index * width)
+        if index < last:
+            condition &= Q(exam_grade__lt=(index + 1) * width)
+        filters.append(('bucket_%d' % index, condition))
+    return filters
+
+
+def rebuild_stats(classroom_ids=None, chunk_size=500, progress=None):
+    """
+    Recomputes the stats of the given classrooms (all of them by default)
+    from their students, with one grouped aggregate query per `chunk_size`
+    classrooms. Each chunk is its own transaction, and `progress(rebuilt)`
+    is called after it.
+    """
+    if classroom_ids is None:
+        classroom_ids = Classroom.objects.order_by('id').values_list('id', flat=True).iterator()
+
+    rebuilt = 0
+    chunk = []
+
+    def flush():
+        nonlocal rebuilt
+        with transaction.atomic():
+            rebuilt += _rebuild_chunk(chunk)
+        if progress is not None:
+            progress(rebuilt)
+
+    for classroom_id in classroom_ids:
+        chunk.append(classroom_id)
+        if len(chunk) >= chunk_size:
+            flush()
+            chunk = []
+    if chunk:
+        flush()
+    return rebuilt
+
+
+def _rebuild_chunk(classroom_ids):
+    buckets = {
+        name: Sum(Case(When(condition, then=Value(1)), default=Value(0), output_field=IntegerField()))
+        for name, condition in _bucket_filters()
+    }
+    rows = Student.objects.filter(classroom_id__in=classroom_ids).order_by().values('classroom_id').annotate(
+        count=Count('id'),
+        total=Sum('exam_grade', output_field=ClassroomStats._meta.get_field('total')),
+        total_squares=Sum(
+            F('exam_grade') * F('exam_grade'),
+            output_field=ClassroomStats._meta.get_field('total_squares'),
+        ),
+        min_grade=Min('exam_grade'),
+        max_grade=Max('exam_grade'),
+        **buckets
+    )
+    computed = {row.pop('classroom_id'): row for row in rows}
+
+    existing = Classroom.objects.filter(id__in=classroom_ids).values_list('id', flat=True)
+    stats = [ClassroomStats(classroom_id=classroom_id, **computed.get(classroom_id, {})) for classroom_id in existing]
+    ClassroomStats.objects.filter(classroom_id__in=classroom_ids).delete()
+    ClassroomStats.objects.bulk_create(stats, batch_size=50)
+    return len(stats)
+
+
+def _extreme(field, aggregate, classroom_id, added, removed):
+    """
+    The new value of min_grade or max_grade, depending on `aggregate`.
+    When a removed grade was (or tied) the extreme it is recomputed from
+    the students, which by now already reflect the change.
+    """
+    lower = aggregate is Min
+    current = F(field)
+    whens = []
+    if removed:
+        boundary = min(removed) if lower else max(removed)
+        recompute = Subquery(
+            Student.objects.filter(classroom_id=classroom_id).order_by()
+            .values('classroom_id').annotate(extreme=aggregate('exam_grade')).values('extreme'),
+            output_field=GRADE_FIELD,
+        )
+        reached = Q(**{field + ('__gte' if lower else '__lte'): boundary})
+        whens.append(When(Q(**{field + '__isnull': True}) | reached, then=recompute))
+    if added:
+        candidate = min(added) if lower else max(added)
+        beaten = Q(**{field + ('__gt' if lower else '__lt'): candidate})
+        whens.append(When(Q(**{field + '__isnull': True}) | beaten, then=Value(candidate)))
+    return Case(*whens, default=current, output_field=GRADE_FIELD)
+
+
+def apply_grade_changes(classroom_id, added=(), removed=()):
+    """
+    Adds `added` to and takes `removed` out of the classroom's running
+    totals with a single UPDATE. Both must already be reflected in the
+    students table.
+    """
+    added, removed = _grades(added), _grades(removed)
+    if not added and not removed:
+        return
+    changes = {
+        'count': F('count') + (len(added) - len(removed)),
+        'total': F('total') + (sum(added) - sum(removed)),
+        'total_squares': F('total_squares') + (
+            sum(grade * grade for grade in added) - sum(grade * grade for grade in removed)
+        ),
+        'min_grade': _extreme('min_grade', Min, classroom_id, added, removed),
+        'max_grade': _extreme('max_grade', Max, classroom_id, added, removed),
+        # Not Now(): SQLite's CURRENT_TIMESTAMP only has whole seconds.
+        'updated_at': timezone.now(),
+    }
+    buckets = Counter(ClassroomStats.bucket_field(grade) for grade in added)
+    buckets.subtract(ClassroomStats.bucket_field(grade) for grade in removed)
+    for field, count in buckets.items():
+        if count:
+            changes[field] = F(field) + count
+
+    # Missing stats are built on first read; only rebuild here when adding,
+    # since removals also run while a classroom is being deleted.
+    if not ClassroomStats.objects.filter(classroom_id=classroom_id).update(**changes) and added:
+        rebuild_stats([classroom_id])
+
+
+def touch_stats(classroom_id):
+    """Marks the roster as changed when a student changed without their grade."""
+    ClassroomStats.objects.filter(classroom_id=classroom_id).update(updated_at=timezone.now())
+
+
+def add_grades(classroom_id, grades):
+    apply_grade_changes(classroom_id, added=grades)
+
+
+def remove_grades(classroom_id, grades):
+    apply_grade_changes(classroom_id, removed=grades)
+
+
+def classroom_stats(classroom):
+    """Returns the classroom's stats, building them the first time."""
+    try:
+        return classroom.stats
+    except ClassroomStats.DoesNotExist:
+        rebuild_stats([classroom.id])
+        return ClassroomStats.objects.get(classroom_id=classroom.id)
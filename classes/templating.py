@@ -0,0 +1,72 @@
+import threading
+import time
+
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+
+from .middleware import current_timings
+
+
+_metrics_lock = threading.Lock()
+_metrics = {}
+
+
+def _record(name, elapsed):
+    with _metrics_lock:
+        metrics = _metrics.setdefault(name, {'renders': 0, 'ms': 0.0, 'max_ms': 0.0})
+        metrics['renders'] += 1
+        metrics['ms'] += elapsed * 1000
+        metrics['max_ms'] = max(metrics['max_ms'], elapsed * 1000)
+
+
+def template_metrics():
+    """
+    Render counts and times per template name. A template's time includes
+    the templates rendered from inside it, such as crispy forms' fields.
+    """
+    with _metrics_lock:
+        return {
+            name: {
+                'renders': metrics['renders'],
+                'avg_ms': metrics['ms'] / metrics['renders'],
+                'max_ms': metrics['max_ms'],
+            }
+            for name, metrics in _metrics.items()
+        }
+
+
+def reset_template_metrics():
+    with _metrics_lock:
+        _metrics.clear()
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        timings = current_timings()
+        # Templates rendered from inside another one (crispy forms, for
+        # instance) are already part of the outer render time.
+        if timings is not None:
+            timings.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            elapsed = time.perf_counter() - start
+            _record(self.template.origin.template_name or '<string>', elapsed)
+            if timings is not None:
+                timings.template_depth -= 1
+                if not timings.template_depth:
+                    timings.template_time += elapsed
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The Django template backend, timing every top-level render."""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
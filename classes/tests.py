@@ -1,7 +1,51 @@
-from django.test import TestCase
+import gzip
+import importlib
+import json
+import datetime
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.sessions.models import Session
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.http import HttpResponse
+from django.template.loader import get_template
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
 from django.contrib.auth.models import User
-from classes.models import Classroom, Student
+from classes.analytics import Cohort, cohort_report, naive_report
+from classes.benchmark import Fixture, run_delete, run_scenario
+from classes.cache import cache_stats, cached_student_rows, reset_cache_stats, year_version
+from classes.checks import check_session_cache
+from classes.exports import EXPORT_CHUNK_SIZE, EXPORT_COLUMNS, EXPORT_ORDERING, export_rows
+from classes.deletion import archive_classroom, can_fast_delete, purge_classroom, restore_classroom
+from classes.database import PIN_COOKIE, ReplicaRouter, pin_reads, reads_pinned, wrote
+from classes.middleware import QueryBudgetExceeded, ReplicaPinningMiddleware, reset_view_metrics
+from classes.imports import import_students
+from classes.jobs import TASKS, claim_job, enqueue, requeue_stale, run_job
+from classes.models import Classroom, ClassroomStats, Job, Student, StudentRank
+from classes.pagination import encode_cursor, keyset_filter, keyset_window
+from classes.ranking import rebuild_rankings
+from classes.search import find, rebuild_search_index, search_available, sqlite_has_fts5
+from classes.seeding import seed_dataset
+from classes.stats import rebuild_stats, touch_stats
+from classes.templatetags.student_links import student_url
+from classes.templating import reset_template_metrics
 
 
 class ModelTestCase(TestCase):
@@ -36,6 +80,9 @@ class SigninTestCase(TestCase):
             password='1234567890-=',
             )
 
+    def setUp(self):
+        caches["ratelimit"].clear()
+
     def test_url(self):
         url = reverse("signin")
         response = self.client.get(url)
@@ -54,6 +101,50 @@ class SigninTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "admin")
 
+    @override_settings(PASSWORD_HASH_ITERATIONS=1000)
+    def test_rehash_on_signin(self):
+        response = self.client.post(reverse("signin"), {"username": "admin", "password": "1234567890-="})
+        self.assertEqual(response.status_code, 302)
+        user = User.objects.get(username="admin")
+        self.assertTrue(user.password.startswith("pbkdf2_sha256$1000$"))
+        self.assertTrue(user.check_password("1234567890-="))
+
+    @override_settings(SIGNIN_RATE_LIMITS={"ip": (10, 60), "username": (2, 60)})
+    def test_rate_limit(self):
+        url = reverse("signin")
+        for _ in range(2):
+            response = self.client.post(url, {"username": "admin", "password": "wrong"})
+            self.assertEqual(response.status_code, 200)
+        # Blocked before the password is checked, even the right one.
+        with self.assertNumQueries(0):
+            response = self.client.post(url, {"username": "Admin", "password": "1234567890-="})
+        self.assertEqual(response.status_code, 429)
+        self.assertContains(response, "Too many failed sign in attempts", status_code=429)
+
+        response = self.client.post(url, {"username": "other", "password": "wrong"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_cached_sessions_need_shared_cache(self):
+        self.assertEqual(check_session_cache(None), [])
+        for engine in ("cache", "cached_db"):
+            with override_settings(SESSION_ENGINE="django.contrib.sessions.backends.%s" % engine):
+                # A sign out on one worker would not reach the others' memory.
+                self.assertEqual([error.id for error in check_session_cache(None)], ["classes.E001"])
+                shared = dict(settings.CACHES, sessions={
+                    "BACKEND": "django.core.cache.backends.memcached.MemcachedCache",
+                    "LOCATION": "127.0.0.1:11211",
+                })
+                with override_settings(CACHES=shared):
+                    self.assertEqual(check_session_cache(None), [])
+
+    @override_settings(SIGNIN_RATE_LIMITS={"ip": (10, 60), "username": (2, 60)})
+    def test_signin_resets_failures(self):
+        url = reverse("signin")
+        self.client.post(url, {"username": "admin", "password": "wrong"})
+        self.client.post(url, {"username": "admin", "password": "1234567890-="})
+        response = self.client.post(url, {"username": "admin", "password": "wrong"})
+        self.assertEqual(response.status_code, 200)
+
     def test_base(self):
         url = reverse("signin")
         response = self.client.get(url)
@@ -361,3 +452,1821 @@ class StudentDeleteTestCase(TestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 302)
 
+
+class ClassroomListTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            )
+        for i in range(0,7):
+            Classroom.objects.create(
+                teacher= cls.user,
+                name=f"Class-{i % 3}",
+                subject="Science",
+                year=2018 + i % 2,
+                )
+
+    def test_url_redirect(self):
+        url = reverse("classroom-list")
+        response = self.client.get(url)
+        self.assertRedirects(response, reverse("signin"))
+
+    def test_keyset_pages(self):
+        self.client.login(username="admin", password="1234567890-=")
+        url = reverse("classroom-list")
+        expected = list(Classroom.objects.order_by("year", "name", "id").values_list("id", flat=True))
+
+        seen = []
+        cursor = None
+        while True:
+            params = {"format": "json", "limit": 3}
+            if cursor:
+                params["after"] = cursor
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page["results"]), 3)
+            seen += [classroom["id"] for classroom in page["results"]]
+            cursor = page["next"]
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, expected)
+
+    def test_page_size_cap(self):
+        self.client.login(username="admin", password="1234567890-=")
+        url = reverse("classroom-list")
+        response = self.client.get(url, {"format": "json", "limit": 10000})
+        self.assertEqual(len(response.json()["results"]), 7)
+
+    def test_html_next_link(self):
+        self.client.login(username="admin", password="1234567890-=")
+        url = reverse("classroom-list")
+        response = self.client.get(url, {"limit": 5})
+        self.assertEqual(len(response.context["classrooms"]), 5)
+        self.assertContains(response, "?after=%s" % response.context["next_cursor"])
+
+    def test_invalid_cursor(self):
+        self.client.login(username="admin", password="1234567890-=")
+        url = reverse("classroom-list")
+        response = self.client.get(url, {"after": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ClassroomDetailPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            )
+        cls.classroom = Classroom.objects.create(
+            teacher= cls.user,
+            name="Hall",
+            subject="Science",
+            year=2018,
+            )
+        for i in range(0,12):
+            Student.objects.create(
+                name=f"Laila-{i % 4}",
+                date_of_birth="1995-01-02",
+                exam_grade=90 + i % 3,
+                classroom=cls.classroom,
+                )
+
+    def setUp(self):
+        self.client.login(username="admin", password="1234567890-=")
+        self.url = reverse("classroom-detail", kwargs={"classroom_id": self.classroom.id})
+        self.expected = list(
+            self.classroom.students.order_by("name", "exam_grade", "id").values_list("id", flat=True)
+        )
+
+    def student_ids(self, content):
+        pattern = r"/student/(\d+)/%d/update/" % self.classroom.id
+        return [int(student_id) for student_id in re.findall(pattern, content)]
+
+    def test_keyset_pages(self):
+        seen = []
+        params = {"limit": 5}
+        while True:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+            seen += self.student_ids(response.content.decode())
+            if response.context["next_cursor"] is None:
+                break
+            params["after"] = response.context["next_cursor"]
+
+        self.assertEqual(seen, self.expected)
+
+    def test_stream(self):
+        response = self.client.get(self.url, {"stream": 1})
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content).decode()
+
+        self.assertIn(self.classroom.name, content)
+        self.assertNotIn("__STUDENT_ROWS__", content)
+        positions = [
+            content.index(reverse("student-update", kwargs={"student_id": student_id, "classroom_id": self.classroom.id}))
+            for student_id in self.expected
+        ]
+        self.assertEqual(positions, sorted(positions))
+
+
+class IndexTestCase(TestCase):
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return " ".join(row[-1] for row in cursor.fetchall())
+
+    def test_detail_query_uses_index(self):
+        students = Student.objects.filter(classroom_id=1).order_by("name", "exam_grade", "id")[:101]
+        plan = self.query_plan(students)
+        self.assertIn("student_class_name_grade_idx", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_teacher_query_uses_index(self):
+        classrooms = Classroom.objects.filter(teacher_id=1).order_by("year")
+        plan = self.query_plan(classrooms)
+        self.assertIn("classroom_teacher_year_idx", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_keyset_page_seeks(self):
+        # A deep page starts at the cursor in the index instead of scanning
+        # it from the first classroom.
+        cursor = encode_cursor([2018, "Hall", 5])
+        plan = self.query_plan(keyset_window(Classroom.objects.all(), ("year", "name", "id"), cursor, 30))
+        self.assertIn("SEARCH", plan)
+        self.assertIn("classroom_year_name_idx (year>?)", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_export_chunk_seeks(self):
+        # Each export chunk after the first starts at the previous one's
+        # last row, so exporting costs the same per chunk however far in.
+        fields = [field for _, field in EXPORT_COLUMNS]
+        chunk = Student.objects.values(*fields).order_by(*EXPORT_ORDERING).filter(
+            keyset_filter(EXPORT_ORDERING, [3, "Anna", 70, 12])
+        )[:EXPORT_CHUNK_SIZE]
+        plan = self.query_plan(chunk)
+        self.assertIn("SEARCH", plan)
+        self.assertIn("student_class_name_grade_idx (classroom_id>?)", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+class StudentFragmentCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            is_staff=True,
+            )
+        cls.classroom = Classroom.objects.create(
+            teacher= cls.user,
+            name="Hall",
+            subject="Science",
+            year=2018,
+            )
+        cls.student = Student.objects.create(
+            name="Laila",
+            date_of_birth="1995-01-02",
+            exam_grade=90,
+            classroom=cls.classroom,
+            )
+
+    def setUp(self):
+        caches["fragments"].clear()
+        reset_cache_stats()
+        self.client.login(username="admin", password="1234567890-=")
+        self.url = reverse("classroom-detail", kwargs={"classroom_id": self.classroom.id})
+
+    def test_hit_and_miss(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        stats = cache_stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 1)
+
+    def test_invalidated_on_save(self):
+        self.client.get(self.url)
+        self.student.name = "Salwa"
+        self.student.save()
+        response = self.client.get(self.url)
+        self.assertContains(response, "Salwa")
+        self.assertEqual(cache_stats()["misses"], 2)
+
+    def test_invalidated_on_delete(self):
+        self.client.get(self.url)
+        self.student.delete()
+        response = self.client.get(self.url)
+        self.assertNotContains(response, "Laila")
+
+    def test_invalidated_by_other_process(self):
+        self.client.get(self.url)
+        # A write made elsewhere bumps that process's version counters, not
+        # these; only the database tells this process about it.
+        Student.objects.filter(id=self.student.id).update(name="Salwa")
+        touch_stats(self.classroom.id)
+        response = self.client.get(self.url)
+        self.assertContains(response, "Salwa")
+
+    def test_stats_endpoint(self):
+        self.client.get(self.url)
+        response = self.client.get(reverse("fragment-cache-stats"))
+        self.assertEqual(response.json()["misses"], 1)
+
+    def test_concurrent_misses_render_once(self):
+        loads = []
+        release = threading.Event()
+
+        def load_page():
+            loads.append(1)
+            release.wait(5)
+            return [], None
+
+        threads = [
+            threading.Thread(target=cached_student_rows, args=(self.classroom, "state", "herd", load_page))
+            for i in range(0,5)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(cache_stats()["misses"], 1)
+        self.assertEqual(cache_stats()["coalesced"], 4)
+
+    def test_lock_in_shared_cache(self):
+        fragments = caches["fragments"]
+
+        def load_page():
+            # Other processes sharing the cache see the lock too.
+            self.assertTrue(any("loading:" in key for key in fragments._cache))
+            return [], None
+
+        cached_student_rows(self.classroom, "state", "lock", load_page)
+        self.assertFalse(any("loading:" in key for key in fragments._cache))
+
+
+class StudentImportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            )
+        cls.user2 = User.objects.create_user(
+            username="admin2",
+            password='1234567890-=',
+            )
+        cls.classroom = Classroom.objects.create(
+            teacher= cls.user,
+            name="Hall",
+            subject="Science",
+            year=2018,
+            )
+
+    def upload(self, content, name="students.csv", **params):
+        url = reverse("student-import", kwargs={"classroom_id": self.classroom.id})
+        if params:
+            url += "?" + "&".join("%s=%s" % item for item in params.items())
+        return self.client.post(url, {"file": SimpleUploadedFile(name, content.encode())})
+
+    def test_import(self):
+        self.client.login(username="admin", password="1234567890-=")
+        rows = ["name,date_of_birth,gender,exam_grade"]
+        rows += [f"Laila-{i},1995-01-02,FEMALE,{i % 100}" for i in range(0,2500)]
+        response = self.upload("\n".join(rows))
+        self.assertRedirects(response, reverse("classroom-detail", kwargs={"classroom_id": self.classroom.id}))
+        self.assertEqual(self.classroom.students.count(), 2500)
+
+    def test_error_report(self):
+        self.client.login(username="admin", password="1234567890-=")
+        content = "\n".join([
+            "name,date_of_birth,gender,exam_grade",
+            "Laila,1995-01-02,FEMALE,95.5",
+            "Salwa,not-a-date,FEMALE,90",
+            "Sara,1995-01-02,FEMALE,1000",
+        ])
+        response = self.upload(content, format="json")
+        report = response.json()
+        self.assertEqual(report["created"], 1)
+        self.assertEqual(report["error_count"], 2)
+        self.assertEqual([error["row"] for error in report["errors"]], [3, 4])
+        self.assertIn("date_of_birth", report["errors"][0]["errors"])
+        self.assertIn("exam_grade", report["errors"][1]["errors"])
+
+    def test_rejects_unknown_format(self):
+        self.client.login(username="admin", password="1234567890-=")
+        response = self.upload("name", name="students.txt")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.classroom.students.count(), 0)
+
+    def test_only_teacher(self):
+        self.client.login(username="admin2", password="1234567890-=")
+        response = self.upload("name,date_of_birth,gender,exam_grade\nLaila,1995-01-02,FEMALE,95")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.classroom.students.count(), 0)
+
+
+class StudentExportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            )
+        cls.user2 = User.objects.create_user(
+            username="admin2",
+            password='1234567890-=',
+            )
+        cls.classrooms = [
+            Classroom.objects.create(teacher=cls.user, name=f"Class-{i}", subject="Science", year=2018)
+            for i in range(0,2)
+        ]
+        other = Classroom.objects.create(teacher=cls.user2, name="Other", subject="Math", year=2018)
+        for classroom in cls.classrooms + [other]:
+            for i in range(0,3):
+                Student.objects.create(
+                    name=f"Laila-{i}",
+                    date_of_birth="1995-01-02",
+                    exam_grade=90 + i,
+                    classroom=classroom,
+                    )
+
+    def setUp(self):
+        self.client.login(username="admin", password="1234567890-=")
+
+    def content(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_classroom_csv(self):
+        url = reverse("classroom-export", kwargs={"classroom_id": self.classrooms[0].id})
+        response = self.client.get(url)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        lines = self.content(response).decode().splitlines()
+        self.assertEqual(lines[0].split(",")[0], "classroom_id")
+        self.assertEqual(len(lines), 4)
+        self.assertIn("Laila-0", lines[1])
+        self.assertIn("90.00", lines[1])
+
+    def test_teacher_ndjson_gzip(self):
+        url = reverse("teacher-export", kwargs={"teacher_id": self.user.id})
+        response = self.client.get(url, {"format": "ndjson", "gzip": 1})
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        rows = [json.loads(line) for line in gzip.decompress(self.content(response)).decode().splitlines()]
+        self.assertEqual(len(rows), 6)
+        self.assertEqual({row["classroom_id"] for row in rows}, {classroom.id for classroom in self.classrooms})
+
+    def test_chunked_rows(self):
+        expected = list(Student.objects.order_by("classroom_id", "name", "exam_grade", "id").values_list("id", flat=True))
+        # Nine students in chunks of two: one bounded query per chunk.
+        with self.assertNumQueries(5):
+            rows = list(export_rows(Student.objects.all(), chunk_size=2))
+        self.assertEqual([row[4] for row in rows], expected)
+
+    def test_unknown_format(self):
+        url = reverse("classroom-export", kwargs={"classroom_id": self.classrooms[0].id})
+        response = self.client.get(url, {"format": "xml"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_other_teacher_forbidden(self):
+        urls = [
+            reverse("classroom-export", kwargs={"classroom_id": self.classrooms[0].id}),
+            reverse("teacher-export", kwargs={"teacher_id": self.user.id}),
+        ]
+        self.client.login(username="admin2", password="1234567890-=")
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 403)
+            self.assertEqual(self.client.post(url).status_code, 403)
+        User.objects.filter(username="admin2").update(is_staff=True)
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class JobQueueTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            )
+        cls.user2 = User.objects.create_user(
+            username="admin2",
+            password='1234567890-=',
+            )
+        cls.classroom = Classroom.objects.create(
+            teacher= cls.user,
+            name="Hall",
+            subject="Science",
+            year=2018,
+            )
+        for i in range(0,3):
+            Student.objects.create(
+                name=f"Laila-{i}",
+                date_of_birth="1995-01-02",
+                exam_grade=90 + i,
+                classroom=cls.classroom,
+                )
+
+    def setUp(self):
+        self.files = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.files)
+        settings_override = override_settings(JOB_FILES_ROOT=self.files)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.login(username="admin", password="1234567890-=")
+
+    def run_jobs(self):
+        output = io.StringIO()
+        call_command("run_jobs", processes=0, once=True, stdout=output)
+        return output.getvalue()
+
+    def status(self, job):
+        return self.client.get(reverse("api-job-detail", kwargs={"job_id": job.id})).json()
+
+    def flaky_task(self, failures):
+        calls = []
+
+        def flaky(job):
+            calls.append(job.attempts)
+            if len(calls) <= failures:
+                raise RuntimeError("try again")
+            return {"calls": len(calls)}
+
+        TASKS["flaky"] = flaky
+        self.addCleanup(TASKS.pop, "flaky")
+        return calls
+
+    def test_background_import(self):
+        url = reverse("student-import", kwargs={"classroom_id": self.classroom.id})
+        content = "name,date_of_birth,gender,exam_grade\nSalwa,1995-01-02,FEMALE,80\nSara,bad,FEMALE,70"
+        response = self.client.post(
+            url + "?format=json&background=1", {"file": SimpleUploadedFile("students.csv", content.encode())},
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response["Location"], response.json()["status_url"])
+        self.assertEqual(response.json()["job"]["status"], "queued")
+        self.assertEqual(self.classroom.students.count(), 3)
+
+        self.assertIn("succeeded", self.run_jobs())
+        status = self.client.get(response["Location"]).json()
+        self.assertEqual(status["status"], "succeeded")
+        self.assertEqual((status["progress"], status["total"]), (2, 2))
+        self.assertEqual(status["result"]["created"], 1)
+        self.assertEqual(status["result"]["error_count"], 1)
+        self.assertEqual(self.classroom.students.count(), 4)
+        self.assertEqual(os.listdir(os.path.join(self.files, "uploads")), [])
+
+    @override_settings(IMPORT_INLINE_MAX_BYTES=10)
+    def test_large_upload_is_queued(self):
+        url = reverse("student-import", kwargs={"classroom_id": self.classroom.id})
+        content = "name,date_of_birth,gender,exam_grade\nSalwa,1995-01-02,FEMALE,80"
+        response = self.client.post(url, {"file": SimpleUploadedFile("students.csv", content.encode())})
+        self.assertRedirects(response, reverse("classroom-detail", kwargs={"classroom_id": self.classroom.id}))
+        self.assertEqual(Job.objects.get().kind, "import_students")
+        self.assertEqual(self.classroom.students.count(), 3)
+
+    def test_bad_file_fails_without_retry(self):
+        url = reverse("student-import", kwargs={"classroom_id": self.classroom.id})
+        response = self.client.post(
+            url + "?format=json&background=1", {"file": SimpleUploadedFile("students.xlsx", b"not a workbook")},
+        )
+        self.run_jobs()
+        status = self.client.get(response["Location"]).json()
+        self.assertEqual(status["status"], "failed")
+        self.assertEqual(status["attempts"], 1)
+        self.assertTrue(status["error"])
+
+    def test_background_export(self):
+        url = reverse("teacher-export", kwargs={"teacher_id": self.user.id})
+        response = self.client.post(url + "?format=ndjson")
+        self.assertEqual(response.status_code, 202)
+        job = Job.objects.get()
+
+        self.run_jobs()
+        status = self.status(job)
+        self.assertEqual(status["status"], "succeeded")
+        self.assertEqual((status["progress"], status["total"]), (3, 3))
+        self.assertNotIn("file", status["result"])
+
+        response = self.client.get(reverse("api-job-download", kwargs={"job_id": job.id}))
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertIn('filename="teacher-%s.ndjson"' % self.user.id, response["Content-Disposition"])
+        rows = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(row)["name"] for row in rows], ["Laila-0", "Laila-1", "Laila-2"])
+
+    def test_district_export_is_staff_only(self):
+        response = self.client.post(reverse("district-export"))
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Job.objects.exists())
+
+    def test_status_is_owner_only(self):
+        job = enqueue("rebuild_stats", owner=self.user)
+        self.client.login(username="admin2", password="1234567890-=")
+        response = self.client.get(reverse("api-job-detail", kwargs={"job_id": job.id}))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(DELETE_INLINE_MAX_STUDENTS=2)
+    def test_classroom_delete_in_background(self):
+        response = self.client.get(reverse("classroom-delete", kwargs={"classroom_id": self.classroom.id}))
+        self.assertRedirects(response, reverse("classroom-list"))
+        # Archived at once, deleted by the worker.
+        self.assertFalse(Classroom.objects.filter(id=self.classroom.id).exists())
+        self.assertTrue(Classroom.all_objects.filter(id=self.classroom.id).exists())
+
+        self.run_jobs()
+        self.assertFalse(Classroom.all_objects.filter(id=self.classroom.id).exists())
+        self.assertFalse(Student.objects.filter(classroom_id=self.classroom.id).exists())
+        status = self.status(Job.objects.get())
+        self.assertEqual(status["status"], "succeeded")
+        self.assertEqual((status["progress"], status["total"]), (3, 3))
+        self.assertEqual(status["result"], {"deleted": 3})
+
+    @override_settings(JOB_RETRY_DELAY=60)
+    def test_retry_with_backoff(self):
+        calls = self.flaky_task(failures=2)
+        job = enqueue("flaky")
+
+        job = run_job(claim_job("test"))
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn("try again", job.error)
+        # Not due again until the delay has passed.
+        self.assertIsNone(claim_job("test"))
+        first_delay = job.run_after - job.updated_at
+
+        Job.objects.filter(id=job.id).update(run_after=job.updated_at)
+        job = run_job(claim_job("test"))
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 2))
+        self.assertGreater(job.run_after - timezone.now(), first_delay)
+
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        job = run_job(claim_job("test"))
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(calls, [1, 2, 3])
+        self.assertEqual(json.loads(Job.objects.get(id=job.id).result), {"calls": 3})
+
+    def test_gives_up_after_max_attempts(self):
+        self.flaky_task(failures=5)
+        job = enqueue("flaky", max_attempts=1)
+        job = run_job(claim_job("test"))
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.FAILED)
+
+    def test_claimed_once(self):
+        job = enqueue("rebuild_stats")
+        self.assertEqual(claim_job("first").id, job.id)
+        self.assertIsNone(claim_job("second"))
+        self.assertEqual(Job.objects.get(id=job.id).worker, "first")
+
+    def test_requeue_stale(self):
+        job = enqueue("rebuild_stats")
+        claim_job("gone")
+        self.assertEqual(requeue_stale(seconds=60), 0)
+        Job.objects.filter(id=job.id).update(updated_at=timezone.now() - datetime.timedelta(minutes=5))
+        self.assertEqual(requeue_stale(seconds=60), 1)
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.QUEUED)
+
+    def test_rebuild_stats_in_background(self):
+        ClassroomStats.objects.filter(classroom=self.classroom).update(count=0)
+        call_command("rebuild_classroom_stats", background=True, stdout=io.StringIO())
+        self.assertEqual(ClassroomStats.objects.get(classroom=self.classroom).count, 0)
+        self.run_jobs()
+        self.assertEqual(ClassroomStats.objects.get(classroom=self.classroom).count, 3)
+        job = Job.objects.get()
+        self.assertEqual((job.progress, job.total), (1, 1))
+
+    def test_import_resumes_after_committed_batch(self):
+        rows = [
+            {"name": f"Sara-{i}", "date_of_birth": "1995-01-02", "gender": "FEMALE", "exam_grade": 70}
+            for i in range(0,5)
+        ]
+        rows[3]["exam_grade"] = "bad"
+        saved = []
+
+        def die_after_first_batch(done, report):
+            if saved:
+                raise RuntimeError("worker died")
+            saved.append((done, json.loads(json.dumps(report))))
+
+        with self.assertRaises(RuntimeError):
+            import_students(self.classroom, rows, batch_size=2, checkpoint=die_after_first_batch)
+        # The first batch committed, the second rolled back.
+        self.assertEqual(saved[0][0], 2)
+        self.assertEqual(self.classroom.students.count(), 5)
+
+        report = import_students(
+            self.classroom, rows, batch_size=2, checkpoint=lambda done, report: None, resume=saved[0],
+        )
+        self.assertEqual((report["created"], report["error_count"]), (4, 1))
+        self.assertEqual(self.classroom.students.filter(name__startswith="Sara").count(), 4)
+        self.assertEqual(ClassroomStats.objects.get(classroom=self.classroom).count, 7)
+
+    def test_superseded_import_rolls_back(self):
+        url = reverse("student-import", kwargs={"classroom_id": self.classroom.id})
+        content = "name,date_of_birth,gender,exam_grade\nSalwa,1995-01-02,FEMALE,80"
+        self.client.post(url + "?background=1", {"file": SimpleUploadedFile("students.csv", content.encode())})
+        job = claim_job("slow")
+        # Taken for dead by requeue_stale and claimed again meanwhile.
+        Job.objects.filter(id=job.id).update(attempts=2, worker="other")
+        run_job(job)
+        self.assertEqual(self.classroom.students.count(), 3)
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.RUNNING)
+
+
+class ClassroomDeletionTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            )
+        cls.classroom = Classroom.objects.create(
+            teacher= cls.user,
+            name="Hall",
+            subject="Science",
+            year=2018,
+            )
+        cls.other = Classroom.objects.create(
+            teacher= cls.user,
+            name="Lab",
+            subject="Physics",
+            year=2018,
+            )
+        for i in range(0,30):
+            Student.objects.create(
+                name=f"Laila-{i}",
+                date_of_birth="1995-01-02",
+                exam_grade=60 + i,
+                classroom=cls.classroom,
+                )
+        for i in range(0,3):
+            Student.objects.create(
+                name=f"Sara-{i}",
+                date_of_birth="1995-01-02",
+                exam_grade=70 + 5 * i,
+                classroom=cls.other,
+                )
+
+    def setUp(self):
+        # A purge clears the id of the instance it deletes.
+        self.classroom = Classroom.objects.get(name="Hall")
+
+    def ranks(self):
+        return sorted(StudentRank.objects.values_list("student_id", "classroom_id", "year", "class_rank", "year_rank"))
+
+    def assertRanksMatch(self):
+        incremental = self.ranks()
+        rebuild_rankings()
+        self.assertEqual(incremental, self.ranks())
+        self.assertEqual(len(incremental), Student.objects.active().count())
+
+    def names(self, text):
+        return sorted(match.name for kind, match in find(text, limit=50))
+
+    def test_purge_in_chunks(self):
+        done = []
+        deleted = purge_classroom(self.classroom, chunk_size=7, progress=done.append)
+        self.assertEqual(deleted, 30)
+        self.assertEqual(done, [7, 14, 21, 28, 30])
+        self.assertFalse(Classroom.all_objects.filter(id=self.classroom.id).exists())
+        self.assertFalse(Student.objects.filter(classroom_id=self.classroom.id).exists())
+        self.assertFalse(ClassroomStats.objects.filter(classroom_id=self.classroom.id).exists())
+        self.assertEqual(self.names("lai"), [])
+        self.assertRanksMatch()
+        self.assertEqual(StudentRank.objects.get(student__name="Sara-2").year_rank, 1)
+
+    def test_queries_do_not_grow_with_the_classroom(self):
+        counts = []
+        for year, size in ((2030, 25), (2031, 60)):
+            classroom = Classroom.objects.create(teacher=self.user, name="Big", subject="Math", year=year)
+            for i in range(0,size):
+                Student.objects.create(name=f"Big-{i}", date_of_birth="1995-01-02", exam_grade=i, classroom=classroom)
+            with CaptureQueriesContext(connection) as queries:
+                purge_classroom(classroom, chunk_size=100)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_sends_no_signal_per_student(self):
+        seen = []
+
+        def receiver(sender, instance, **kwargs):
+            seen.append(instance.id)
+
+        post_delete.connect(receiver, sender=Student)
+        self.addCleanup(post_delete.disconnect, receiver, sender=Student)
+        self.assertTrue(can_fast_delete())
+        self.assertEqual(purge_classroom(self.classroom), 30)
+        self.assertEqual(seen, [])
+        # What the signals would have done is done for the whole classroom.
+        self.assertRanksMatch()
+        self.assertEqual(self.names("lai"), [])
+
+    def test_archive_and_restore(self):
+        archive_classroom(self.classroom)
+        self.assertFalse(Classroom.objects.filter(id=self.classroom.id).exists())
+        self.assertEqual(Student.objects.filter(classroom_id=self.classroom.id).count(), 30)
+        self.assertFalse(StudentRank.objects.filter(classroom_id=self.classroom.id).exists())
+        self.assertRanksMatch()
+        self.assertEqual(self.names("lai"), [])
+        self.assertEqual(self.names("hall"), [])
+
+        restore_classroom(Classroom.all_objects.get(id=self.classroom.id))
+        self.assertTrue(Classroom.objects.filter(id=self.classroom.id).exists())
+        self.assertRanksMatch()
+        self.assertEqual(len(self.names("lai")), 30)
+        self.assertEqual(self.names("hall"), ["Hall"])
+
+    def test_archived_in_dumps(self):
+        archive_classroom(self.classroom)
+        out = io.StringIO()
+        call_command("dumpdata", "classes.Classroom", "classes.Student", stdout=out)
+        rows = json.loads(out.getvalue())
+        dumped = {row["pk"] for row in rows if row["model"] == "classes.classroom"}
+        self.assertIn(self.classroom.id, dumped)
+        # Every dumped student's classroom is in the dump too.
+        self.assertTrue({row["fields"]["classroom"] for row in rows if row["model"] == "classes.student"} <= dumped)
+
+    def test_archive_and_restore_views(self):
+        self.client.login(username="admin", password="1234567890-=")
+        response = self.client.get(reverse("classroom-delete", kwargs={"classroom_id": self.classroom.id}) + "?archive=1")
+        self.assertRedirects(response, reverse("classroom-list"))
+        self.assertNotContains(self.client.get(reverse("classroom-list")), "Hall")
+
+        response = self.client.get(reverse("classroom-restore", kwargs={"classroom_id": self.classroom.id}))
+        self.assertRedirects(response, reverse("classroom-detail", kwargs={"classroom_id": self.classroom.id}))
+        self.assertIsNone(Classroom.objects.get(id=self.classroom.id).archived_at)
+
+    @override_settings(DELETE_INLINE_MAX_STUDENTS=10)
+    def test_no_restore_while_deleting(self):
+        self.client.login(username="admin", password="1234567890-=")
+        self.client.get(reverse("classroom-delete", kwargs={"classroom_id": self.classroom.id}))
+        self.assertEqual(Job.objects.get().kind, "delete_classroom")
+        self.client.get(reverse("classroom-restore", kwargs={"classroom_id": self.classroom.id}))
+        self.assertFalse(Classroom.objects.filter(id=self.classroom.id).exists())
+
+
+class MutationQueryCountTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            )
+        cls.user2 = User.objects.create_user(
+            username="admin2",
+            password='1234567890-=',
+            )
+        cls.classroom = Classroom.objects.create(
+            teacher= cls.user,
+            name="Hall",
+            subject="Science",
+            year=2018,
+            )
+        cls.students = [
+            Student.objects.create(
+                name=f"Laila-{i}",
+                date_of_birth="1995-01-02",
+                exam_grade=90,
+                classroom=cls.classroom,
+                )
+            for i in range(0,3)
+        ]
+
+    def student_url(self, name, student):
+        return reverse(name, kwargs={"student_id": student.id, "classroom_id": self.classroom.id})
+
+    def test_student_update_get(self):
+        self.client.login(username="admin", password="1234567890-=")
+        # session, user, student joined with its classroom
+        with self.assertNumQueries(3):
+            response = self.client.get(self.student_url("student-update", self.students[0]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_student_update_post(self):
+        self.client.login(username="admin", password="1234567890-=")
+        data = {
+            "name":"Laila",
+            "date_of_birth":"1995-01-02",
+            "exam_grade":10,
+            "gender":"FEMALE"
+        }
+        # session, user, student joined with its classroom, update, search
+        # index, shift the ranks below, count the grades above, rank row, stats
+        with self.assertNumQueries(9):
+            response = self.client.post(self.student_url("student-update", self.students[0]), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Student.objects.get(id=self.students[0].id).exam_grade, 10)
+
+    def test_student_update_other_teacher(self):
+        self.client.login(username="admin2", password="1234567890-=")
+        with self.assertNumQueries(3):
+            response = self.client.get(self.student_url("student-update", self.students[0]))
+        self.assertEqual(response.status_code, 302)
+
+    def test_student_delete(self):
+        self.client.login(username="admin", password="1234567890-=")
+        # session, user, student joined with its classroom, delete rank,
+        # delete student, search index, stats, shift the ranks below
+        with self.assertNumQueries(8):
+            response = self.client.get(self.student_url("student-delete", self.students[0]))
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Student.objects.filter(id=self.students[0].id).exists())
+
+    def test_student_delete_other_teacher(self):
+        self.client.login(username="admin2", password="1234567890-=")
+        with self.assertNumQueries(3):
+            self.client.get(self.student_url("student-delete", self.students[0]))
+        self.assertTrue(Student.objects.filter(id=self.students[0].id).exists())
+
+    def test_classroom_delete(self):
+        self.client.login(username="admin", password="1234567890-=")
+        url = reverse("classroom-delete", kwargs={"classroom_id": self.classroom.id})
+        # session, user, classroom with its stats; archiving: savepoint, mark
+        # archived, ranks, a rank shift per student, delete ranks, unindex
+        # students and classroom, release; one chunk of students in a
+        # savepoint; the cascade: collect students, delete stats, ranks and
+        # classroom, unindex classroom
+        with self.assertNumQueries(18 + len(self.students)):
+            response = self.client.get(url)
+        self.assertRedirects(response, reverse("classroom-list"))
+        self.assertFalse(Classroom.objects.filter(id=self.classroom.id).exists())
+
+    def test_classroom_delete_other_teacher(self):
+        self.client.login(username="admin2", password="1234567890-=")
+        url = reverse("classroom-delete", kwargs={"classroom_id": self.classroom.id})
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        self.assertTrue(Classroom.objects.filter(id=self.classroom.id).exists())
+
+
+class QueryTimingMiddlewareTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            is_staff=True,
+            )
+        Classroom.objects.create(
+            teacher= cls.user,
+            name="Hall",
+            subject="Science",
+            year=2018,
+            )
+
+    def setUp(self):
+        reset_view_metrics()
+        self.client.login(username="admin", password="1234567890-=")
+
+    def test_server_timing(self):
+        response = self.client.get(reverse("classroom-list"))
+        timing = response["Server-Timing"]
+        self.assertIn('desc="4 queries"', timing)
+        self.assertIn("tpl;dur=", timing)
+        self.assertIn("total;dur=", timing)
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse("classroom-list"))
+        self.client.get(reverse("classroom-list"))
+        metrics = self.client.get(reverse("metrics")).json()["classroom-list"]
+        self.assertEqual(metrics["requests"], 2)
+        self.assertEqual(metrics["max_queries"], 4)
+        self.assertEqual(sum(bucket["count"] for bucket in metrics["histogram"]), 2)
+
+    @override_settings(QUERY_BUDGETS={"classroom-list": 1}, QUERY_BUDGET_ACTION="raise")
+    def test_budget_exceeded(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse("classroom-list"))
+
+    def test_template_metrics(self):
+        reset_template_metrics()
+        self.client.get(reverse("classroom-list"))
+        self.client.get(reverse("classroom-list"))
+        metrics = self.client.get(reverse("metrics"), {"by": "template"}).json()
+        self.assertEqual(metrics["classroom_list.html"]["renders"], 2)
+        self.assertGreaterEqual(metrics["classroom_list.html"]["max_ms"], metrics["classroom_list.html"]["avg_ms"])
+
+    @override_settings(TEMPLATES=[dict(
+        settings.TEMPLATES[0],
+        OPTIONS=dict(settings.TEMPLATES[0]["OPTIONS"], loaders=[
+            ("django.template.loaders.cached.Loader", ["django.template.loaders.app_directories.Loader"]),
+        ]),
+    )])
+    def test_production_templates(self):
+        # Compiled once and then served from memory.
+        self.assertIs(get_template("base.html").template, get_template("base.html").template)
+        response = self.client.get(reverse("classroom-list"))
+        self.assertContains(response, '<nav class="navbar')
+
+    def test_student_url_tag(self):
+        # Ids that contain the other id's sentinel are substituted as is.
+        for student_id, classroom_id in ((546372819, 7), (3, 918273645), (918273645, 546372819), (12, 5)):
+            for name in ("student-update", "student-delete"):
+                self.assertEqual(
+                    student_url(name, student_id, classroom_id), reverse(name, args=[student_id, classroom_id]),
+                )
+
+    def test_database_metrics(self):
+        self.client.get(reverse("classroom-list"))
+        metrics = self.client.get(reverse("metrics")).json()["classroom-list"]
+        self.assertEqual(metrics["databases"]["default"]["avg_queries"], 4)
+        databases = self.client.get(reverse("metrics"), {"by": "database"}).json()
+        # The list's four queries and the first metrics request's two.
+        self.assertEqual(databases["default"]["queries"], 6)
+
+
+class ReplicaRouterTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            )
+        cls.classroom = Classroom.objects.create(teacher=cls.user, name="Hall", subject="Science", year=2018)
+        cls.student = Student.objects.create(
+            name="Laila", date_of_birth="2000-01-01", exam_grade=80, classroom=cls.classroom,
+        )
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        pin_reads(False)
+        self.addCleanup(pin_reads, False)
+
+    def test_without_replicas(self):
+        self.assertEqual(self.router.db_for_read(Classroom), "default")
+
+    @override_settings(REPLICA_DATABASES=["replica_0", "replica_1"])
+    def test_reads_go_to_replicas(self):
+        self.assertIn(self.router.db_for_read(Classroom), ["replica_0", "replica_1"])
+        self.assertEqual(self.router.db_for_read(Session), "default")
+        self.assertEqual(self.router.db_for_write(Classroom), "default")
+        self.assertFalse(self.router.allow_migrate("replica_0", "classes"))
+        self.assertTrue(self.router.allow_migrate("default", "classes"))
+
+    @override_settings(REPLICA_DATABASES=["replica_0"])
+    def test_reads_after_write_go_to_primary(self):
+        self.router.db_for_write(Classroom)
+        self.assertTrue(wrote())
+        self.assertEqual(self.router.db_for_read(Classroom), "default")
+
+    # The primary stands in for a replica so that the requests can run.
+    @override_settings(REPLICA_DATABASES=["default"])
+    def test_write_sets_pin_cookie(self):
+        self.client.login(username="admin", password="1234567890-=")
+        response = self.client.get(reverse("classroom-list"))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+        url = reverse("api-student-detail", kwargs={"student_id": self.student.id})
+        response = self.client.patch(url, json.dumps({"exam_grade": "90"}), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertFalse(reads_pinned())
+
+    @override_settings(REPLICA_DATABASES=["replica_0"])
+    def test_pin_cookie_pins_reads(self):
+        seen = []
+        middleware = ReplicaPinningMiddleware(lambda request: seen.append(reads_pinned()) or HttpResponse())
+        factory = RequestFactory()
+        middleware(factory.get("/"))
+        request = factory.get("/")
+        request.COOKIES[PIN_COOKIE] = str(time.time() + 5)
+        middleware(request)
+        request.COOKIES[PIN_COOKIE] = str(time.time() - 5)
+        middleware(request)
+        self.assertEqual(seen, [False, True, False])
+
+
+
+class BenchmarkTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.dataset = seed_dataset(2, 2, 5, seed=1)
+
+    def test_seed(self):
+        self.assertEqual(self.dataset, {"teachers": 2, "classrooms": 4, "students": 20})
+        self.assertEqual(Student.objects.count(), 20)
+
+    def test_scenarios(self):
+        fixture = Fixture()
+        for name in (
+            "classroom_list", "classroom_detail", "classroom_detail_herd", "student_update", "mixed", "signin",
+        ):
+            result = run_scenario(name, fixture, requests=3)
+            self.assertEqual(result["requests"], 3)
+            self.assertEqual(result["errors"], 0)
+            self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+            self.assertGreater(result["avg_queries"], 0)
+
+    def test_delete(self):
+        classrooms = list(Classroom.objects.order_by("id"))
+        cascade = run_delete("cascade", classrooms[0::2])
+        fast = run_delete("fast", classrooms[1::2])
+        self.assertEqual(Classroom.all_objects.count(), 0)
+        for result in (cascade, fast):
+            # The first classroom is only traced for memory.
+            self.assertEqual((result["requests"], result["students"]), (1, 5))
+            self.assertGreater(result["peak_kib"], 0)
+        self.assertLess(fast["avg_queries"], cascade["avg_queries"])
+
+
+class DatabaseTuningTestCase(TestCase):
+    def test_pragmas_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute("PRAGMA cache_size")
+            self.assertEqual(cursor.fetchone()[0], -64000)
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_file_database_uses_wal(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        wrapper = DatabaseWrapper(dict(connection.settings_dict, NAME=os.path.join(directory, "db.sqlite3")), "tuning")
+        try:
+            with wrapper.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode")
+                self.assertEqual(cursor.fetchone()[0], "wal")
+        finally:
+            wrapper.close()
+
+    @override_settings(SQLITE_PRAGMAS={"journal_mode": "delete", "synchronous": "full"})
+    def test_journal_mode_from_settings(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        wrapper = DatabaseWrapper(dict(connection.settings_dict, NAME=os.path.join(directory, "db.sqlite3")), "tuning")
+        try:
+            with wrapper.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode")
+                self.assertEqual(cursor.fetchone()[0], "delete")
+                cursor.execute("PRAGMA synchronous")
+                self.assertEqual(cursor.fetchone()[0], 2)
+        finally:
+            wrapper.close()
+
+
+class SeedClassroomsTestCase(TestCase):
+    def seed(self, prefix):
+        out = io.StringIO()
+        call_command("seed_classrooms", teachers=3, classrooms=2, students=4, prefix=prefix, batch_size=5, stdout=out)
+        return out.getvalue()
+
+    def test_seed(self):
+        output = self.seed("teacher")
+        self.assertIn("Created 3 teachers, 6 classrooms and 24 students", output)
+        self.assertEqual(Classroom.objects.filter(teacher__username__startswith="teacher-").count(), 6)
+        self.assertEqual(Student.objects.count(), 24)
+
+    def test_deterministic(self):
+        self.seed("first")
+        self.seed("second")
+        first = Student.objects.filter(classroom__teacher__username__startswith="first-")
+        second = Student.objects.filter(classroom__teacher__username__startswith="second-")
+        fields = ("name", "date_of_birth", "gender", "exam_grade")
+        self.assertEqual(list(first.order_by("id").values_list(*fields)), list(second.order_by("id").values_list(*fields)))
+
+    def test_invalidates_cached_tables(self):
+        before = {year: year_version(year) for year in range(2015, 2021)}
+        self.seed("teacher")
+        for year in Classroom.objects.values_list("year", flat=True).distinct():
+            self.assertNotEqual(year_version(year), before[year])
+
+
+class ClassroomStatsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            )
+        cls.classroom = Classroom.objects.create(
+            teacher= cls.user,
+            name="Hall",
+            subject="Science",
+            year=2018,
+            )
+        cls.other = Classroom.objects.create(
+            teacher= cls.user,
+            name="Other",
+            subject="Math",
+            year=2018,
+            )
+        for grade in (55, 70, 85, 95.5):
+            Student.objects.create(
+                name="Laila",
+                date_of_birth="1995-01-02",
+                exam_grade=grade,
+                classroom=cls.classroom,
+                )
+
+    def assertStatsMatch(self, classroom):
+        stats = ClassroomStats.objects.get(classroom=classroom)
+        incremental = [getattr(stats, field) for field in self.FIELDS]
+        rebuild_stats([classroom.id])
+        stats = ClassroomStats.objects.get(classroom=classroom)
+        self.assertEqual(incremental, [getattr(stats, field) for field in self.FIELDS])
+        return stats
+
+    FIELDS = ["count", "total", "total_squares", "min_grade", "max_grade"] + ["bucket_%d" % i for i in range(10)]
+
+    def test_create(self):
+        stats = self.assertStatsMatch(self.classroom)
+        self.assertEqual(stats.count, 4)
+        self.assertEqual(stats.average, Decimal("76.375"))
+        self.assertEqual(stats.min_grade, Decimal("55"))
+        self.assertEqual(stats.max_grade, Decimal("95.5"))
+        self.assertEqual(stats.buckets, [0, 0, 0, 0, 0, 1, 0, 1, 1, 1])
+
+    def test_update_extreme(self):
+        student = Student.objects.get(exam_grade=95.5)
+        student.exam_grade = 60
+        student.save()
+        stats = self.assertStatsMatch(self.classroom)
+        self.assertEqual(stats.max_grade, Decimal("85"))
+
+    def test_move_classroom(self):
+        student = Student.objects.get(exam_grade=55)
+        student.classroom = self.other
+        student.save()
+        self.assertEqual(self.assertStatsMatch(self.classroom).min_grade, Decimal("70"))
+        self.assertEqual(self.assertStatsMatch(self.other).count, 1)
+
+    def test_delete(self):
+        Student.objects.filter(exam_grade__lt=80).delete()
+        stats = self.assertStatsMatch(self.classroom)
+        self.assertEqual(stats.count, 2)
+        self.assertEqual(stats.min_grade, Decimal("85"))
+
+        Student.objects.all().delete()
+        stats = self.assertStatsMatch(self.classroom)
+        self.assertEqual(stats.count, 0)
+        self.assertIsNone(stats.average)
+
+    def test_bulk_import(self):
+        rows = [{"name": "Sara", "date_of_birth": "1995-01-02", "gender": "FEMALE", "exam_grade": "12.5"}] * 3
+        import_students(self.other, rows)
+        self.assertEqual(self.assertStatsMatch(self.other).count, 3)
+
+    def test_rebuild_command(self):
+        ClassroomStats.objects.all().delete()
+        out = io.StringIO()
+        call_command("rebuild_classroom_stats", stdout=out)
+        self.assertIn("2 classroom(s)", out.getvalue())
+        self.assertEqual(ClassroomStats.objects.get(classroom=self.classroom).count, 4)
+
+    def test_views(self):
+        self.client.login(username="admin", password="1234567890-=")
+        response = self.client.get(reverse("classroom-detail", kwargs={"classroom_id": self.classroom.id}))
+        self.assertContains(response, "Average: 76.38")
+        response = self.client.get(reverse("classroom-list"), {"format": "json"})
+        cards = {card["id"]: card for card in response.json()["results"]}
+        self.assertEqual(cards[self.classroom.id]["students"], 4)
+
+
+class GradeAnalyticsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset(4, 3, 25, seed=2)
+
+    def assertReportsEqual(self, first, second):
+        if isinstance(first, dict):
+            self.assertEqual(set(first), set(second))
+            for key in first:
+                self.assertReportsEqual(first[key], second[key])
+        elif isinstance(first, float):
+            self.assertAlmostEqual(first, second, places=6)
+        else:
+            self.assertEqual(first, second)
+
+    def test_matches_naive(self):
+        as_of = datetime.date(2020, 6, 1)
+        report = cohort_report(Cohort(as_of=as_of))
+        self.assertEqual(report["overall"]["count"], 300)
+        self.assertReportsEqual(report, naive_report(as_of=as_of))
+
+    def test_empty(self):
+        report = cohort_report(Cohort(Student.objects.none()))
+        self.assertEqual(report["overall"], {"count": 0})
+        self.assertEqual(report["by_subject"], {})
+        self.assertIsNone(report["grade_age_correlation"])
+
+    def test_view(self):
+        user = User.objects.create_user(username="admin", password="1234567890-=")
+        self.client.login(username="admin", password="1234567890-=")
+        year = Classroom.objects.values_list("year", flat=True).first()
+        response = self.client.get(reverse("grade-analytics"), {"year": year})
+        expected = Student.objects.filter(classroom__year=year).count()
+        self.assertEqual(response.json()["overall"]["count"], expected)
+        self.assertEqual(list(response.json()["by_year"]), [str(year)])
+
+    def test_command_skips_archived(self):
+        classroom = Classroom.objects.first()
+        archived = classroom.students.count()
+        archive_classroom(classroom)
+        out = io.StringIO()
+        call_command("grade_analytics", stdout=out)
+        self.assertEqual(json.loads(out.getvalue())["overall"]["count"], 300 - archived)
+
+
+class StudentRankTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            )
+        cls.classroom = Classroom.objects.create(
+            teacher= cls.user,
+            name="Hall",
+            subject="Science",
+            year=2018,
+            )
+        cls.other = Classroom.objects.create(
+            teacher= cls.user,
+            name="Other",
+            subject="Math",
+            year=2018,
+            )
+        cls.later = Classroom.objects.create(
+            teacher= cls.user,
+            name="Later",
+            subject="Math",
+            year=2019,
+            )
+        for classroom, grades in ((cls.classroom, (55, 70, 70, 95.5)), (cls.other, (80, 60)), (cls.later, (40,))):
+            for grade in grades:
+                Student.objects.create(
+                    name="Laila %s" % grade,
+                    date_of_birth="1995-01-02",
+                    exam_grade=grade,
+                    classroom=classroom,
+                    )
+
+    def ranks(self):
+        return sorted(StudentRank.objects.values_list("student_id", "classroom_id", "year", "class_rank", "year_rank"))
+
+    def assertRanksMatch(self):
+        incremental = self.ranks()
+        rebuild_rankings()
+        self.assertEqual(incremental, self.ranks())
+        self.assertEqual(len(incremental), Student.objects.count())
+
+    def rank(self, student):
+        rank = StudentRank.objects.get(student=student)
+        return rank.class_rank, rank.year_rank
+
+    def test_create(self):
+        self.assertRanksMatch()
+        self.assertEqual(self.rank(Student.objects.get(exam_grade=95.5)), (1, 1))
+        self.assertEqual(self.rank(Student.objects.get(exam_grade=80)), (1, 2))
+        # Ties share a rank and the next grade skips past them.
+        self.assertEqual([self.rank(s) for s in Student.objects.filter(exam_grade=70)], [(2, 3), (2, 3)])
+        self.assertEqual(self.rank(Student.objects.get(exam_grade=60)), (2, 5))
+        self.assertEqual(self.rank(Student.objects.get(exam_grade=40)), (1, 1))
+
+    def test_update(self):
+        student = Student.objects.get(exam_grade=55)
+        student.exam_grade = 99
+        student.save()
+        self.assertRanksMatch()
+        self.assertEqual(self.rank(student), (1, 1))
+
+    def test_move_classroom(self):
+        student = Student.objects.get(exam_grade=95.5)
+        student.classroom = self.later
+        student.save()
+        self.assertRanksMatch()
+        self.assertEqual(self.rank(student), (1, 1))
+        self.assertEqual(self.rank(Student.objects.get(exam_grade=40)), (2, 2))
+
+    def test_delete(self):
+        Student.objects.get(exam_grade=80).delete()
+        self.assertRanksMatch()
+        self.assertEqual(self.rank(Student.objects.get(exam_grade=60)), (1, 4))
+
+    def test_classroom_year_change(self):
+        classroom = Classroom.objects.get(id=self.other.id)
+        classroom.year = 2019
+        classroom.save()
+        self.assertRanksMatch()
+        self.assertEqual(self.rank(Student.objects.get(exam_grade=80)), (1, 1))
+
+    def test_import(self):
+        rows = [{"name": "Imported", "date_of_birth": "1995-01-02", "gender": "MALE", "exam_grade": "99.5"}]
+        import_students(self.other, rows)
+        self.assertRanksMatch()
+        self.assertEqual(self.rank(Student.objects.get(exam_grade=99.5)), (1, 1))
+
+    def test_leaderboards(self):
+        self.client.login(username="admin", password="1234567890-=")
+        url = reverse("year-leaderboard", kwargs={"year": 2018})
+        results = self.client.get(url, {"top": 2}).json()["results"]
+        self.assertEqual([row["year_rank"] for row in results], [1, 2])
+
+        student = Student.objects.get(exam_grade=80)
+        results = self.client.get(url, {"around": student.id, "k": 1}).json()["results"]
+        # Every student ranked within one place, ties included.
+        self.assertEqual([row["exam_grade"] for row in results], ["95.50", "80.00", "70.00", "70.00"])
+
+        url = reverse("classroom-leaderboard", kwargs={"classroom_id": self.classroom.id})
+        results = self.client.get(url).json()["results"]
+        self.assertEqual([row["class_rank"] for row in results], [1, 2, 2, 4])
+        self.assertEqual(self.client.get(url, {"around": 0}).status_code, 404)
+        self.assertEqual(self.client.get(url, {"top": "x"}).status_code, 400)
+
+    def test_detail_shows_ranks(self):
+        self.client.login(username="admin", password="1234567890-=")
+        url = reverse("classroom-detail", kwargs={"classroom_id": self.other.id})
+        self.assertContains(response=self.client.get(url), text="<td>80.00</td>\n    <td>1</td>\n    <td>2</td>")
+        # A change in another classroom of the same year moves these ranks,
+        # so the cached table must not be served.
+        student = Student.objects.get(exam_grade=95.5)
+        student.exam_grade = 50
+        student.save()
+        self.assertContains(response=self.client.get(url), text="<td>80.00</td>\n    <td>1</td>\n    <td>1</td>")
+
+
+class SearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            )
+        cls.user2 = User.objects.create_user(
+            username="admin2",
+            password='1234567890-=',
+            )
+        cls.classroom = Classroom.objects.create(
+            teacher= cls.user,
+            name="Hall",
+            subject="Science",
+            year=2018,
+            )
+        cls.other = Classroom.objects.create(
+            teacher= cls.user2,
+            name="Lab",
+            subject="Physics",
+            year=2018,
+            )
+        for name, classroom in (("Laila Ahmad", cls.classroom), ("Sara Lail", cls.classroom), ("Laila Omar", cls.other)):
+            Student.objects.create(
+                name=name,
+                date_of_birth="1995-01-02",
+                exam_grade=90,
+                classroom=classroom,
+                )
+
+    def names(self, text, teacher_id=None):
+        return [match.name for kind, match in find(text, teacher_id)]
+
+    def test_prefix(self):
+        self.assertEqual(sorted(self.names("lai")), ["Laila Ahmad", "Laila Omar", "Sara Lail"])
+        self.assertEqual(self.names("lai ahm"), ["Laila Ahmad"])
+        self.assertEqual(self.names("phys"), ["Lab"])
+        self.assertEqual(self.names("!!"), [])
+
+    def test_ranking(self):
+        # Names weigh more than subjects.
+        Student.objects.create(name="Science Club", date_of_birth="1995-01-02", exam_grade=90, classroom=self.classroom)
+        self.assertEqual(self.names("scien", self.user.id), ["Science Club", "Hall"])
+
+    def test_teacher_scope(self):
+        self.assertEqual(sorted(self.names("laila", self.user.id)), ["Laila Ahmad"])
+        self.assertEqual(self.names("laila", self.user2.id), ["Laila Omar"])
+
+    def test_kept_in_sync(self):
+        student = Student.objects.get(name="Laila Omar")
+        student.name = "Mona Omar"
+        student.save()
+        Student.objects.get(name="Laila Ahmad").delete()
+        self.assertEqual(self.names("laila"), [])
+        self.assertEqual(self.names("mona"), ["Mona Omar"])
+
+        classroom = Classroom.objects.get(id=self.other.id)
+        classroom.teacher = self.user
+        classroom.save()
+        self.assertEqual(sorted(self.names("omar", self.user.id)), ["Mona Omar"])
+        self.assertEqual(self.names("lab", self.user2.id), [])
+
+    def test_without_fts5(self):
+        with mock.patch("classes.search.sqlite_has_fts5", return_value=False):
+            self.assertFalse(search_available())
+            # The fallback only matches the start of names and subjects.
+            self.assertEqual(self.names("lai"), ["Laila Ahmad", "Laila Omar"])
+            self.assertEqual(self.names("laila", self.user2.id), ["Laila Omar"])
+
+        migration = importlib.import_module("classes.migrations.0006_search")
+        schema_editor = mock.Mock()
+        schema_editor.connection.vendor = "sqlite"
+        with mock.patch.object(migration, "has_fts5", return_value=False):
+            migration.create_search_table(None, schema_editor)
+        schema_editor.execute.assert_not_called()
+        self.assertEqual(migration.has_fts5(connection), sqlite_has_fts5())
+
+    def test_bulk_import_and_rebuild(self):
+        rows = [{"name": "Imported Student", "date_of_birth": "1995-01-02", "gender": "MALE", "exam_grade": "50"}]
+        import_students(self.classroom, rows)
+        self.assertEqual(self.names("impo"), ["Imported Student"])
+        self.assertEqual(rebuild_search_index(), 6)
+        self.assertEqual(self.names("impo"), ["Imported Student"])
+
+    def test_view(self):
+        self.client.login(username="admin", password="1234567890-=")
+        url = reverse("search")
+        results = self.client.get(url, {"q": "lai"}).json()["results"]
+        self.assertEqual({row["name"] for row in results}, {"Laila Ahmad", "Sara Lail"})
+        self.assertEqual(results[0]["url"], self.classroom.get_absolute_url())
+        results = self.client.get(url, {"q": "lab", "all": 1}).json()["results"]
+        self.assertEqual([(row["type"], row["subject"]) for row in results], [("classroom", "Physics")])
+
+
+class DashboardTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            )
+        cls.user2 = User.objects.create_user(
+            username="admin2",
+            password='1234567890-=',
+            )
+        cls.classroom = Classroom.objects.create(
+            teacher= cls.user,
+            name="Hall",
+            subject="Science",
+            year=2018,
+            )
+        Classroom.objects.create(teacher=cls.user2, name="Other", subject="Math", year=2018)
+        for grade in (80, 90):
+            Student.objects.create(
+                name="Laila",
+                date_of_birth="1995-01-02",
+                exam_grade=grade,
+                classroom=cls.classroom,
+                )
+
+    def setUp(self):
+        self.client.login(username="admin", password="1234567890-=")
+        self.url = reverse("dashboard")
+
+    def test_own_classrooms(self):
+        response = self.client.get(self.url)
+        classrooms = list(response.context["classrooms"])
+        self.assertEqual(classrooms, [self.classroom])
+        self.assertContains(response, "Students: 2, average 85.00")
+        student = Student.objects.get(exam_grade=90)
+        self.assertEqual(classrooms[0].last_modified, student.updated_at)
+
+    def test_constant_queries(self):
+        # session, user, classrooms with stats and last change
+        with self.assertNumQueries(3):
+            self.client.get(self.url)
+        for i in range(0,5):
+            classroom = Classroom.objects.create(teacher=self.user, name=f"Class-{i}", subject="Math", year=2019)
+            Student.objects.create(name="Sara", date_of_birth="1995-01-02", exam_grade=70, classroom=classroom)
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.context["classrooms"]), 6)
+
+
+class HTMLConditionalGetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            )
+        User.objects.create_user(
+            username="admin2",
+            password='1234567890-=',
+            )
+        cls.classroom = Classroom.objects.create(teacher=cls.user, name="Hall", subject="Science", year=2018)
+        cls.neighbour = Classroom.objects.create(teacher=cls.user, name="Lab", subject="Math", year=2018)
+        cls.later = Classroom.objects.create(teacher=cls.user, name="Annex", subject="Art", year=2019)
+        for classroom in (cls.classroom, cls.neighbour, cls.later):
+            Student.objects.create(name="Laila", date_of_birth="1995-01-02", exam_grade=80, classroom=classroom)
+
+    def setUp(self):
+        self.client.login(username="admin", password="1234567890-=")
+        self.detail_url = reverse("classroom-detail", kwargs={"classroom_id": self.classroom.id})
+
+    def assertNotModified(self, url, response):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def assertModified(self, url, response):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+
+    def test_headers(self):
+        for url in (reverse("classroom-list"), self.detail_url):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("ETag", response)
+            # Removing a classroom does not move the latest change.
+            self.assertNotIn("Last-Modified", response)
+            self.assertIn("private", response["Cache-Control"])
+            self.assertIn("no-cache", response["Cache-Control"])
+            self.assertIn("Cookie", response["Vary"])
+
+    def test_list_not_modified(self):
+        url = reverse("classroom-list")
+        response = self.client.get(url)
+        # session, user, then one aggregate over the page's classrooms
+        with self.assertNumQueries(3):
+            self.assertNotModified(url, response)
+
+        Student.objects.create(name="Sara", date_of_birth="1995-01-02", exam_grade=70, classroom=self.later)
+        self.assertModified(url, response)
+        response = self.client.get(url)
+        Classroom.objects.create(teacher=self.user, name="Gym", subject="Sport", year=2020)
+        self.assertModified(url, response)
+
+    def test_list_archive_and_restore(self):
+        url = reverse("classroom-list")
+        response = self.client.get(url)
+        archive_classroom(self.later)
+        self.assertModified(url, response)
+        response = self.client.get(url)
+        restore_classroom(self.later)
+        self.assertModified(url, response)
+        # A client that only kept the date is never told nothing changed.
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date()).status_code, 200)
+
+    def test_detail_archive(self):
+        response = self.client.get(self.detail_url)
+        archive_classroom(self.neighbour)
+        self.assertModified(self.detail_url, response)
+
+    def test_list_page_query(self):
+        url = reverse("classroom-list")
+        response = self.client.get(url)
+        self.assertModified(url + "?limit=1", response)
+        self.assertEqual(self.client.get(url + "?after=bogus").status_code, 400)
+
+    def test_detail_not_modified(self):
+        response = self.client.get(self.detail_url)
+        # session, user, then one aggregate over the year's classrooms
+        with self.assertNumQueries(3):
+            self.assertNotModified(self.detail_url, response)
+
+        # Another year's roster does not move this year's ranks.
+        Student.objects.create(name="Sara", date_of_birth="1995-01-02", exam_grade=99, classroom=self.later)
+        self.assertNotModified(self.detail_url, response)
+
+        # The same year's does.
+        Student.objects.create(name="Sara", date_of_birth="1995-01-02", exam_grade=99, classroom=self.neighbour)
+        self.assertModified(self.detail_url, response)
+
+    def test_detail_per_user(self):
+        response = self.client.get(self.detail_url)
+        self.client.login(username="admin2", password="1234567890-=")
+        self.assertModified(self.detail_url, response)
+
+    def test_detail_with_messages(self):
+        student = Student.objects.filter(classroom=self.classroom).first()
+        self.client.login(username="admin2", password="1234567890-=")
+        cached = self.client.get(self.detail_url)
+        # Only the classroom's teacher may update: redirects with a message.
+        self.client.get(reverse("student-update", kwargs={"student_id": student.id, "classroom_id": self.classroom.id}))
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=cached["ETag"])
+        self.assertContains(response, "Only The Teacher")
+        self.assertNotIn("ETag", response)
+        self.assertNotModified(self.detail_url, cached)
+
+
+class APITestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            )
+        cls.user2 = User.objects.create_user(
+            username="admin2",
+            password='1234567890-=',
+            )
+        cls.classroom = Classroom.objects.create(
+            teacher= cls.user,
+            name="Hall",
+            subject="Science",
+            year=2018,
+            )
+        cls.other = Classroom.objects.create(teacher=cls.user2, name="Other", subject="Math", year=2019)
+        cls.students = [
+            Student.objects.create(
+                name=f"Laila-{i}",
+                date_of_birth="1995-01-02",
+                exam_grade=80 + i,
+                classroom=cls.classroom,
+                )
+            for i in range(0,5)
+        ]
+
+    def setUp(self):
+        self.client.login(username="admin", password="1234567890-=")
+        self.students_url = reverse("api-classroom-students", kwargs={"classroom_id": self.classroom.id})
+
+    def student_url(self, student):
+        return reverse("api-student-detail", kwargs={"student_id": student.id})
+
+    def test_anonymous(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("api-classroom-list")).status_code, 401)
+
+    def test_classroom_list_fields(self):
+        response = self.client.get(reverse("api-classroom-list"), {"fields": "id,students,average_grade"})
+        self.assertEqual(response.json()["results"], [
+            {"id": self.classroom.id, "students": 5, "average_grade": "82.00"},
+            {"id": self.other.id, "students": 0, "average_grade": None},
+        ])
+        response = self.client.get(reverse("api-classroom-list"), {"mine": 1, "fields": "name"})
+        self.assertEqual(response.json()["results"], [{"name": "Hall"}])
+        self.assertEqual(self.client.get(reverse("api-classroom-list"), {"fields": "password"}).status_code, 400)
+
+    def test_student_pages(self):
+        seen = []
+        params = {"limit": 2, "fields": "id"}
+        while True:
+            body = self.client.get(self.students_url, params).json()
+            seen += [row["id"] for row in body["results"]]
+            if body["next"] is None:
+                break
+            params["after"] = body["next"]
+        self.assertEqual(seen, [student.id for student in self.students])
+
+    def test_conditional_get(self):
+        response = self.client.get(self.students_url)
+        etag = response["ETag"]
+        # session, user, classroom with stats: the roster is not read
+        with self.assertNumQueries(3):
+            response = self.client.get(self.students_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(self.students_url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+        # A deletion leaves no updated_at behind but still changes the ETag.
+        Student.objects.get(id=self.students[0].id).delete()
+        response = self.client.get(self.students_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 4)
+
+    def test_classroom_list_conditional(self):
+        url = reverse("api-classroom-list")
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Classroom.objects.filter(id=self.other.id).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # A changed roster keeps the count and ids but not the latest change.
+        etag = self.client.get(url)["ETag"]
+        student = Student.objects.get(id=self.students[0].id)
+        student.exam_grade = 60
+        student.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_classroom_list_page_conditional(self):
+        url = reverse("api-classroom-list")
+        etag = self.client.get(url, {"limit": 1})["ETag"]
+        # A classroom two pages on does not change the first page.
+        Classroom.objects.create(teacher=self.user2, name="Gym", subject="Sport", year=2020)
+        self.assertEqual(self.client.get(url, {"limit": 1}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, {"after": "bogus"}).status_code, 400)
+
+    def test_private(self):
+        urls = [
+            reverse("api-classroom-list"),
+            reverse("api-classroom-detail", kwargs={"classroom_id": self.classroom.id}),
+            self.students_url,
+            self.student_url(self.students[0]),
+        ]
+        for url in urls:
+            response = self.client.get(url)
+            self.assertIn("private", response["Cache-Control"])
+            self.assertIn("Cookie", response["Vary"])
+            self.client.login(username="admin2", password="1234567890-=")
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+            self.client.login(username="admin", password="1234567890-=")
+
+    def test_student_writes(self):
+        data = {"name": "Sara", "date_of_birth": "1996-03-04", "gender": "FEMALE", "exam_grade": "70.5"}
+        response = self.client.post(self.students_url, json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        student = Student.objects.get(id=response.json()["id"])
+        self.assertEqual(student.classroom, self.classroom)
+
+        url = self.student_url(student)
+        response = self.client.patch(url, json.dumps({"exam_grade": "99"}), content_type="application/json")
+        self.assertEqual(response.json()["exam_grade"], "99")
+        self.assertEqual(Student.objects.get(id=student.id).name, "Sara")
+
+        response = self.client.put(url, json.dumps({"name": "Sara"}), content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("date_of_birth", response.json()["errors"])
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_other_teacher_cannot_write(self):
+        self.client.login(username="admin2", password="1234567890-=")
+        url = self.student_url(self.students[0])
+        self.assertEqual(self.client.get(url).json()["name"], "Laila-0")
+        self.assertEqual(self.client.delete(url).status_code, 403)
+        response = self.client.post(self.students_url, "{}", content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(Student.objects.filter(id=self.students[0].id).exists())
+
+
+class BulkGradeTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="admin",
+            password='1234567890-=',
+            )
+        cls.user2 = User.objects.create_user(
+            username="admin2",
+            password='1234567890-=',
+            )
+        cls.classroom = Classroom.objects.create(
+            teacher= cls.user,
+            name="Hall",
+            subject="Science",
+            year=2018,
+            )
+        cls.other = Classroom.objects.create(teacher=cls.user2, name="Other", subject="Math", year=2018)
+        cls.stranger = Student.objects.create(name="Omar", date_of_birth="1995-01-02", exam_grade=50, classroom=cls.other)
+        for i in range(0,30):
+            Student.objects.create(
+                name=f"Laila-{i}",
+                date_of_birth="1995-01-02",
+                exam_grade=60,
+                classroom=cls.classroom,
+                )
+
+    def setUp(self):
+        self.client.login(username="admin", password="1234567890-=")
+        self.students = list(self.classroom.students.order_by("id"))
+        self.url = reverse("student-grades", kwargs={"classroom_id": self.classroom.id})
+        self.api_url = reverse("api-classroom-grades", kwargs={"classroom_id": self.classroom.id})
+
+    def assertMaintained(self):
+        stats = ClassroomStats.objects.get(classroom=self.classroom)
+        incremental = [stats.count, stats.total, stats.min_grade, stats.max_grade, stats.buckets]
+        ranks = sorted(StudentRank.objects.values_list("student_id", "class_rank", "year_rank"))
+        rebuild_stats([self.classroom.id])
+        rebuild_rankings([2018])
+        stats = ClassroomStats.objects.get(classroom=self.classroom)
+        self.assertEqual(incremental, [stats.count, stats.total, stats.min_grade, stats.max_grade, stats.buckets])
+        self.assertEqual(ranks, sorted(StudentRank.objects.values_list("student_id", "class_rank", "year_rank")))
+
+    def test_form(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, 'name="grade_%d"' % self.students[0].id)
+        data = {"grade_%d" % student.id: 70 + i % 25 for i, student in enumerate(self.students)}
+        data["grade_%d" % self.students[1].id] = ""
+        # session, user, classroom, students, savepoint, current grades,
+        # one grade UPDATE per 200 students, stats, re-rank the year (delete,
+        # read, insert), release.
+        with self.assertNumQueries(12):
+            response = self.client.post(self.url, data)
+        self.assertRedirects(response, reverse("classroom-detail", kwargs={"classroom_id": self.classroom.id}))
+        self.assertEqual(Student.objects.get(id=self.students[0].id).exam_grade, 70)
+        self.assertEqual(Student.objects.get(id=self.students[1].id).exam_grade, 60)
+        self.assertMaintained()
+
+    def test_form_rejects_invalid_grades(self):
+        data = {"grade_%d" % self.students[0].id: "100.5", "grade_%d" % self.students[1].id: "9.999"}
+        response = self.client.post(self.url, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["form"].errors)
+        self.assertFalse(Student.objects.exclude(exam_grade=60).filter(classroom=self.classroom).exists())
+
+    def test_api(self):
+        grades = {str(self.students[0].id): "99.5", str(self.students[1].id): "10"}
+        response = self.client.post(self.api_url, json.dumps({"grades": grades}), content_type="application/json")
+        self.assertEqual(response.json(), {"updated": 2})
+        self.assertEqual(Student.objects.get(id=self.students[0].id).exam_grade, Decimal("99.5"))
+        self.assertEqual(StudentRank.objects.get(student=self.students[0]).class_rank, 1)
+        self.assertMaintained()
+
+    def test_api_rejects_other_classrooms_students(self):
+        grades = {str(self.stranger.id): "99"}
+        response = self.client.post(self.api_url, json.dumps({"grades": grades}), content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Student.objects.get(id=self.stranger.id).exam_grade, 50)
+
+    def test_other_teacher(self):
+        self.client.login(username="admin2", password="1234567890-=")
+        grades = {str(self.students[0].id): "99"}
+        response = self.client.post(self.api_url, json.dumps({"grades": grades}), content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+        self.assertRedirects(self.client.get(self.url), reverse("classroom-detail", kwargs={"classroom_id": self.classroom.id}))
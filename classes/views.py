@@ -1,37 +1,335 @@
+from django.conf import settings
 from django.shortcuts import render, redirect
 from django.contrib import messages
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.template.loader import get_template, render_to_string
+from django.urls import reverse
 
 from django.contrib.auth import login, authenticate, logout
-
-from .models import Classroom, Student
-from .forms import ClassroomForm, SignupForm, SigninForm, StudentForm
+from django.db.models import Max, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Classroom, Student, StudentRank
+from .analytics import Cohort, cohort_report
+from .cache import cache_stats, cached_student_rows
+from .conditional import classrooms_state, conditional
+from .deletion import archive_classroom, purge_classroom, restore_classroom
+from .forms import BulkGradeForm, ClassroomForm, SignupForm, SigninForm, StudentForm, StudentImportForm
+from .exports import EXPORT_FORMATS, export_response
+from .grades import set_grades
+from .imports import ImportFormatError, import_students, iter_rows
+from .jobs import enqueue, job_status, pending_jobs, save_upload
+from .middleware import database_metrics, view_metrics
+from .pagination import InvalidCursor, get_page_size, keyset_chunks, keyset_page, keyset_window
+from .ranking import around, top
+from .ratelimit import signin_blocked, signin_failed, signin_succeeded
+from .search import SEARCH_LIMIT, SEARCH_MAX_LIMIT, find
+from .stats import classroom_stats
+from .templating import template_metrics
+
+CLASSROOM_ORDERING = ('year', 'name', 'id')
+CLASSROOM_CARD_FIELDS = ('id', 'name', 'subject', 'year', 'stats__count', 'stats__total')
+
+STUDENT_ORDERING = ('name', 'exam_grade', 'id')
+STUDENT_PAGE_SIZE = 100
+STUDENT_MAX_PAGE_SIZE = 500
+STUDENT_CHUNK_SIZE = 500
+STUDENT_ROWS_MARKER = '__STUDENT_ROWS__'
+
+LEADERBOARD_SIZE = 10
+LEADERBOARD_MAX_SIZE = 100
+LEADERBOARD_DISTANCE = 5
+LEADERBOARD_MAX_DISTANCE = 50
 
 def classroom_list(request):
     if request.user.is_anonymous:
         return redirect('signin')
 
-    classrooms = Classroom.objects.all()
+    cursor = request.GET.get('after')
+    size = get_page_size(request)
+    try:
+        # Only the page's own classrooms (and the first of the next page)
+        # decide whether it changed, so this costs the same on any page.
+        state = classrooms_state(keyset_window(Classroom.objects.all(), CLASSROOM_ORDERING, cursor, size))
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor")
+    return conditional(request, state, lambda: classroom_list_page(request, cursor, size), private=True)
+
+
+def classroom_list_page(request, cursor, size):
+    classrooms = Classroom.objects.select_related('stats').only(*CLASSROOM_CARD_FIELDS)
+    classrooms, next_cursor = keyset_page(classrooms, CLASSROOM_ORDERING, cursor=cursor, size=size)
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            "results": [
+                {
+                    "id": classroom.id,
+                    "name": classroom.name,
+                    "subject": classroom.subject,
+                    "year": classroom.year,
+                    "students": classroom.stats.count if hasattr(classroom, 'stats') else None,
+                    "average_grade": classroom.stats.average if hasattr(classroom, 'stats') else None,
+                    "url": classroom.get_absolute_url(),
+                }
+                for classroom in classrooms
+            ],
+            "next": next_cursor,
+        })
+
     context = {
         "classrooms": classrooms,
+        "next_cursor": next_cursor,
     }
     return render(request, 'classroom_list.html', context)
 
 
+def dashboard(request):
+    """
+    The teacher's own classrooms with their student count, average grade
+    and when anything in them last changed, all in one query: the counts
+    come from the maintained stats and the times from one grouped MAX.
+    """
+    if request.user.is_anonymous:
+        return redirect('signin')
+
+    classrooms = (
+        Classroom.objects
+        .filter(teacher=request.user)
+        .select_related('stats')
+        .annotate(last_modified=Greatest('updated_at', Coalesce(Max('students__updated_at'), 'updated_at')))
+        .order_by(*CLASSROOM_ORDERING)
+    )
+    context = {
+        "classrooms": classrooms,
+    }
+    return render(request, 'dashboard.html', context)
+
+
 def classroom_detail(request, classroom_id):
     if request.user.is_anonymous:
         return redirect('signin')
 
-    classroom = Classroom.objects.get(id=classroom_id)
-    students = classroom.students.all().order_by('name','exam_grade')
+    # The table shows ranks within the whole year, so a change to any
+    # classroom or roster of the year changes the page.
+    year = Classroom.objects.filter(id=classroom_id).values('year')[:1]
+    state = classrooms_state(Classroom.objects.filter(year=Subquery(year)))
+    return conditional(request, state, lambda: classroom_detail_page(request, classroom_id, state[0]), private=True)
+
+
+def classroom_detail_page(request, classroom_id, year_state):
+    classroom = Classroom.objects.select_related('stats').get(id=classroom_id)
+
+    if request.GET.get('stream'):
+        return StreamingHttpResponse(stream_classroom_detail(request, classroom))
+
+    cursor = request.GET.get('after', '')
+    size = get_page_size(request, STUDENT_PAGE_SIZE, STUDENT_MAX_PAGE_SIZE)
+    try:
+        student_rows, next_cursor = cached_student_rows(
+            classroom,
+            year_state,
+            '%s:%s' % (cursor, size),
+            lambda: keyset_page(
+                classroom.students.select_related('rank'), STUDENT_ORDERING, cursor=cursor, size=size,
+            ),
+        )
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor")
 
     context = {
         "classroom": classroom,
-        "students": students
+        "stats": classroom_stats(classroom),
+        "student_rows": student_rows,
+        "next_cursor": next_cursor,
     }
     return render(request, 'classroom_detail.html', context)
 
 
+def stream_classroom_detail(request, classroom):
+    """
+    Yields the whole detail page with every student, rendering the table
+    body chunk by chunk so memory stays flat however big the classroom is.
+    """
+    page = render_to_string('classroom_detail.html', {
+        "classroom": classroom,
+        "stats": classroom_stats(classroom),
+        "rows_marker": STUDENT_ROWS_MARKER,
+    }, request=request)
+    head, tail = page.split(STUDENT_ROWS_MARKER, 1)
+    yield head
+
+    rows_template = get_template('student_rows.html')
+    students = classroom.students.select_related('rank')
+    for chunk in keyset_chunks(students, STUDENT_ORDERING, STUDENT_CHUNK_SIZE):
+        yield rows_template.render({"classroom": classroom, "students": chunk})
+
+    yield tail
+
+
+def classroom_leaderboard(request, classroom_id):
+    if request.user.is_anonymous:
+        return redirect('signin')
+
+    return leaderboard(request, StudentRank.objects.filter(classroom_id=classroom_id), 'class_rank')
+
+
+def year_leaderboard(request, year):
+    if request.user.is_anonymous:
+        return redirect('signin')
+
+    return leaderboard(request, StudentRank.objects.filter(year=year), 'year_rank')
+
+
+def leaderboard(request, ranks, order):
+    """
+    The best `top` students of `ranks`, or with `around` (a student id)
+    the students within `k` places of that student.
+    """
+    try:
+        if request.GET.get('around'):
+            distance = min(int(request.GET.get('k', LEADERBOARD_DISTANCE)), LEADERBOARD_MAX_DISTANCE)
+            rank = ranks.filter(student_id=int(request.GET['around'])).values_list(order, flat=True).first()
+            if rank is None:
+                raise Http404("No such student")
+            rows = around(ranks, order, rank, max(distance, 0))
+        else:
+            rows = top(ranks, order, min(int(request.GET.get('top', LEADERBOARD_SIZE)), LEADERBOARD_MAX_SIZE))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid leaderboard parameters")
+
+    return JsonResponse({
+        "results": [
+            {
+                "id": row.student_id,
+                "name": row.student.name,
+                "classroom": row.classroom_id,
+                "exam_grade": row.exam_grade,
+                "class_rank": row.class_rank,
+                "year_rank": row.year_rank,
+            }
+            for row in rows
+        ],
+    })
+
+
+def search(request):
+    """
+    Prefix search over student names and classroom names and subjects,
+    best match first. Only the teacher's own classrooms are searched
+    unless `all` is given.
+    """
+    if request.user.is_anonymous:
+        return redirect('signin')
+
+    teacher_id = None if request.GET.get('all') else request.user.id
+    size = get_page_size(request, SEARCH_LIMIT, SEARCH_MAX_LIMIT)
+    results = []
+    for kind, match in find(request.GET.get('q', ''), teacher_id, size):
+        if kind == 'student':
+            results.append({
+                "type": kind,
+                "id": match.id,
+                "name": match.name,
+                "classroom": match.classroom.name,
+                "url": match.classroom.get_absolute_url(),
+            })
+        else:
+            results.append({
+                "type": kind,
+                "id": match.id,
+                "name": match.name,
+                "subject": match.subject,
+                "year": match.year,
+                "url": match.get_absolute_url(),
+            })
+    return JsonResponse({"results": results})
+
+
+def fragment_cache_stats(request):
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    return JsonResponse(cache_stats())
+
+
+def classroom_export(request, classroom_id):
+    if request.user.is_anonymous:
+        return redirect('signin')
+
+    classroom = Classroom.objects.get(id=classroom_id)
+    if classroom.teacher_id != request.user.id and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return export_students(request, classroom.students.all(), 'classroom-%s' % classroom.id, classroom_id=classroom.id)
+
+
+def teacher_export(request, teacher_id):
+    if request.user.is_anonymous:
+        return redirect('signin')
+    if teacher_id != request.user.id and not request.user.is_staff:
+        return HttpResponseForbidden()
+
+    students = Student.objects.active().filter(classroom__teacher_id=teacher_id)
+    return export_students(request, students, 'teacher-%s' % teacher_id, teacher_id=teacher_id)
+
+
+def district_export(request):
+    """Every student of every classroom."""
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    return export_students(request, Student.objects.active(), 'district')
+
+
+def export_students(request, students, filename, **scope):
+    """
+    Streams the export, or with POST queues it as a background job whose
+    file is downloaded once the job has finished.
+    """
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest("Unknown export format")
+    gzip = bool(request.GET.get('gzip'))
+    if request.method == 'POST':
+        job = enqueue(
+            'export_students', owner=request.user, filename=filename,
+            export_format=export_format, gzip=gzip, **scope
+        )
+        return job_accepted(job)
+    return export_response(students, filename, export_format, gzip=gzip)
+
+
+def job_accepted(job):
+    """Answers 202 with the queued job and the URL to poll for its status."""
+    status_url = reverse('api-job-detail', kwargs={'job_id': job.id})
+    response = JsonResponse({"job": job_status(job), "status_url": status_url}, status=202)
+    response['Location'] = status_url
+    return response
+
+
+def metrics(request):
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    if request.GET.get('by') == 'database':
+        return JsonResponse(database_metrics())
+    if request.GET.get('by') == 'template':
+        return JsonResponse(template_metrics())
+    return JsonResponse(view_metrics())
+
+
+def grade_analytics(request):
+    if request.user.is_anonymous:
+        return redirect('signin')
+
+    students = Student.objects.active()
+    if request.GET.get('subject'):
+        students = students.filter(classroom__subject=request.GET['subject'])
+    if request.GET.get('year'):
+        try:
+            students = students.filter(classroom__year=int(request.GET['year']))
+        except ValueError:
+            return HttpResponseBadRequest("Invalid year")
+    return JsonResponse(cohort_report(Cohort(students)))
+
+
 def classroom_create(request):
     if request.user.is_anonymous:
         return redirect('signin')
@@ -83,17 +381,47 @@ def classroom_delete(request, classroom_id):
     if request.user.is_anonymous:
         return redirect('signin')
 
-    classroom = Classroom.objects.get(id=classroom_id)
+    classroom = Classroom.objects.select_related('stats').filter(id=classroom_id, teacher=request.user).first()
 
-    if not(classroom.teacher == request.user):
+    if classroom is None:
         messages.success(request, "Only the Teacher of this classroom can  delete Student's Info!!!")
         return redirect('classroom-detail', classroom_id)
 
-    Classroom.objects.get(id=classroom_id).delete()
+    if request.GET.get('archive'):
+        archive_classroom(classroom)
+        messages.success(request, "Successfully Archived!")
+        return redirect('classroom-list')
+
+    stats = getattr(classroom, 'stats', None)
+    if stats is not None and stats.count > settings.DELETE_INLINE_MAX_STUDENTS:
+        # Archived right away so it is gone from every page while a worker
+        # deletes the students.
+        archive_classroom(classroom)
+        enqueue('delete_classroom', owner=request.user, classroom_id=classroom.id)
+        messages.success(request, "The classroom is being deleted in the background.")
+        return redirect('classroom-list')
+
+    purge_classroom(classroom)
     messages.success(request, "Successfully Deleted!")
     return redirect('classroom-list')
 
 
+def classroom_restore(request, classroom_id):
+    """Brings back an archived classroom that is not being deleted."""
+    if request.user.is_anonymous:
+        return redirect('signin')
+
+    classroom = Classroom.all_objects.filter(id=classroom_id, teacher=request.user, archived_at__isnull=False).first()
+
+    if classroom is None or pending_jobs('delete_classroom', classroom_id=classroom.id).exists():
+        messages.success(request, "Only an archived classroom of yours can be restored!!!")
+        return redirect('classroom-list')
+
+    restore_classroom(classroom)
+    messages.success(request, "Successfully Restored!")
+    return redirect('classroom-detail', classroom_id)
+
+
 def student_add(request, classroom_id):
     if request.user.is_anonymous:
         return redirect('signin')
@@ -120,28 +448,109 @@ def student_add(request, classroom_id):
     return render(request, 'student_add.html', context)
 
 
-def student_update(request, student_id, classroom_id):
+def student_import(request, classroom_id):
     if request.user.is_anonymous:
         return redirect('signin')
 
     classroom = Classroom.objects.get(id=classroom_id)
-    student = Student.objects.get(id=student_id)
 
     if not(classroom.teacher == request.user):
+        messages.success(request, "Only the Teacher of this classroom  can add a student(s)!!!")
+        return redirect('classroom-detail', classroom_id)
+
+    form = StudentImportForm()
+    report = None
+
+    if request.method == "POST":
+        form = StudentImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                rows = iter_rows(upload)
+                # Big files are imported by a worker; the client polls the job.
+                if request.GET.get('background') or upload.size > settings.IMPORT_INLINE_MAX_BYTES:
+                    job = enqueue(
+                        'import_students', owner=request.user, classroom_id=classroom.id,
+                        path=save_upload(upload), filename=upload.name,
+                    )
+                else:
+                    job, report = None, import_students(classroom, rows)
+            except ImportFormatError as error:
+                form.add_error('file', str(error))
+            else:
+                if job is not None:
+                    if request.GET.get('format') == 'json':
+                        return job_accepted(job)
+                    messages.success(request, "The file is being imported in the background.")
+                    return redirect('classroom-detail', classroom_id)
+                if request.GET.get('format') == 'json':
+                    return JsonResponse(report)
+                messages.success(request, "Imported %s student(s)." % report["created"])
+                if not report["error_count"]:
+                    return redirect('classroom-detail', classroom_id)
+
+        if request.GET.get('format') == 'json':
+            return JsonResponse({"errors": form.errors.get_json_data()}, status=400)
+
+    context = {
+        "form": form,
+        "classroom": classroom,
+        "report": report,
+    }
+    return render(request, 'student_import.html', context)
+
+
+def student_grades(request, classroom_id):
+    """Enters the grades of the whole classroom in one form."""
+    if request.user.is_anonymous:
+        return redirect('signin')
+
+    classroom = Classroom.objects.get(id=classroom_id)
+
+    if classroom.teacher_id != request.user.id:
+        messages.success(request, "Only the Teacher of this classroom can enter grades!!!")
+        return redirect('classroom-detail', classroom_id)
+
+    students = classroom.students.order_by(*STUDENT_ORDERING).only('id', 'name', 'exam_grade', 'classroom_id')
+    form = BulkGradeForm(students)
+    if request.method == "POST":
+        form = BulkGradeForm(students, request.POST)
+        if form.is_valid():
+            changed = set_grades(classroom, form.grades())
+            messages.success(request, "Updated %s grade(s)." % changed)
+            return redirect('classroom-detail', classroom_id)
+
+    context = {
+        "form": form,
+        "classroom": classroom,
+    }
+    return render(request, 'student_grades.html', context)
+
+
+def student_update(request, student_id, classroom_id):
+    if request.user.is_anonymous:
+        return redirect('signin')
+
+    student = Student.objects.select_related('classroom').filter(
+        id=student_id,
+        classroom_id=classroom_id,
+        classroom__teacher=request.user,
+    ).first()
+
+    if student is None:
         messages.success(request, "Only The Teacher of this classroom can update student's information!!!")
         return redirect('classroom-detail', classroom_id)
-    
+
     form = StudentForm(instance=student)
     if request.method == "POST":
         form = StudentForm(request.POST, instance=student)
         if form.is_valid():
             form.save()
-            print(form)
             return redirect('classroom-detail', classroom_id)
 
     context = {
         "form": form,
-        "classroom": classroom,
+        "classroom": student.classroom,
         "student": student,
 
     }
@@ -152,16 +561,21 @@ def student_delete(request, student_id, classroom_id):
     if request.user.is_anonymous:
         return redirect('signin')
 
-    classroom = Classroom.objects.get(id=classroom_id)
+    # Loaded with its classroom so the delete signals can re-rank the year
+    # without fetching it again.
+    student = Student.objects.select_related('classroom').filter(
+        id=student_id,
+        classroom_id=classroom_id,
+        classroom__teacher=request.user,
+    ).first()
 
-    if not(classroom.teacher == request.user):
+    if student is None:
         messages.success(request, "Teacher of this classroom only can delete students!!!")
         return redirect('classroom-detail', classroom_id)
 
-    else:
-        Student.objects.get(id=student_id).delete()
-        messages.success(request, "Successfully Deleted!")
-        return redirect('classroom-detail', classroom_id)
+    student.delete()
+    messages.success(request, "Successfully Deleted!")
+    return redirect('classroom-detail', classroom_id)
 
 
 def signup(request):
@@ -190,10 +604,16 @@ def signin(request):
             username = form.cleaned_data['username']
             password = form.cleaned_data['password']
 
+            if signin_blocked(request, username):
+                form.add_error(None, "Too many failed sign in attempts. Please try again in a few minutes.")
+                return render(request, 'signin.html', {'form': form}, status=429)
+
             user_obj = authenticate(username=username, password=password)
             if user_obj is not None:
+                signin_succeeded(request, username)
                 login(request, user_obj)
-                return redirect('classroom-list')      
+                return redirect('classroom-list')
+            signin_failed(request, username)
 
     context = {
         'form': form,
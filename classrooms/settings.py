@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 MIDDLEWARE = [
+    'classes.middleware.QueryTimingMiddleware',
+    'classes.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,14 +57,34 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Maximum number of SQL queries per URL name. Views over budget are logged,
+# or raise QueryBudgetExceeded when QUERY_BUDGET_ACTION is 'raise'.
+QUERY_BUDGET_DEFAULT = None
+QUERY_BUDGETS = {
+    'classroom-list': 4,
+    'dashboard': 3,
+    'classroom-detail': 5,
+    'student-update': 10,
+    'student-delete': 9,
+}
+QUERY_BUDGET_ACTION = 'log'
+
 ROOT_URLCONF = 'classrooms.urls'
 
+# 'production' compiles every template once and keeps it in memory with
+# the cached loader; 'development' reads and compiles templates on every
+# use, so edits show up without a restart.
+TEMPLATE_MODE = os.environ.get('TEMPLATE_MODE', 'development' if DEBUG else 'production')
+TEMPLATE_LOADERS = ['django.template.loaders.app_directories.Loader']
+if TEMPLATE_MODE == 'production':
+    TEMPLATE_LOADERS = [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)]
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'classes.templating.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': TEMPLATE_LOADERS,
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -83,9 +105,137 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Seconds a connection is kept open between requests; 0 reconnects
+        # on every request.
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
     }
 }
 
+# Read replicas, as a comma separated list of SQLite files in
+# DATABASE_REPLICAS that `manage.py sync_replicas` copies the primary to.
+# classes.database.ReplicaRouter sends reads to them and writes to
+# 'default'; a client that writes reads from 'default' for the next
+# READ_YOUR_WRITES_SECONDS so it always sees its own changes.
+REPLICA_DATABASES = []
+for index, name in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(','))):
+    REPLICA_DATABASES.append('replica_%d' % index)
+    DATABASES['replica_%d' % index] = dict(DATABASES['default'], NAME=name, TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['classes.database.ReplicaRouter']
+READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 10))
+
+# Applied to every new SQLite connection by classes.database. WAL lets
+# readers run alongside the single writer, and synchronous=NORMAL is safe
+# with WAL (only the last commits can be lost on power failure, never
+# corrupting the file). cache_size is in KiB when negative.
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'normal'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'temp_store': 'memory',
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+#
+# The 'fragments' cache holds rendered student tables. It is an LRU-culled
+# local memory cache by default; point FRAGMENT_CACHE_BACKEND and
+# FRAGMENT_CACHE_LOCATION at e.g. FileBasedCache and a directory to share it
+# between worker processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'classrooms',
+    },
+    'fragments': {
+        'BACKEND': os.environ.get('FRAGMENT_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('FRAGMENT_CACHE_LOCATION', 'student-fragments'),
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 2000)),
+        },
+    },
+    'sessions': {
+        'BACKEND': os.environ.get('SESSION_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('SESSION_CACHE_LOCATION', 'sessions'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('SESSION_CACHE_MAX_ENTRIES', 50000)),
+        },
+    },
+    # Failed sign in counters; see SIGNIN_RATE_LIMITS.
+    'ratelimit': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ratelimit',
+    },
+}
+
+
+# Sessions and sign in
+#
+# SESSION_BACKEND picks where sessions live: 'db' (the default) always
+# queries the database and 'signed_cookies' keeps them in the cookie.
+# 'cached_db' reads them from the 'sessions' cache and writes them through
+# to the database, and 'cache' skips the database altogether. Those two are
+# only allowed when SESSION_CACHE_BACKEND is one of SHARED_CACHE_BACKENDS,
+# a cache every worker process shares: signing out clears the session from
+# the cache of the process that handled it only, so with a local memory
+# cache the session would stay signed in on every other worker. The
+# classes.E001 system check enforces this.
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.%s' % os.environ.get('SESSION_BACKEND', 'db')
+SESSION_CACHE_ALIAS = 'sessions'
+SHARED_CACHE_BACKENDS = [
+    'django.core.cache.backends.memcached.MemcachedCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+    'django_redis.cache.RedisCache',
+]
+
+# The first hasher hashes new passwords. Passwords stored with any other
+# one, or with another PASSWORD_HASH_ITERATIONS, are rehashed on their
+# owner's next sign in. Argon2 and bcrypt need the argon2-cffi and bcrypt
+# packages.
+PASSWORD_HASHER_CHOICES = {
+    'pbkdf2': 'classes.hashers.TunablePBKDF2PasswordHasher',
+    'argon2': 'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'bcrypt_sha256': 'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+}
+PASSWORD_HASHERS = [PASSWORD_HASHER_CHOICES[os.environ.get('PASSWORD_HASHER', 'pbkdf2')]]
+PASSWORD_HASHERS += [hasher for hasher in PASSWORD_HASHER_CHOICES.values() if hasher not in PASSWORD_HASHERS]
+PASSWORD_HASHERS += ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 120000))
+
+# Failed sign ins allowed per client address and per username within a
+# window of seconds, after which signin answers 429 without checking the
+# password.
+SIGNIN_RATE_LIMITS = {
+    'ip': (int(os.environ.get('SIGNIN_IP_FAILURES', 50)), 300),
+    'username': (int(os.environ.get('SIGNIN_USERNAME_FAILURES', 5)), 300),
+}
+
+
+# Background jobs
+#
+# Imports, exports and deletes too big to finish within a request are
+# queued as classes.models.Job rows and run by `manage.py run_jobs`. A job
+# that fails is retried JOB_MAX_ATTEMPTS times in all, JOB_RETRY_DELAY
+# seconds later and twice as long after every further failure; one left
+# running for JOB_STALE_SECONDS without a progress report is taken to have
+# lost its worker. Uploads and finished exports are kept in JOB_FILES_ROOT,
+# which is not served to the public.
+
+JOB_FILES_ROOT = os.environ.get('JOB_FILES_ROOT', os.path.join(BASE_DIR, 'jobfiles'))
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = int(os.environ.get('JOB_RETRY_DELAY', 30))
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 60 * 60))
+# Bigger uploads are imported in the background.
+IMPORT_INLINE_MAX_BYTES = int(os.environ.get('IMPORT_INLINE_MAX_BYTES', 1024 * 1024))
+# Classrooms with more students are deleted in the background.
+DELETE_INLINE_MAX_STUDENTS = int(os.environ.get('DELETE_INLINE_MAX_STUDENTS', 5000))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
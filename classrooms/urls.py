@@ -3,22 +3,47 @@ from django.contrib import admin
 from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
-from classes import views
+from classes import api, views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('classrooms/', views.classroom_list, name='classroom-list'),
+    path('dashboard/', views.dashboard, name='dashboard'),
     path('classrooms/<int:classroom_id>/', views.classroom_detail, name='classroom-detail'),
 
+    path('classrooms/<int:classroom_id>/export/', views.classroom_export, name='classroom-export'),
+    path('teachers/<int:teacher_id>/export/', views.teacher_export, name='teacher-export'),
+    path('export/', views.district_export, name='district-export'),
+
     path('classrooms/create', views.classroom_create, name='classroom-create'),
     path('classrooms/<int:classroom_id>/update/', views.classroom_update, name='classroom-update'),
     path('classrooms/<int:classroom_id>/delete/', views.classroom_delete, name='classroom-delete'),
+    path('classrooms/<int:classroom_id>/restore/', views.classroom_restore, name='classroom-restore'),
+
+    path('classrooms/<int:classroom_id>/leaderboard/', views.classroom_leaderboard, name='classroom-leaderboard'),
+    path('years/<int:year>/leaderboard/', views.year_leaderboard, name='year-leaderboard'),
+
+    path('analytics/', views.grade_analytics, name='grade-analytics'),
+    path('search/', views.search, name='search'),
+
+    path('cache/stats/', views.fragment_cache_stats, name='fragment-cache-stats'),
+    path('metrics/', views.metrics, name='metrics'),
+
+    path('api/classrooms/', api.classroom_list, name='api-classroom-list'),
+    path('api/classrooms/<int:classroom_id>/', api.classroom_detail, name='api-classroom-detail'),
+    path('api/classrooms/<int:classroom_id>/students/', api.classroom_students, name='api-classroom-students'),
+    path('api/classrooms/<int:classroom_id>/grades/', api.classroom_grades, name='api-classroom-grades'),
+    path('api/students/<int:student_id>/', api.student_detail, name='api-student-detail'),
+    path('api/jobs/<int:job_id>/', api.job_detail, name='api-job-detail'),
+    path('api/jobs/<int:job_id>/download/', api.job_download, name='api-job-download'),
 
     path('signup/', views.signup, name='signup'),
     path('signin/', views.signin, name='signin'),
     path('signout/', views.signout, name='signout'),
 
     path('classroom/<int:classroom_id>/student/add/', views.student_add, name='student-add'),
+    path('classroom/<int:classroom_id>/student/import/', views.student_import, name='student-import'),
+    path('classroom/<int:classroom_id>/student/grades/', views.student_grades, name='student-grades'),
     path('student/<int:student_id>/<int:classroom_id>/update/', views.student_update, name='student-update'),
     path('student/<int:student_id>/<int:classroom_id>/delete/', views.student_delete, name='student-delete'),
 ]